@@ -0,0 +1,148 @@
+"""
+Рассылка сообщения администратора всем пользователям.
+
+Пользователи читаются порциями по id (в памяти не больше одной порции), сообщения идут
+через ограниченную очередь и общий ограничитель частоты (app.sender.fan_out). Курсор
+и счётчики сохраняются в job_checkpoints после каждой порции; незавершённые рассылки
+продолжаются при запуске бота.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from aiogram import Bot
+
+from app.sender import fan_out
+from config.base import settings
+from db.repository import JobCheckpointRepository, UserRepository
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PREFIX = "broadcast:"
+# Не чаще одного сообщения о прогрессе за столько секунд
+PROGRESS_INTERVAL = 5.0
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_background_tasks: set[asyncio.Task] = set()
+
+
+def format_broadcast_stats(stats: Counter) -> str:
+    return (
+        f"✅ Доставлено: {stats['delivered']}\n"
+        f"🚫 Заблокировали бота: {stats['blocked']}\n"
+        f"❌ Ошибок: {stats['failed']}"
+    )
+
+
+async def _broadcast_batches(session_factory, cursor: int, text: str) -> AsyncIterator[tuple[int, list[tuple[int, str]]]]:
+    while True:
+        async with session_factory() as session:
+            users = await UserRepository(session).get_chat_batch(cursor, settings.fan_out_batch_size)
+        if not users:
+            return
+        cursor = users[-1][0]
+        yield cursor, [(chat_id, text) for _, chat_id in users]
+
+
+async def create_broadcast(session_factory, text: str, admin_chat_id: int) -> str:
+    """Сохраняет рассылку и возвращает её имя в job_checkpoints"""
+    name = f"{CHECKPOINT_PREFIX}{datetime.now().strftime('%Y%m%d%H%M%S')}:{admin_chat_id}"
+    async with session_factory() as session:
+        await JobCheckpointRepository(session).create(name, json.dumps({"text": text, "admin_chat_id": admin_chat_id}))
+    return name
+
+
+async def run_broadcast(
+    bot: Bot,
+    session_factory,
+    name: str,
+    progress: Optional[Callable[[Counter], Awaitable[None]]] = None,
+) -> Counter:
+    """Отправляет рассылку с сохранённого курсора"""
+    async with session_factory() as session:
+        checkpoint = await JobCheckpointRepository(session).get(name)
+    stats = Counter(delivered=checkpoint.delivered, blocked=checkpoint.blocked, failed=checkpoint.failed)
+    if checkpoint.finished_at is not None:
+        return stats
+    text = json.loads(checkpoint.payload)["text"]
+    cursor = checkpoint.cursor
+
+    async def save_checkpoint(batch_cursor: int, batch_stats: Counter):
+        nonlocal cursor
+        cursor = batch_cursor
+        async with session_factory() as session:
+            await JobCheckpointRepository(session).advance(name, cursor, batch_stats)
+        if progress is not None:
+            await progress(batch_stats)
+
+    await fan_out(
+        bot,
+        _broadcast_batches(session_factory, cursor, text),
+        settings.fan_out_workers,
+        on_batch_sent=save_checkpoint,
+        stats=stats,
+        parse_mode="HTML",
+    )
+    async with session_factory() as session:
+        await JobCheckpointRepository(session).advance(name, cursor, stats, finished=True)
+    logger.info(f"Рассылка {name} завершена: {dict(stats)}")
+    return stats
+
+
+async def _run_with_report(bot: Bot, session_factory, name: str, admin_chat_id: int, progress_message_id: Optional[int]):
+    """Фоновая рассылка с отчётом администратору"""
+    last_report = time.monotonic()
+
+    async def report(stats: Counter):
+        nonlocal last_report
+        if progress_message_id is None or time.monotonic() - last_report < PROGRESS_INTERVAL:
+            return
+        last_report = time.monotonic()
+        try:
+            await bot.edit_message_text(
+                f"⏳ Рассылка идёт...\n\n{format_broadcast_stats(stats)}",
+                chat_id=admin_chat_id,
+                message_id=progress_message_id,
+            )
+        except Exception:
+            pass
+
+    try:
+        stats = await run_broadcast(bot, session_factory, name, progress=report)
+        text = f"📢 <b>Рассылка завершена</b>\n\n{format_broadcast_stats(stats)}"
+    except Exception:
+        logger.exception(f"Ошибка рассылки {name}")
+        text = "❌ Рассылка прервана из-за ошибки, она продолжится после перезапуска бота"
+    try:
+        await bot.send_message(admin_chat_id, text, parse_mode="HTML")
+    except Exception:
+        logger.exception(f"Не удалось отправить отчёт о рассылке {name}")
+
+
+def start_broadcast_task(
+    bot: Bot, session_factory, name: str, admin_chat_id: int, progress_message_id: Optional[int]
+) -> None:
+    task = asyncio.create_task(_run_with_report(bot, session_factory, name, admin_chat_id, progress_message_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def resume_broadcasts(bot: Bot, session_factory) -> None:
+    """Продолжает рассылки, прерванные перезапуском бота"""
+    async with session_factory() as session:
+        unfinished = await JobCheckpointRepository(session).get_unfinished(CHECKPOINT_PREFIX)
+    for checkpoint in unfinished:
+        admin_chat_id = json.loads(checkpoint.payload)["admin_chat_id"]
+        logger.info(f"Продолжаю рассылку {checkpoint.name} с пользователя id>{checkpoint.cursor}")
+        try:
+            message = await bot.send_message(admin_chat_id, "⏳ Продолжаю прерванную рассылку...")
+            progress_message_id = message.message_id
+        except Exception:
+            logger.exception(f"Не удалось уведомить администратора о рассылке {checkpoint.name}")
+            progress_message_id = None
+        start_broadcast_task(bot, session_factory, checkpoint.name, admin_chat_id, progress_message_id)
@@ -0,0 +1,69 @@
+"""
+Фоновая дозапись строк в файл (записанные апдейты, трассы).
+
+Строки копятся в памяти и раз в interval секунд дописываются в файл из отдельного потока,
+поэтому обработка апдейта не ждёт диск. Если диск не успевает и в памяти уже max_pending строк,
+новые строки пропускаются, а их число пишется в журнал при следующем сбросе.
+"""
+
+import asyncio
+import gzip
+import logging
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Больше строк в памяти не держим: при отставании диска новые пропускаются
+MAX_PENDING = 10_000
+
+
+class BufferedFileWriter:
+    def __init__(self, path: str, what: str, interval: float, compress: bool = False, max_pending: int = MAX_PENDING):
+        """what — что пишется, в родительном падеже, для сообщений журнала ("апдейтов", "трасс")"""
+        self.path = path
+        self.what = what
+        self.interval = interval
+        self.compress = compress
+        self.max_pending = max_pending
+        self._pending: list[str] = []
+        self._dropped = 0
+        self._task: Optional[asyncio.Task] = None
+        self._write_lock = asyncio.Lock()
+
+    def add(self, make_line: Callable[[], str]) -> None:
+        """Добавить строку; make_line вызывается, только если в буфере есть место"""
+        if len(self._pending) < self.max_pending:
+            self._pending.append(make_line())
+        else:
+            self._dropped += 1
+
+    def _write(self, lines: list[str]) -> None:
+        # gzip на дозапись добавляет новый gzip-член, файл читается обычным gzip.open
+        opener = gzip.open if self.compress else open
+        with opener(self.path, "at", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    async def flush(self) -> None:
+        async with self._write_lock:
+            lines, self._pending = self._pending, []
+            if lines:
+                await asyncio.to_thread(self._write, lines)
+        if self._dropped:
+            logger.warning(f"Запись {self.what} не успевает, пропущено: {self._dropped}")
+            self._dropped = 0
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception(f"Ошибка записи {self.what} в {self.path}")
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        await self.flush()
@@ -0,0 +1,192 @@
+"""
+Пакетный расчёт оценочной энергетической потребности (ОЭП) для когорт пациентов.
+
+Формулы те же, что в чате (app/handlers/calories.py), но считаются векторно
+по столбцам pandas/NumPy и потоково по частям файла.
+"""
+
+import os
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from app.handlers.calories import _get_activity_coefficient_from_callback
+
+ACTIVITY_LEVELS = ("sedentary", "low", "medium", "high")
+
+# Коэффициенты активности берём из обработчика чата, чтобы значения совпадали
+ACTIVITY_COEFFICIENTS = {
+    (gender, level): _get_activity_coefficient_from_callback(f"cal_act_{gender}_{level}")
+    for gender in ("male", "female")
+    for level in ACTIVITY_LEVELS
+}
+
+GENDER_ALIASES = {
+    "male": "male",
+    "m": "male",
+    "м": "male",
+    "мальчик": "male",
+    "female": "female",
+    "f": "female",
+    "ж": "female",
+    "девочка": "female",
+}
+
+OUTPUT_COLUMNS = ["mr", "eer", "eer_rounded", "error"]
+
+
+def _label_codes(series: pd.Series, vocabulary: dict[str, int]) -> np.ndarray:
+    """
+    Переводит текстовую колонку в целочисленные коды словаря (-1 — неизвестное значение).
+    Строковые операции выполняются только над уникальными значениями колонки.
+    """
+    cat = series.astype("category")
+    labels = cat.cat.categories.astype(str).str.strip().str.lower()
+    label_codes = np.array([vocabulary.get(label, -1) for label in labels] + [-1], dtype=np.int64)
+    return label_codes[cat.cat.codes.to_numpy()]
+
+
+GENDER_CODES = {alias: (0 if gender == "male" else 1) for alias, gender in GENDER_ALIASES.items()}
+LEVEL_CODES = {level: i for i, level in enumerate(ACTIVITY_LEVELS)}
+
+# Таблица коэффициентов [пол, уровень], последняя строка/столбец — для неизвестных значений
+COEFFICIENT_TABLE = np.full((3, len(ACTIVITY_LEVELS) + 1), np.nan)
+for (_gender, _level), _value in ACTIVITY_COEFFICIENTS.items():
+    COEFFICIENT_TABLE[0 if _gender == "male" else 1, LEVEL_CODES[_level]] = _value
+
+ERROR_MESSAGES = np.array(
+    [
+        "",
+        "unknown gender",
+        "age_years out of range",
+        "age_months out of range",
+        "weight_kg out of range",
+        "height_cm out of range",
+        "unknown activity",
+    ],
+    dtype=object,
+)
+
+
+def _numeric(df: pd.DataFrame, column: str) -> np.ndarray:
+    return pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def calc_eer_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Считает МР и ОЭП для каждой строки.
+
+    Ожидаемые колонки: gender, age_years, weight_kg, height_cm и activity
+    (sedentary/low/medium/high) либо activity_coef; age_months — для детей до года.
+    Строки с некорректными данными получают пустой результат и описание в колонке error.
+    """
+    n = len(df)
+    gender = _label_codes(df["gender"], GENDER_CODES)
+    age = _numeric(df, "age_years")
+    months = np.nan_to_num(_numeric(df, "age_months")) if "age_months" in df else np.zeros(n)
+    weight = _numeric(df, "weight_kg")
+    height = _numeric(df, "height_cm")
+
+    if "activity_coef" in df:
+        coef = _numeric(df, "activity_coef")
+    else:
+        level = _label_codes(df["activity"], LEVEL_CODES)
+        coef = COEFFICIENT_TABLE[gender, level]
+
+    # Те же ограничения, что при вводе в чате; сравнения с NaN дают False, поэтому проверяем через отрицание
+    with np.errstate(invalid="ignore"):
+        checks = [
+            gender < 0,
+            ~((age >= 0) & (age <= 18) & (age == np.round(age))),
+            (age == 0) & ~((months >= 0) & (months <= 12) & (months == np.round(months))),
+            ~((weight > 0) & (weight <= 400)),
+            ~((height > 30) & (height <= 220)),
+            np.isnan(coef),
+        ]
+    error_code = np.zeros(n, dtype=np.int64)
+    for code, mask in enumerate(checks, start=1):
+        error_code[(error_code == 0) & mask] = code
+    valid = error_code == 0
+
+    a = np.where(valid, age, 0).astype(np.int64)
+    mo = np.where(valid, months, 0).astype(np.int64)
+    w = np.where(valid, weight, 0.0)
+    h = np.where(valid, height, 0.0)
+    k = np.where(valid, coef, 0.0)
+    is_male = gender == 0
+
+    # 0-3 мес = 175; 4-6 мес = 56; 7-12 мес = 22; 1-8 лет = 20; 9-18 лет = 25
+    mr = np.select(
+        [(a == 0) & (mo <= 3), (a == 0) & (mo <= 6), a == 0, (a >= 1) & (a <= 8)],
+        [175, 56, 22, 20],
+        default=25,
+    )
+
+    # Порядок операций как в _calc_eer, чтобы результат совпадал бит в бит
+    height_m = h / 100.0
+    eer_young = 89.0 * w - 100.0 + mr
+    eer_male = 88.5 - 61.9 * a + k * (26.7 * w + 903.0 * height_m) + mr
+    eer_female = 135.3 - 30.8 * a + k * (10.0 * w + 934.0 * height_m) + mr
+    eer = np.where(a < 3, eer_young, np.where(is_male, eer_male, eer_female))
+
+    result = pd.DataFrame(index=df.index)
+    result["mr"] = pd.arrays.IntegerArray(mr.astype(np.int64), ~valid)
+    result["eer"] = np.where(valid, eer, np.nan)
+    # np.round, как и round() в чате, округляет половины к чётному
+    result["eer_rounded"] = pd.arrays.IntegerArray(np.round(eer).astype(np.int64), ~valid)
+    result["error"] = ERROR_MESSAGES[error_code]
+    return result
+
+
+def _is_parquet(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in (".parquet", ".pq")
+
+
+def iter_patient_chunks(path: str, chunksize: int = 200_000) -> Iterator[pd.DataFrame]:
+    """Читает CSV или Parquet частями, не загружая файл целиком"""
+    if _is_parquet(path):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Для чтения Parquet установите pyarrow")
+
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+        return
+
+    yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def process_file(input_path: str, output_path: str, chunksize: int = 200_000) -> tuple[int, int]:
+    """
+    Потоково считает ОЭП для файла пациентов и дописывает результат к исходным колонкам.
+    Возвращает (всего строк, строк с ошибками).
+    """
+    total = 0
+    failed = 0
+    parquet_writer = None
+
+    try:
+        for chunk in iter_patient_chunks(input_path, chunksize):
+            result = calc_eer_frame(chunk)
+            out = pd.concat([chunk.drop(columns=OUTPUT_COLUMNS, errors="ignore"), result], axis=1)
+            total += len(out)
+            failed += int((result["error"] != "").sum())
+
+            if _is_parquet(output_path):
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                table = pa.Table.from_pandas(out, preserve_index=False)
+                if parquet_writer is None:
+                    parquet_writer = pq.ParquetWriter(output_path, table.schema)
+                parquet_writer.write_table(table)
+            else:
+                out.to_csv(output_path, mode="w" if total == len(out) else "a", header=total == len(out), index=False)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+
+    return total, failed
@@ -0,0 +1,209 @@
+"""
+Показания непрерывного мониторинга глюкозы (CGM).
+
+Сутки хранятся одной строкой: 288 пятиминутных слотов в int16 (ммоль/л × 100),
+т.е. 576 байт на день вместо 288 строк. Выгрузки сенсоров (LibreView, Dexcom Clarity
+или простой CSV «время;глюкоза») разбираются потоково и накладываются на уже
+загруженные дни.
+"""
+
+import asyncio
+import csv
+from datetime import date, datetime, time, timedelta
+from typing import Iterator, NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.repository import CGMRepository
+
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+# Значения хранятся в сотых долях ммоль/л; 0 означает пропуск
+SCALE = 100
+MGDL_PER_MMOL = 18.0
+
+# Окно для СК_отработки: 4–5 часов после еды, предпочтительно ближе к 4,5 часам
+GLUCOSE_END_WINDOW = (timedelta(hours=4), timedelta(hours=5))
+
+HEADER_SEARCH_LINES = 30
+TIME_KEYWORDS = ("timestamp", "time", "время", "дата")
+# Колонки с глюкозой в порядке приоритета: у Libre исторические значения точнее сканов
+GLUCOSE_KEYWORDS = ("historic glucose", "glucose value", "scan glucose", "glucose", "глюкоза", "сахар")
+TIMESTAMP_FORMATS = (
+    "%Y-%m-%d %H:%M",
+    "%d-%m-%Y %H:%M",
+    "%d.%m.%Y %H:%M",
+    "%d.%m.%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y %I:%M %p",
+)
+
+
+class CGMIngestResult(NamedTuple):
+    readings: int
+    days: int
+    first: Optional[datetime]
+    last: Optional[datetime]
+
+
+def pack_day(slots: np.ndarray) -> bytes:
+    return slots.astype("<i2").tobytes()
+
+
+def unpack_day(payload: bytes) -> np.ndarray:
+    return np.frombuffer(payload, dtype="<i2")
+
+
+def slot_time(day: date, slot: int) -> datetime:
+    return datetime.combine(day, time()) + timedelta(minutes=slot * SLOT_MINUTES)
+
+
+class _TimestampParser:
+    """Определяет формат времени по первой строке и дальше использует только его"""
+
+    def __init__(self):
+        self._format: Optional[str] = None
+
+    def __call__(self, value: str) -> datetime:
+        value = value.strip()
+        if self._format is not None:
+            try:
+                return datetime.strptime(value, self._format)
+            except ValueError:
+                pass
+        try:
+            # ISO с секундами, «T» или смещением пояса; время сенсора считаем местным
+            return datetime.fromisoformat(value).replace(tzinfo=None)
+        except ValueError:
+            pass
+        for fmt in TIMESTAMP_FORMATS:
+            try:
+                parsed = datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            self._format = fmt
+            return parsed
+        raise ValueError(f"Неизвестный формат времени: {value}")
+
+
+def _find_header(rows: list[list[str]]) -> Optional[tuple[int, int, list[int], float]]:
+    """Ищет строку заголовка: (номер строки, колонка времени, колонки глюкозы, множитель единиц)"""
+    for line, row in enumerate(rows):
+        cells = [cell.strip().lower() for cell in row]
+        time_column = next((i for i, c in enumerate(cells) if any(k in c for k in TIME_KEYWORDS)), None)
+        if time_column is None:
+            continue
+
+        glucose_columns: list[int] = []
+        for keyword in GLUCOSE_KEYWORDS:
+            for i, cell in enumerate(cells):
+                if keyword in cell and i not in glucose_columns and i != time_column:
+                    glucose_columns.append(i)
+        if not glucose_columns:
+            continue
+
+        unit_cells = [cells[i] for i in glucose_columns]
+        factor = 1 / MGDL_PER_MMOL if any("mg/dl" in c or "мг/дл" in c for c in unit_cells) else 1.0
+        return line, time_column, glucose_columns, factor
+    return None
+
+
+def parse_cgm_export(path: str) -> Iterator[tuple[datetime, float]]:
+    """Читает выгрузку сенсора и возвращает пары (время, ммоль/л)"""
+    with open(path, encoding="utf-8-sig", newline="") as stream:
+        sample = stream.read(8192)
+        stream.seek(0)
+        delimiter = max((";", ",", "\t"), key=sample.count)
+        reader = csv.reader(stream, delimiter=delimiter)
+
+        head = [row for _, row in zip(range(HEADER_SEARCH_LINES), reader)]
+        header = _find_header(head)
+        if header is None:
+            raise ValueError("Не найдены колонки времени и глюкозы")
+        header_line, time_column, glucose_columns, factor = header
+
+        parse_timestamp = _TimestampParser()
+        width = max(time_column, *glucose_columns) + 1
+        rows = head[header_line + 1 :]
+
+        def all_rows():
+            yield from rows
+            yield from reader
+
+        for row in all_rows():
+            if len(row) < width:
+                continue
+            for column in glucose_columns:
+                raw = row[column].strip()
+                if not raw:
+                    continue
+                try:
+                    value = float(raw.replace(",", ".")) * factor
+                except ValueError:
+                    # «Low»/«High» и служебные строки пропускаем
+                    continue
+                # Файл без единиц в заголовке, но в мг/дл
+                if factor == 1.0 and value > 35:
+                    value /= MGDL_PER_MMOL
+                if 1.0 <= value <= 35.0:
+                    yield parse_timestamp(row[time_column]), value
+                break
+
+
+def _readings_to_days(path: str) -> tuple[dict[date, np.ndarray], CGMIngestResult]:
+    days: dict[date, np.ndarray] = {}
+    count = 0
+    first = last = None
+    for moment, value in parse_cgm_export(path):
+        slots = days.get(moment.date())
+        if slots is None:
+            slots = days[moment.date()] = np.zeros(SLOTS_PER_DAY, dtype=np.int16)
+        slots[(moment.hour * 60 + moment.minute) // SLOT_MINUTES] = round(value * SCALE)
+        count += 1
+        first = moment if first is None or moment < first else first
+        last = moment if last is None or moment > last else last
+    return days, CGMIngestResult(count, len(days), first, last)
+
+
+async def ingest_cgm_file(session: AsyncSession, user_id: int, path: str) -> CGMIngestResult:
+    """Загружает выгрузку сенсора; новые значения заменяют сохранённые в тех же слотах"""
+    days, result = await asyncio.to_thread(_readings_to_days, path)
+    if not days:
+        return result
+
+    from app.glycemic import day_stats_cache
+
+    repo = CGMRepository(session)
+    existing = await repo.get_days(user_id, min(days), max(days), for_update=True)
+    for day, slots in days.items():
+        stored = existing.get(day)
+        if stored is not None:
+            slots = np.where(slots != 0, slots, unpack_day(stored.readings))
+        repo.put_day(user_id, day, pack_day(slots), int(np.count_nonzero(slots)), stored)
+    await session.commit()
+    day_stats_cache.invalidate(user_id, days)
+    return result
+
+
+async def get_readings(session: AsyncSession, user_id: int, start: datetime, end: datetime) -> list[tuple[datetime, float]]:
+    """Показания за период [start, end]"""
+    stored = await CGMRepository(session).get_days(user_id, start.date(), end.date())
+    readings = []
+    for day in sorted(stored):
+        slots = unpack_day(stored[day].readings)
+        for slot in np.flatnonzero(slots):
+            moment = slot_time(day, int(slot))
+            if start <= moment <= end:
+                readings.append((moment, float(slots[slot]) / SCALE))
+    return readings
+
+
+async def find_glucose_end(session: AsyncSession, user_id: int, meal_started_at: datetime) -> Optional[tuple[datetime, float]]:
+    """Показание через 4–5 часов после еды, ближайшее к 4,5 часам (meal_started_at — местное время пользователя без пояса)"""
+    window_start, window_end = (meal_started_at + offset for offset in GLUCOSE_END_WINDOW)
+    readings = await get_readings(session, user_id, window_start, window_end)
+    if not readings:
+        return None
+    target = window_start + (window_end - window_start) / 2
+    return min(readings, key=lambda reading: abs(reading[0] - target))
@@ -0,0 +1,139 @@
+"""
+Итоги недели для пользователей, включивших их командой /digest.
+
+Пользователи обходятся порциями по id; для каждой порции ФЧИ и УК считаются двумя
+агрегирующими запросами на всю порцию, а не по запросу на пользователя. После отправки
+порции курсор сохраняется в job_checkpoints, поэтому прерванная рассылка продолжается
+с того же места (пользователи последней неподтверждённой порции могут получить итоги повторно).
+Незавершённые рассылки досылаются при запуске бота и перед каждой следующей; после ошибки
+отправка повторяется с нарастающей паузой.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator, Optional
+
+from aiogram import Bot
+
+from app.sender import fan_out
+from app.utils import format_date, format_period_stats, get_user_zone
+from config.base import settings
+from db.repository import FCIRepository, JobCheckpointRepository, MealRecordRepository, UserRepository
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_PREFIX = "weekly_digest:"
+# Пауза перед повтором после ошибки: RETRY_BASE_DELAY × 2^(ошибка - 1), но не больше RETRY_MAX_DELAY (секунды)
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 3600
+
+
+def get_digest_week(now: datetime) -> tuple[date, datetime]:
+    """Последний наступивший (или сегодняшний) момент отправки и начало недели перед ним"""
+    send_day = now.date() - timedelta(days=(now.weekday() - settings.weekly_digest_weekday) % 7)
+    return send_day - timedelta(days=7), datetime.combine(send_day, time(settings.weekly_digest_hour), tzinfo=now.tzinfo)
+
+
+def render_digest(week_start: date, fci_stats: Optional[tuple], uk_stats: dict) -> str:
+    """Текст итогов недели; fci_stats — строка FCIRepository.get_period_stats"""
+    week_end = week_start + timedelta(days=6)
+    text = f"📬 <b>Итоги недели {format_date(week_start)} - {format_date(week_end)}</b>\n\n"
+    text += format_period_stats(fci_stats[:4] if fci_stats else None, uk_stats)
+
+    if fci_stats and fci_stats[1] is not None and fci_stats[4] is not None:
+        current, previous = fci_stats[1], fci_stats[4]
+        arrow = "📈" if current > previous else "📉" if current < previous else "➡️"
+        text += f"\n{arrow} ФЧИ к прошлой неделе: {previous:.2f} → {current:.2f} ({(current / previous - 1) * 100:+.1f}%)\n"
+
+    text += "\n🔕 Отключить итоги недели: /digest"
+    return text
+
+
+async def _digest_batches(session_factory, week_start: date, cursor: int) -> AsyncIterator[tuple[int, list[tuple[int, str]]]]:
+    week_end = week_start + timedelta(days=6)
+    while True:
+        async with session_factory() as session:
+            users = await UserRepository(session).get_chat_batch(cursor, settings.fan_out_batch_size, weekly_digest=True)
+            if not users:
+                return
+            user_ids = [user_id for user_id, _ in users]
+            fci_stats = await FCIRepository(session).get_period_stats(
+                user_ids, week_start, week_end, week_start - timedelta(days=7)
+            )
+            uk_stats = await MealRecordRepository(session).get_uk_stats(user_ids, week_start, week_end)
+
+        messages = []
+        for user_id, chat_id in users:
+            fci = fci_stats.get(user_id)
+            # Без записей за неделю итоги не отправляем
+            if user_id in uk_stats or (fci and fci[0]):
+                messages.append((chat_id, render_digest(week_start, fci, uk_stats.get(user_id, {}))))
+        cursor = users[-1][0]
+        yield cursor, messages
+
+
+async def send_weekly_digest(bot: Bot, session_factory, week_start: date) -> Counter:
+    """Отправляет итоги за неделю, начинающуюся week_start; продолжает прерванную отправку"""
+    name = f"{CHECKPOINT_PREFIX}{week_start.isoformat()}"
+    async with session_factory() as session:
+        repo = JobCheckpointRepository(session)
+        checkpoint = await repo.get(name) or await repo.create(name)
+    stats = Counter(delivered=checkpoint.delivered, blocked=checkpoint.blocked, failed=checkpoint.failed)
+    if checkpoint.finished_at is not None:
+        return stats
+
+    cursor = checkpoint.cursor
+    if cursor:
+        logger.info(f"Продолжаю отправку итогов недели {week_start} с пользователя id>{cursor}")
+
+    async def save_checkpoint(batch_cursor: int, batch_stats: Counter):
+        nonlocal cursor
+        cursor = batch_cursor
+        async with session_factory() as session:
+            await JobCheckpointRepository(session).advance(name, cursor, batch_stats)
+
+    await fan_out(
+        bot,
+        _digest_batches(session_factory, week_start, cursor),
+        settings.fan_out_workers,
+        on_batch_sent=save_checkpoint,
+        stats=stats,
+        parse_mode="HTML",
+    )
+    async with session_factory() as session:
+        await JobCheckpointRepository(session).advance(name, cursor, stats, finished=True)
+    logger.info(f"Итоги недели {week_start} отправлены: {dict(stats)}")
+    return stats
+
+
+async def resume_weekly_digests(bot: Bot, session_factory) -> None:
+    """Досылает итоги недель, отправка которых была прервана"""
+    async with session_factory() as session:
+        unfinished = await JobCheckpointRepository(session).get_unfinished(CHECKPOINT_PREFIX)
+    for checkpoint in unfinished:
+        await send_weekly_digest(bot, session_factory, date.fromisoformat(checkpoint.name[len(CHECKPOINT_PREFIX):]))
+
+
+async def run_weekly_digest_loop(bot: Bot, session_factory) -> None:
+    """Раз в неделю отправляет итоги; после перезапуска и после ошибок досылает незавершённые"""
+    zone = get_user_zone(None)
+    failures = 0
+    while True:
+        now = datetime.now(zone)
+        week_start, send_at = get_digest_week(now)
+        try:
+            await resume_weekly_digests(bot, session_factory)
+            if now >= send_at:
+                await send_weekly_digest(bot, session_factory, week_start)
+                send_at += timedelta(days=7)
+        except Exception:
+            # Момент отправки не сдвигается: повтор продолжит ту же неделю с сохранённого курсора
+            failures += 1
+            delay = min(RETRY_BASE_DELAY * 2 ** (failures - 1), RETRY_MAX_DELAY)
+            logger.exception(f"Не удалось отправить итоги недели, повтор через {delay} с")
+            await asyncio.sleep(delay)
+            continue
+        failures = 0
+        await asyncio.sleep((send_at - datetime.now(zone)).total_seconds())
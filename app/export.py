@@ -0,0 +1,318 @@
+"""
+Потоковая выгрузка истории пользователя в CSV (zip-архив) и XLSX.
+
+Данные читаются серверными курсорами порциями по EXPORT_CHUNK_SIZE строк и сразу
+пишутся во временный файл, поэтому расход памяти не зависит от длины истории. Запись
+в файл (сжатие, сохранение книги XLSX) идёт в отдельном потоке, чтобы не задерживать цикл asyncio.
+"""
+
+import asyncio
+import csv
+import io
+import os
+import tempfile
+import time
+import zipfile
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Iterable, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import MealRecord, AdditionalInjection, InsulinRecord, InsulinDose, FCI, MealType, InsulinType
+from app.utils import get_meal_type_name, get_user_zone
+
+EXPORT_CHUNK_SIZE = 1000
+# Не чаще одного сообщения о прогрессе за столько секунд
+PROGRESS_INTERVAL = 2.0
+
+MEAL_HEADERS = [
+    "id",
+    "Дата",
+    "Приём пищи",
+    "СК_старт",
+    "Пауза, мин",
+    "Углеводы основные, г",
+    "Углеводы доп., г",
+    "Белки, г",
+    "Инсулин на еду, ед.",
+    "СК_отработка",
+    "Подколки с коррекцией, ед.",
+    "Подколки (время мин: доза → с коррекцией)",
+    "УК",
+    "Создано",
+]
+INJECTION_HEADERS = ["id приёма пищи", "Дата", "Время от еды, мин", "Доза, ед.", "С коррекцией, ед."]
+INSULIN_HEADERS = ["Дата", "Тип", "Количество, ед.", "Ручной ввод", "Создано"]
+DOSE_HEADERS = ["Время (местное)", "Часовой пояс", "Тип", "Доза (подколки с коррекцией), ед.", "id приёма пищи"]
+FCI_HEADERS = ["Дата", "ФЧИ", "Создано"]
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
+class _SheetWriter(ABC):
+    """Общий интерфейс записи таблиц для CSV-архива и XLSX (методы блокирующие, вызываются через asyncio.to_thread)"""
+
+    @abstractmethod
+    def start_sheet(self, name: str, headers: list[str]) -> None: ...
+
+    @abstractmethod
+    def write_rows(self, rows: Iterable[list]) -> None: ...
+
+    @abstractmethod
+    def close(self) -> None: ...
+
+
+class _CsvZipWriter(_SheetWriter):
+    def __init__(self, path: str):
+        self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        self._stream: Optional[io.TextIOWrapper] = None
+        self._writer = None
+
+    def _close_stream(self) -> None:
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def start_sheet(self, name: str, headers: list[str]) -> None:
+        self._close_stream()
+        # utf-8-sig, чтобы Excel корректно открывал кириллицу
+        self._stream = io.TextIOWrapper(self._zip.open(f"{name}.csv", "w"), encoding="utf-8-sig", newline="")
+        self._writer = csv.writer(self._stream, delimiter=";")
+        self._writer.writerow(headers)
+
+    def write_rows(self, rows: Iterable[list]) -> None:
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        self._close_stream()
+        self._zip.close()
+
+
+class _XlsxWriter(_SheetWriter):
+    def __init__(self, path: str):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise RuntimeError("Для выгрузки в XLSX установите openpyxl")
+
+        self._path = path
+        # write_only: строки сбрасываются на диск, а не держатся в памяти
+        self._workbook = Workbook(write_only=True)
+        self._sheet = None
+
+    def start_sheet(self, name: str, headers: list[str]) -> None:
+        self._sheet = self._workbook.create_sheet(title=name)
+        self._sheet.append(headers)
+
+    def write_rows(self, rows: Iterable[list]) -> None:
+        for row in rows:
+            self._sheet.append(row)
+
+    def close(self) -> None:
+        self._workbook.save(self._path)
+
+
+def _meal_name(value) -> str:
+    return get_meal_type_name(MealType(value))
+
+
+def _insulin_type_name(value) -> str:
+    return "На еду" if InsulinType(value) == InsulinType.FOOD else "Коррекция"
+
+
+def _local_time(ts: datetime, tz: str) -> str:
+    """Момент инъекции по часовому поясу пользователя на тот момент (SQLite возвращает время без пояса, это UTC)"""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(get_user_zone(tz)).isoformat(sep=" ", timespec="minutes")
+
+
+async def _count_rows(session: AsyncSession, user_id: int) -> int:
+    total = 0
+    for model in (MealRecord, InsulinRecord, InsulinDose, FCI):
+        result = await session.execute(select(func.count()).select_from(model).where(model.user_id == user_id))
+        total += result.scalar_one()
+    result = await session.execute(
+        select(func.count())
+        .select_from(AdditionalInjection)
+        .join(MealRecord, AdditionalInjection.meal_record_id == MealRecord.id)
+        .where(MealRecord.user_id == user_id)
+    )
+    return total + result.scalar_one()
+
+
+async def export_user_history(
+    session: AsyncSession,
+    user_id: int,
+    fmt: str,
+    progress: Optional[ProgressCallback] = None,
+) -> str:
+    """
+    Выгружает историю пользователя во временный файл и возвращает путь к нему.
+    fmt: "csv" (zip-архив с CSV на каждую таблицу) или "xlsx". Файл удаляет вызывающий код.
+    """
+    suffix = ".zip" if fmt == "csv" else ".xlsx"
+    fd, path = tempfile.mkstemp(prefix="diabetbot_export_", suffix=suffix)
+    os.close(fd)
+
+    writer: _SheetWriter = _CsvZipWriter(path) if fmt == "csv" else _XlsxWriter(path)
+    total = await _count_rows(session, user_id)
+    done = 0
+    last_report = time.monotonic()
+
+    async def advance(rows: int) -> None:
+        nonlocal done, last_report
+        done += rows
+        if progress is not None and time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            await progress(done, total)
+
+    try:
+        # Приёмы пищи: подколки подтягиваются одним запросом на порцию
+        await asyncio.to_thread(writer.start_sheet, "meals", MEAL_HEADERS)
+        meals = await session.stream(
+            select(MealRecord.__table__)
+            .where(MealRecord.user_id == user_id)
+            .order_by(MealRecord.id)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        async for chunk in meals.partitions():
+            meal_ids = [row.id for row in chunk]
+            injections_result = await session.execute(
+                select(
+                    AdditionalInjection.meal_record_id,
+                    AdditionalInjection.time_from_meal,
+                    AdditionalInjection.dose,
+                    AdditionalInjection.dose_corrected,
+                )
+                .where(AdditionalInjection.meal_record_id.in_(meal_ids))
+                .order_by(AdditionalInjection.meal_record_id, AdditionalInjection.time_from_meal)
+            )
+            injections_by_meal: dict[int, list[str]] = {}
+            for inj in injections_result:
+                injections_by_meal.setdefault(inj.meal_record_id, []).append(
+                    f"{inj.time_from_meal}: {inj.dose:g} → {inj.dose_corrected:.2f}"
+                )
+
+            await asyncio.to_thread(
+                writer.write_rows,
+                (
+                    [
+                        row.id,
+                        row.date.isoformat(),
+                        _meal_name(row.meal_type),
+                        row.glucose_start,
+                        row.pause_time,
+                        row.carbs_main,
+                        row.carbs_additional,
+                        row.proteins,
+                        row.insulin_food,
+                        row.glucose_end,
+                        row.insulin_additional,
+                        "; ".join(injections_by_meal.get(row.id, [])),
+                        round(row.uk_value, 3),
+                        row.created_at.isoformat(sep=" ", timespec="seconds") if row.created_at else None,
+                    ]
+                    for row in chunk
+                ),
+            )
+            await advance(len(chunk))
+
+        await asyncio.to_thread(writer.start_sheet, "injections", INJECTION_HEADERS)
+        injections = await session.stream(
+            select(
+                AdditionalInjection.meal_record_id,
+                MealRecord.date,
+                AdditionalInjection.time_from_meal,
+                AdditionalInjection.dose,
+                AdditionalInjection.dose_corrected,
+            )
+            .join(MealRecord, AdditionalInjection.meal_record_id == MealRecord.id)
+            .where(MealRecord.user_id == user_id)
+            .order_by(AdditionalInjection.id)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        async for chunk in injections.partitions():
+            await asyncio.to_thread(
+                writer.write_rows,
+                (
+                    [r.meal_record_id, r.date.isoformat(), r.time_from_meal, r.dose, r.dose_corrected]
+                    for r in chunk
+                ),
+            )
+            await advance(len(chunk))
+
+        await asyncio.to_thread(writer.start_sheet, "insulin", INSULIN_HEADERS)
+        insulin = await session.stream(
+            select(InsulinRecord.__table__)
+            .where(InsulinRecord.user_id == user_id)
+            .order_by(InsulinRecord.date, InsulinRecord.id)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        async for chunk in insulin.partitions():
+            await asyncio.to_thread(
+                writer.write_rows,
+                (
+                    [
+                        r.date.isoformat(),
+                        _insulin_type_name(r.insulin_type),
+                        r.amount,
+                        "да" if r.is_manual else "нет",
+                        r.created_at.isoformat(sep=" ", timespec="seconds") if r.created_at else None,
+                    ]
+                    for r in chunk
+                ),
+            )
+            await advance(len(chunk))
+
+        await asyncio.to_thread(writer.start_sheet, "insulin_doses", DOSE_HEADERS)
+        doses = await session.stream(
+            select(InsulinDose.__table__)
+            .where(InsulinDose.user_id == user_id)
+            .order_by(InsulinDose.ts, InsulinDose.id)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        async for chunk in doses.partitions():
+            await asyncio.to_thread(
+                writer.write_rows,
+                (
+                    [_local_time(r.ts, r.tz), r.tz, _insulin_type_name(r.insulin_type), r.amount, r.meal_record_id]
+                    for r in chunk
+                ),
+            )
+            await advance(len(chunk))
+
+        await asyncio.to_thread(writer.start_sheet, "fci", FCI_HEADERS)
+        fci = await session.stream(
+            select(FCI.__table__)
+            .where(FCI.user_id == user_id)
+            .order_by(FCI.date, FCI.id)
+            .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        async for chunk in fci.partitions():
+            await asyncio.to_thread(
+                writer.write_rows,
+                (
+                    [
+                        r.date.isoformat(),
+                        round(r.value, 3),
+                        r.created_at.isoformat(sep=" ", timespec="seconds") if r.created_at else None,
+                    ]
+                    for r in chunk
+                ),
+            )
+            await advance(len(chunk))
+
+        await asyncio.to_thread(writer.close)
+    except BaseException:
+        try:
+            await asyncio.to_thread(writer.close)
+        finally:
+            os.remove(path)
+        raise
+
+    if progress is not None:
+        await progress(done, total)
+    return path
@@ -0,0 +1,275 @@
+import csv
+import json
+import logging
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Формат предсобранного файла индекса: сигнатура, длина заголовка (uint32), заголовок JSON
+# (версия, списки строк, описание массивов), затем байты массивов подряд в порядке из заголовка
+INDEX_MAGIC = b"FOODIDX\0"
+INDEX_FORMAT_VERSION = 2
+_ARRAY_FIELDS = ("carbs", "proteins", "fats", "word_food", "trigram_offsets", "postings")
+_LIST_FIELDS = ("names", "words", "trigram_keys")
+# Сколько последних выбранных продуктов помним для каждого пользователя
+RECENT_PER_USER = 20
+# Для скольких пользователей помнить недавние продукты (дольше всех не выбиравшие забываются)
+RECENT_USERS = 10_000
+
+
+class FoodMatch(NamedTuple):
+    food_id: int
+    name: str
+    carbs: float  # Углеводы на 100 г
+    proteins: float  # Белки на 100 г
+    fats: float  # Жиры на 100 г
+
+
+def normalize_food_name(text: str) -> str:
+    """Приводит название продукта к виду для поиска"""
+    text = text.lower().replace("ё", "е")
+    cleaned = "".join(c if c.isalnum() or c == "." else " " for c in text)
+    return " ".join(cleaned.split())
+
+
+def _trigrams(normalized: str) -> set[str]:
+    """Триграммы по словам с границами, как в pg_trgm"""
+    result = set()
+    for word in normalized.split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            result.add(padded[i : i + 3])
+    return result
+
+
+class FoodIndex:
+    """Компактный индекс продуктов: префиксы слов + триграммы на массивах"""
+
+    def __init__(
+        self,
+        names: List[str],
+        carbs: array,
+        proteins: array,
+        fats: array,
+        words: List[str],
+        word_food: array,
+        trigram_keys: List[str],
+        trigram_offsets: array,
+        postings: array,
+    ):
+        self.names = names
+        self.carbs = carbs
+        self.proteins = proteins
+        self.fats = fats
+        # Отсортированные слова названий и id продукта для каждого слова
+        self.words = words
+        self.word_food = word_food
+        # Триграмма -> срез postings[offsets[i]:offsets[i + 1]]
+        self.trigram_keys = trigram_keys
+        self.trigram_offsets = trigram_offsets
+        self.postings = postings
+        self._trigram_pos = {key: i for i, key in enumerate(trigram_keys)}
+        # user_id -> недавние продукты; порядок пользователей — от давно выбиравших к недавним
+        self._recent: OrderedDict[int, OrderedDict[int, None]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def build(cls, rows: List[tuple[str, float, float, float]]) -> "FoodIndex":
+        """Собирает индекс из строк (название, углеводы, белки, жиры) на 100 г"""
+        names: List[str] = []
+        carbs, proteins, fats = array("f"), array("f"), array("f")
+        word_pairs: List[tuple[str, int]] = []
+        trigram_lists: Dict[str, List[int]] = {}
+
+        for food_id, (name, c, p, f) in enumerate(rows):
+            names.append(name)
+            carbs.append(c)
+            proteins.append(p)
+            fats.append(f)
+            normalized = normalize_food_name(name)
+            for word in set(normalized.split()):
+                word_pairs.append((word, food_id))
+            for tri in _trigrams(normalized):
+                trigram_lists.setdefault(tri, []).append(food_id)
+
+        word_pairs.sort()
+        trigram_keys = sorted(trigram_lists)
+        trigram_offsets = array("I", [0])
+        postings = array("I")
+        for key in trigram_keys:
+            postings.extend(trigram_lists[key])
+            trigram_offsets.append(len(postings))
+
+        return cls(
+            names=names,
+            carbs=carbs,
+            proteins=proteins,
+            fats=fats,
+            words=[w for w, _ in word_pairs],
+            word_food=array("I", (food_id for _, food_id in word_pairs)),
+            trigram_keys=trigram_keys,
+            trigram_offsets=trigram_offsets,
+            postings=postings,
+        )
+
+    @classmethod
+    def from_csv(cls, path: str) -> "FoodIndex":
+        """Собирает индекс из CSV с колонками name, carbs, proteins, fats"""
+        rows = []
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                rows.append((row["name"].strip(), float(row["carbs"]), float(row["proteins"]), float(row["fats"])))
+        return cls.build(rows)
+
+    def save(self, path: str) -> None:
+        """Сохраняет предсобранный индекс для быстрой загрузки при старте"""
+        header = {field: getattr(self, field) for field in _LIST_FIELDS}
+        header["version"] = INDEX_FORMAT_VERSION
+        header["byteorder"] = sys.byteorder
+        header["arrays"] = [
+            [field, getattr(self, field).typecode, getattr(self, field).itemsize, len(getattr(self, field))]
+            for field in _ARRAY_FIELDS
+        ]
+        encoded = json.dumps(header, ensure_ascii=False).encode("utf-8")
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(struct.pack("<I", len(encoded)))
+            f.write(encoded)
+            for field in _ARRAY_FIELDS:
+                getattr(self, field).tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "FoodIndex":
+        """Загружает предсобранный индекс (только данные: строки из JSON и массивы чисел)"""
+        with open(path, "rb") as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError("Файл не является индексом продуктов")
+            (header_size,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_size).decode("utf-8"))
+            if header.get("version") != INDEX_FORMAT_VERSION:
+                raise ValueError("Неподдерживаемая версия индекса продуктов")
+
+            fields = {field: header[field] for field in _LIST_FIELDS}
+            for field, typecode, itemsize, length in header["arrays"]:
+                values = array(typecode)
+                if values.itemsize != itemsize:
+                    raise ValueError(f"Размер элемента массива {field} не совпадает с этой платформой")
+                # Обрезанный файл даёт EOFError или ValueError
+                values.fromfile(f, length)
+                if header["byteorder"] != sys.byteorder:
+                    values.byteswap()
+                fields[field] = values
+        return cls(**fields)
+
+    def get(self, food_id: int) -> Optional[FoodMatch]:
+        if food_id < 0 or food_id >= len(self.names):
+            return None
+        return FoodMatch(
+            food_id,
+            self.names[food_id],
+            float(self.carbs[food_id]),
+            float(self.proteins[food_id]),
+            float(self.fats[food_id]),
+        )
+
+    def _prefix_matches(self, prefix: str) -> set[int]:
+        start = bisect_left(self.words, prefix)
+        result = set()
+        for i in range(start, len(self.words)):
+            if not self.words[i].startswith(prefix):
+                break
+            result.add(self.word_food[i])
+        return result
+
+    def search(self, query: str, user_id: int | None = None, limit: int = 8) -> List[FoodMatch]:
+        """Ищет продукты по названию с учётом недавних выборов пользователя"""
+        normalized = normalize_food_name(query)
+        if not normalized:
+            return []
+
+        scores: Dict[int, float] = {}
+
+        # Совпадения по триграммам (устойчиво к опечаткам и словоформам)
+        query_trigrams = _trigrams(normalized)
+        if query_trigrams:
+            for tri in query_trigrams:
+                pos = self._trigram_pos.get(tri)
+                if pos is None:
+                    continue
+                for food_id in self.postings[self.trigram_offsets[pos] : self.trigram_offsets[pos + 1]]:
+                    scores[food_id] = scores.get(food_id, 0.0) + 1.0
+            threshold = max(1.0, len(query_trigrams) * 0.3)
+            scores = {food_id: s / len(query_trigrams) for food_id, s in scores.items() if s >= threshold}
+
+        # Каждое слово запроса как префикс слова в названии
+        for word in normalized.split():
+            for food_id in self._prefix_matches(word):
+                scores[food_id] = scores.get(food_id, 0.0) + 1.0
+
+        if not scores:
+            return []
+
+        # Недавно выбранные пользователем продукты поднимаем выше
+        recent = self._recent.get(user_id) if user_id is not None else None
+        if recent:
+            for rank, food_id in enumerate(reversed(recent)):
+                if food_id in scores:
+                    scores[food_id] += 1.0 / (rank + 1)
+
+        best = sorted(scores, key=lambda food_id: (-scores[food_id], len(self.names[food_id])))[:limit]
+        return [self.get(food_id) for food_id in best]
+
+    def touch(self, user_id: int, food_id: int) -> None:
+        """Запоминает выбор продукта пользователем"""
+        recent = self._recent.get(user_id)
+        if recent is None:
+            recent = self._recent[user_id] = OrderedDict()
+            if len(self._recent) > RECENT_USERS:
+                self._recent.popitem(last=False)
+        else:
+            self._recent.move_to_end(user_id)
+        recent.pop(food_id, None)
+        recent[food_id] = None
+        if len(recent) > RECENT_PER_USER:
+            recent.popitem(last=False)
+
+
+food_index = FoodIndex.build([])
+
+
+def load_food_index(index_path: str, data_path: str) -> FoodIndex:
+    """Загружает индекс из предсобранного файла, при отсутствии собирает его из CSV"""
+    index = None
+    if os.path.exists(index_path) and (
+        not os.path.exists(data_path) or os.path.getmtime(index_path) >= os.path.getmtime(data_path)
+    ):
+        try:
+            index = FoodIndex.load(index_path)
+        except (OSError, ValueError, EOFError, KeyError, TypeError) as e:
+            logger.warning(f"Не удалось загрузить индекс продуктов {index_path}: {e}")
+
+    if index is None:
+        if not os.path.exists(data_path):
+            logger.warning(f"Файл с базой продуктов {data_path} не найден, поиск продуктов отключён")
+            return food_index
+        index = FoodIndex.from_csv(data_path)
+        try:
+            index.save(index_path)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить индекс продуктов {index_path}: {e}")
+
+    # Подменяем содержимое общего индекса, чтобы импортированные ссылки оставались рабочими
+    food_index.__dict__.update(index.__dict__)
+    logger.info(f"Загружен индекс продуктов: {len(food_index)} позиций")
+    return food_index
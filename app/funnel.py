@@ -0,0 +1,126 @@
+"""
+Воронка сценариев FSM (расчёт ФЧИ, расчёт УК и др.): где пользователи тратят время и бросают сценарий.
+
+FunnelMiddleware сообщает о каждом ответе пользователя в состоянии FSM и о каждой смене состояния.
+Для перехода «состояние → следующее состояние» копятся: число переходов, время пользователя
+в состоянии (от входа в него до ответа) и время обработки ответа ботом. Если пользователь не
+отвечает funnel_abandon_minutes минут, сценарий считается брошенным (переход в "abandoned").
+Шаги, на которых пользователь ждёт по сценарию (СК_отработка через glucose_end_reminder_minutes
+после еды), получают этот срок в дополнение к порогу — см. abandon_timeouts().
+Итоги хранятся в памяти и раз в funnel_flush_interval секунд прибавляются к таблице funnel_rollups.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import date
+from typing import Dict, Optional
+
+from app.states import MealStates
+from config.base import settings
+
+logger = logging.getLogger(__name__)
+
+# Вне сценария (до начала или после завершения), отмена и брошенный сценарий
+NO_STATE = "none"
+CANCELLED = "cancelled"
+ABANDONED = "abandoned"
+
+
+class FunnelTracker:
+    def __init__(self):
+        # Текущее состояние пользователя и когда он в него вошёл (time.monotonic)
+        self._entered: Dict[int, tuple[str, float]] = {}
+        # (день, состояние, следующее состояние) -> [переходы, время в состоянии, переходы со временем, время обработки]
+        self._pending: Dict[tuple[date, str, str], list] = {}
+
+    def _add(self, state: str, next_state: str, dwell: Optional[float], server: float) -> None:
+        key = (date.today(), state, next_state)
+        totals = self._pending.get(key)
+        if totals is None:
+            totals = self._pending[key] = [0, 0.0, 0, 0.0]
+        totals[0] += 1
+        if dwell is not None:
+            totals[1] += dwell
+            totals[2] += 1
+        totals[3] += server
+
+    def record(self, user_id: int, state: Optional[str], next_state: Optional[str], server: float, cancelled: bool = False) -> None:
+        """Ответ пользователя в состоянии state, после обработки которого состояние стало next_state"""
+        now = time.monotonic()
+        state = state or NO_STATE
+        if next_state is None:
+            target = CANCELLED if cancelled else NO_STATE
+        else:
+            target = next_state
+
+        dwell = None
+        entered = self._entered.get(user_id)
+        if entered is not None and entered[0] == state:
+            dwell = now - entered[1]
+        self._add(state, target, dwell, server)
+
+        if next_state is None:
+            self._entered.pop(user_id, None)
+        else:
+            # Повторный ответ в том же состоянии (например, ошибка ввода) начинает отсчёт заново
+            self._entered[user_id] = (next_state, now)
+
+    def sweep(self, timeout: float, overrides: Optional[Dict[str, float]] = None) -> None:
+        """
+        Переводит в "abandoned" пользователей, молчащих в состоянии дольше timeout секунд
+        (для состояний из overrides — дольше указанного там срока)
+        """
+        overrides = overrides or {}
+        now = time.monotonic()
+        for user_id, (state, entered_at) in list(self._entered.items()):
+            if now - entered_at > overrides.get(state, timeout):
+                del self._entered[user_id]
+                self._add(state, ABANDONED, None, 0.0)
+
+    async def flush(self, session_factory) -> None:
+        """Прибавить накопленные переходы к таблице funnel_rollups"""
+        from db.repository import FunnelRollupRepository
+
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        try:
+            async with session_factory() as session:
+                repo = FunnelRollupRepository(session)
+                for (day, state, next_state), (transitions, dwell, dwell_count, server) in sorted(pending.items()):
+                    await repo.add(day, state, next_state, transitions, dwell, dwell_count, server)
+                await session.commit()
+        except Exception:
+            # Возвращаем несохранённые итоги, чтобы записать их в следующий раз
+            for key, totals in pending.items():
+                current = self._pending.setdefault(key, [0, 0.0, 0, 0.0])
+                for i, value in enumerate(totals):
+                    current[i] += value
+            raise
+
+
+funnel_tracker = FunnelTracker()
+
+
+def abandon_timeouts() -> Dict[str, float]:
+    """Пороги брошенного сценария (секунды) для состояний, где пользователь ждёт по сценарию"""
+    return {
+        # СК_отработку вводят через glucose_end_reminder_minutes после еды, по напоминанию
+        MealStates.waiting_for_glucose_end.state: (
+            settings.glucose_end_reminder_minutes + settings.funnel_abandon_minutes
+        ) * 60,
+    }
+
+
+async def run_funnel_flush_loop(session_factory, interval: float) -> None:
+    """Периодически отмечает брошенные сценарии и сохраняет итоги воронки в БД"""
+    overrides = abandon_timeouts()
+    while True:
+        await asyncio.sleep(interval)
+        funnel_tracker.sweep(settings.funnel_abandon_minutes * 60, overrides)
+        try:
+            await funnel_tracker.flush(session_factory)
+        except Exception:
+            logger.exception("Не удалось сохранить итоги воронки")
@@ -0,0 +1,180 @@
+"""
+Показатели гликемического контроля по данным CGM: время в диапазоне (TIR),
+GMI, коэффициент вариации и профиль глюкозы по часам.
+
+Для каждого дня считается вектор достаточных статистик (суммы, счётчики по диапазонам,
+суммы по часам). Вектора прошедших дней не меняются и кэшируются, поэтому отчёт
+за 90 дней пересчитывает только сегодняшний день; показатели периода — сумма векторов.
+"""
+
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.cgm import SCALE, SLOTS_PER_DAY, MGDL_PER_MMOL, unpack_day
+from db.repository import CGMRepository
+
+# Границы диапазонов (ммоль/л) по международному консенсусу по TIR
+VERY_LOW = 3.0
+LOW = 3.9
+HIGH = 10.0
+VERY_HIGH = 13.9
+
+SLOTS_PER_HOUR = SLOTS_PER_DAY // 24
+# Раскладка вектора статистик дня
+_N, _SUM, _SUMSQ, _VERY_LOW, _LOW, _IN_RANGE, _HIGH, _VERY_HIGH = range(8)
+_HOURLY_SUM = slice(8, 32)
+_HOURLY_N = slice(32, 56)
+_HOURS_COVERED = 56
+STATS_SIZE = 57
+
+# Сколько дней держать в кэше (≈450 байт на день)
+CACHE_MAX_DAYS = 100_000
+
+
+class GlycemicSummary(NamedTuple):
+    days: int
+    readings: int
+    coverage: float  # Доля часов, за которые есть показания, %
+    mean: float
+    very_low: float  # Доли времени в диапазонах, %
+    low: float
+    in_range: float
+    high: float
+    very_high: float
+    gmi: float
+    cv: float
+    hourly: list[Optional[float]]
+
+
+def day_stats(slots: np.ndarray) -> np.ndarray:
+    """Векторы статистик для матрицы дней × 288 слотов (значения ×SCALE, 0 — пропуск)"""
+    slots = np.atleast_2d(slots)
+    values = slots / SCALE
+    present = slots > 0
+
+    stats = np.zeros((slots.shape[0], STATS_SIZE))
+    stats[:, _N] = present.sum(axis=1)
+    stats[:, _SUM] = values.sum(axis=1)
+    stats[:, _SUMSQ] = (values * values).sum(axis=1)
+    stats[:, _VERY_LOW] = (present & (values < VERY_LOW)).sum(axis=1)
+    stats[:, _LOW] = (present & (values >= VERY_LOW) & (values < LOW)).sum(axis=1)
+    stats[:, _IN_RANGE] = ((values >= LOW) & (values <= HIGH)).sum(axis=1)
+    stats[:, _HIGH] = ((values > HIGH) & (values <= VERY_HIGH)).sum(axis=1)
+    stats[:, _VERY_HIGH] = (values > VERY_HIGH).sum(axis=1)
+
+    by_hour = values.reshape(slots.shape[0], 24, SLOTS_PER_HOUR)
+    stats[:, _HOURLY_SUM] = by_hour.sum(axis=2)
+    stats[:, _HOURLY_N] = present.reshape(slots.shape[0], 24, SLOTS_PER_HOUR).sum(axis=2)
+    # Покрытие считаем по часам: у Libre показания раз в 15 минут, и доля слотов занижала бы его
+    stats[:, _HOURS_COVERED] = (stats[:, _HOURLY_N] > 0).sum(axis=1)
+    return stats
+
+
+def summarize(stats: np.ndarray, days: int) -> Optional[GlycemicSummary]:
+    """Показатели периода по сумме векторов статистик его дней"""
+    total = stats.sum(axis=0) if stats.ndim == 2 else stats
+    n = total[_N]
+    if n == 0:
+        return None
+
+    mean = total[_SUM] / n
+    variance = max(total[_SUMSQ] / n - mean * mean, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hourly = total[_HOURLY_SUM] / total[_HOURLY_N]
+    shares = total[_VERY_LOW : _VERY_HIGH + 1] / n * 100
+
+    return GlycemicSummary(
+        days=days,
+        readings=int(n),
+        coverage=total[_HOURS_COVERED] / (days * 24) * 100,
+        mean=mean,
+        very_low=shares[0],
+        low=shares[1],
+        in_range=shares[2],
+        high=shares[3],
+        very_high=shares[4],
+        # GMI (%) = 3,31 + 0,02392 × средняя глюкоза в мг/дл
+        gmi=3.31 + 0.02392 * mean * MGDL_PER_MMOL,
+        cv=np.sqrt(variance) / mean * 100,
+        hourly=[None if np.isnan(v) else float(v) for v in hourly],
+    )
+
+
+class DayStatsCache:
+    """LRU-кэш статистик прошедших дней; сегодняшний день не кэшируется"""
+
+    def __init__(self, max_days: int = CACHE_MAX_DAYS):
+        self.max_days = max_days
+        self._stats: OrderedDict[tuple[int, date], np.ndarray] = OrderedDict()
+
+    def get(self, user_id: int, day: date) -> Optional[np.ndarray]:
+        stats = self._stats.get((user_id, day))
+        if stats is not None:
+            self._stats.move_to_end((user_id, day))
+        return stats
+
+    def put(self, user_id: int, day: date, stats: np.ndarray) -> None:
+        if day >= date.today():
+            return
+        self._stats[(user_id, day)] = stats
+        self._stats.move_to_end((user_id, day))
+        while len(self._stats) > self.max_days:
+            self._stats.popitem(last=False)
+
+    def invalidate(self, user_id: int, days) -> None:
+        """Сбросить дни, для которых загружены новые показания"""
+        for day in days:
+            self._stats.pop((user_id, day), None)
+
+
+day_stats_cache = DayStatsCache()
+
+
+async def get_glycemic_summary(
+    session: AsyncSession, user_id: int, start_date: date, end_date: date
+) -> Optional[GlycemicSummary]:
+    """Показатели за период; из БД читаются только дни, которых нет в кэше"""
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    cached = {day: day_stats_cache.get(user_id, day) for day in days}
+    missing = [day for day, stats in cached.items() if stats is None]
+
+    if missing:
+        stored = await CGMRepository(session).get_days_in(user_id, missing)
+        if stored:
+            loaded_days = sorted(stored)
+            matrix = np.stack([unpack_day(stored[day].readings) for day in loaded_days])
+            for day, stats in zip(loaded_days, day_stats(matrix)):
+                cached[day] = stats
+                day_stats_cache.put(user_id, day, stats)
+        # Дни без показаний тоже кэшируем, чтобы не запрашивать их снова
+        empty = np.zeros(STATS_SIZE)
+        for day in missing:
+            if cached[day] is None:
+                cached[day] = empty
+                day_stats_cache.put(user_id, day, empty)
+
+    return summarize(np.stack(list(cached.values())), len(days))
+
+
+def format_glycemic_summary(summary: GlycemicSummary) -> str:
+    """Текстовый блок CGM для экранов статистики"""
+    text = "📡 <b>CGM:</b>\n"
+    text += f"• Средняя глюкоза: {summary.mean:.1f} ммоль/л (покрытие {summary.coverage:.0f}%)\n"
+    text += f"• В диапазоне 3,9–10: <b>{summary.in_range:.0f}%</b>\n"
+    text += f"• Ниже 3,9: {summary.low + summary.very_low:.0f}% (ниже 3,0: {summary.very_low:.0f}%)\n"
+    text += f"• Выше 10: {summary.high + summary.very_high:.0f}% (выше 13,9: {summary.very_high:.0f}%)\n"
+    text += f"• GMI: {summary.gmi:.1f}%\n"
+    text += f"• Вариабельность (CV): {summary.cv:.0f}%{' ⚠️' if summary.cv > 36 else ''}\n"
+
+    text += "🕐 <b>Профиль по часам:</b>\n<code>"
+    for first_hour in range(0, 24, 6):
+        values = " ".join(
+            f"{v:4.1f}" if v is not None else "  — " for v in summary.hourly[first_hour : first_hour + 6]
+        )
+        text += f"{first_hour:02d}–{first_hour + 5:02d}: {values}\n"
+    text += "</code>\n"
+    return text
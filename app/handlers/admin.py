@@ -0,0 +1,80 @@
+import logging
+from aiogram import Router, F
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, CallbackQuery
+from aiogram.fsm.context import FSMContext
+from app.broadcast import create_broadcast, start_broadcast_task
+from app.keyboards import get_broadcast_confirm_keyboard, get_main_menu_keyboard
+from app.profiler import profiler, start_profiling_task
+from app.scheduler import reminder_scheduler, REMINDER_GLUCOSE_END
+from app.states import BroadcastStates
+from config.base import settings
+from db.session import async_session
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+# Команды администратора; для остальных пользователей роутер не срабатывает
+router.message.filter(F.from_user.id.in_(settings.admin_ids))
+router.callback_query.filter(F.from_user.id.in_(settings.admin_ids))
+
+
+@router.message(Command("broadcast"))
+async def start_broadcast(message: Message, command: CommandObject, state: FSMContext, user):
+    """Рассылка всем пользователям: /broadcast текст (можно с HTML-разметкой)"""
+    if not command.args:
+        await message.answer(
+            "📢 Отправьте команду с текстом рассылки, например:\n<code>/broadcast Бот обновлён!</code>",
+            parse_mode="HTML",
+        )
+        return
+
+    text = command.args.strip()
+    try:
+        # Предпросмотр заодно проверяет HTML-разметку
+        await message.answer(text, parse_mode="HTML")
+    except Exception as e:
+        await message.answer(f"❌ Не удалось отправить текст: {e}")
+        return
+
+    await reminder_scheduler.cancel(user.id, REMINDER_GLUCOSE_END)
+    await state.set_state(BroadcastStates.waiting_for_confirmation)
+    await state.update_data(broadcast_text=text)
+    await message.answer("👆 Так сообщение увидят пользователи. Отправить всем?", reply_markup=get_broadcast_confirm_keyboard())
+
+
+@router.callback_query(BroadcastStates.waiting_for_confirmation, F.data == "broadcast_confirm")
+async def confirm_broadcast(callback: CallbackQuery, state: FSMContext):
+    """Подтверждение рассылки"""
+    data = await state.get_data()
+    await state.clear()
+    await callback.answer()
+
+    name = await create_broadcast(async_session, data["broadcast_text"], callback.from_user.id)
+    logger.info(f"Администратор {callback.from_user.id} запустил рассылку {name}")
+    await callback.message.edit_text("⏳ Рассылка запущена...")
+    start_broadcast_task(callback.bot, async_session, name, callback.from_user.id, callback.message.message_id)
+    await callback.message.answer("👇 Выберите нужное действие в меню ниже", reply_markup=get_main_menu_keyboard())
+
+
+@router.message(Command("profile"))
+async def start_profiling(message: Message, command: CommandObject):
+    """Профилирование: /profile [секунды] [telegram_id пользователя]"""
+    args = (command.args or "").split()
+    try:
+        seconds = int(args[0]) if args else 30
+        user_id = int(args[1]) if len(args) > 1 else None
+    except ValueError:
+        await message.answer("❌ Формат: <code>/profile [секунды] [telegram_id]</code>", parse_mode="HTML")
+        return
+    if not 1 <= seconds <= settings.profile_max_seconds:
+        await message.answer(f"❌ Длительность — от 1 до {settings.profile_max_seconds} секунд")
+        return
+    if profiler.running:
+        await message.answer("⏳ Профилирование уже идёт, дождитесь отчёта")
+        return
+
+    scope = f"апдейты пользователя {user_id}" if user_id is not None else "все апдейты"
+    logger.info(f"Администратор {message.from_user.id} запустил профилирование на {seconds} с ({scope})")
+    start_profiling_task(message.bot, message.chat.id, seconds, user_id)
+    await message.answer(f"🔬 Профилирую {seconds} с, {scope}. Отчёт придёт в этот чат.")
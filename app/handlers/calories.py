@@ -2,6 +2,7 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from app.states import CaloriesStates
+from app.scheduler import reminder_scheduler, REMINDER_GLUCOSE_END
 from app.keyboards import (
     get_calories_gender_keyboard,
     get_calories_activity_keyboard,
@@ -85,8 +86,9 @@ def _calc_eer(
 
 
 @router.message(F.text == "🔥 Расчет калорий")
-async def calories_entry(message: Message, state: FSMContext):
+async def calories_entry(message: Message, state: FSMContext, user):
     await state.clear()
+    await reminder_scheduler.cancel(user.id, REMINDER_GLUCOSE_END)
     await state.set_state(CaloriesStates.waiting_for_gender)
     await message.answer(
         "<b>Расчет калорий</b>\n\nВыберите пол:",
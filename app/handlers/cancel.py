@@ -2,14 +2,17 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 from app.keyboards import get_main_menu_keyboard
+from app.scheduler import reminder_scheduler, REMINDER_GLUCOSE_END
 
 router = Router()
 
 
 @router.callback_query(F.data == "cancel_input")
-async def cancel_input(callback: CallbackQuery, state: FSMContext):
+async def cancel_input(callback: CallbackQuery, state: FSMContext, user):
     """Отмена ввода данных"""
     await state.clear()
+    # Иначе после перезапуска напоминание восстановит отменённый расчёт УК
+    await reminder_scheduler.cancel(user.id, REMINDER_GLUCOSE_END)
     await callback.message.answer("❌ Ввод отменён\n👇 Выберите нужное действие в меню ниже", reply_markup=get_main_menu_keyboard())
     await callback.message.delete()
     await callback.answer()
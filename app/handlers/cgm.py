@@ -0,0 +1,91 @@
+import logging
+import os
+import tempfile
+from typing import Optional
+from aiogram import Router, F
+from aiogram.filters import Command
+from aiogram.types import Message
+from aiogram.fsm.context import FSMContext
+from app.cgm import ingest_cgm_file, CGMIngestResult
+from app.keyboards import get_cancel_keyboard, get_main_menu_keyboard
+from app.states import CGMStates
+from app.scheduler import reminder_scheduler, REMINDER_GLUCOSE_END
+from db.session import async_session
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+# Ограничение Bot API на скачивание файлов
+MAX_CGM_FILE_SIZE = 20 * 1024 * 1024
+
+CGM_HELP_TEXT = """
+📡 <b>Загрузка данных CGM</b>
+
+Пришлите выгрузку сенсора CSV-файлом: LibreView, Dexcom Clarity
+или простую таблицу с колонками «время» и «глюкоза» (ммоль/л или мг/дл).
+
+После загрузки при расчёте УК можно будет взять СК_отработку из CGM —
+показание через 4–5 часов после еды.
+"""
+
+
+async def save_cgm_document(message: Message, user) -> Optional[CGMIngestResult]:
+    """Скачивает и загружает выгрузку CGM; при ошибке сообщает пользователю и возвращает None"""
+    document = message.document
+    if document.file_size and document.file_size > MAX_CGM_FILE_SIZE:
+        await message.answer("❌ Файл больше 20 МБ. Выгрузите данные за меньший период.")
+        return None
+
+    fd, path = tempfile.mkstemp(prefix="diabetbot_cgm_", suffix=".csv")
+    os.close(fd)
+    try:
+        await message.bot.download(document, destination=path)
+        async with async_session() as session:
+            result = await ingest_cgm_file(session, user.id, path)
+    except (ValueError, UnicodeDecodeError) as e:
+        await message.answer(f"❌ Не удалось разобрать выгрузку: {e}")
+        return None
+    except Exception:
+        logger.exception(f"Ошибка загрузки CGM для пользователя {user.id}")
+        await message.answer("❌ Не удалось загрузить файл. Попробуйте позже.")
+        return None
+    finally:
+        os.remove(path)
+
+    if not result.readings:
+        await message.answer("❌ В файле не найдено ни одного показания глюкозы")
+        return None
+    return result
+
+
+@router.message(Command("cgm"))
+async def start_cgm_upload(message: Message, state: FSMContext, user):
+    """Начало загрузки данных CGM"""
+    await reminder_scheduler.cancel(user.id, REMINDER_GLUCOSE_END)
+    await state.set_state(CGMStates.waiting_for_file)
+    await message.answer(CGM_HELP_TEXT, parse_mode="HTML", reply_markup=get_cancel_keyboard())
+
+
+@router.message(CGMStates.waiting_for_file, F.document)
+async def process_cgm_file(message: Message, state: FSMContext, user):
+    """Получение выгрузки CGM"""
+    result = await save_cgm_document(message, user)
+    if result is None:
+        return
+
+    await state.clear()
+    text = f"""
+✅ <b>Данные CGM загружены</b>
+
+📈 Показаний: {result.readings}
+📅 Дней: {result.days}
+🕐 Период: {result.first.strftime('%d.%m.%Y %H:%M')} — {result.last.strftime('%d.%m.%Y %H:%M')}
+"""
+    await message.answer(text, parse_mode="HTML", reply_markup=get_main_menu_keyboard())
+
+
+@router.message(CGMStates.waiting_for_file)
+async def process_cgm_not_file(message: Message):
+    """Вместо файла пришло что-то другое"""
+    await message.answer("📎 Пришлите выгрузку CGM файлом", reply_markup=get_cancel_keyboard())
@@ -0,0 +1,56 @@
+import os
+from datetime import date
+from aiogram import Router, F
+from aiogram.types import CallbackQuery, FSInputFile
+from app.export import export_user_history
+from app.jobs import job_queue, JobContext
+from db.session import async_session
+
+router = Router()
+
+# Тип задачи в очереди
+EXPORT_JOB = "export"
+
+
+async def run_export_job(ctx: JobContext):
+    """Выгрузка истории (задача очереди "export")"""
+
+    async def report(done: int, total: int):
+        percent = int(done * 100 / total) if total else 100
+        await ctx.progress(f"⏳ Готовлю выгрузку... {percent}% ({done} из {total} записей)")
+
+    fmt = ctx.payload["fmt"]
+    path = None
+    try:
+        async with async_session() as session:
+            path = await export_user_history(session, ctx.job.user_id, fmt, progress=report)
+
+        extension = "zip" if fmt == "csv" else "xlsx"
+        filename = f"diabetbot_{date.today().strftime('%Y%m%d')}.{extension}"
+        await ctx.bot.send_document(
+            ctx.job.chat_id,
+            FSInputFile(path, filename=filename),
+            caption="📤 Ваша история: приёмы пищи, подколки, инсулин и ФЧИ",
+        )
+        await ctx.finish("✅ Выгрузка готова")
+    finally:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+
+@router.callback_query(F.data.in_({"export_csv", "export_xlsx"}))
+async def start_export(callback: CallbackQuery, user):
+    """Запуск выгрузки истории"""
+    if await job_queue.has_active(user.id, EXPORT_JOB):
+        await callback.answer("⏳ Выгрузка уже готовится", show_alert=True)
+        return
+
+    fmt = "csv" if callback.data == "export_csv" else "xlsx"
+    progress_message = await callback.bot.send_message(callback.from_user.id, "⏳ Готовлю выгрузку...")
+    await callback.answer()
+    job_id = await job_queue.enqueue(
+        EXPORT_JOB, user.id, callback.from_user.id, fmt=fmt, progress_message_id=progress_message.message_id
+    )
+    if job_id is None:
+        # Другая выгрузка поставлена в очередь между проверкой и этим запросом
+        await progress_message.edit_text("⏳ Выгрузка уже готовится")
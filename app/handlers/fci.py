@@ -2,6 +2,7 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from app.states import FCIStates
+from app.scheduler import reminder_scheduler, REMINDER_GLUCOSE_END
 from app.keyboards import (
     get_main_menu_keyboard,
     get_cancel_keyboard,
@@ -14,8 +15,12 @@ from app.utils import (
     calculate_fci,
     parse_number_input,
     get_insulin_for_fci,
+    get_insulin_for_fci_days,
+    get_user_zone,
+    format_fci_window,
+    save_fci,
 )
-from db.repository import FCIRepository, InsulinRecordRepository
+from db.repository import InsulinRecordRepository
 from db.models import InsulinType
 from db.session import async_session
 
@@ -25,20 +30,19 @@ router = Router()
 @router.message(F.text == "📊 Рассчитать ФЧИ")
 async def start_fci_calculation(message: Message, state: FSMContext, user):
     """Начало расчёта ФЧИ"""
+    await reminder_scheduler.cancel(user.id, REMINDER_GLUCOSE_END)
     day1, day2, day3 = get_date_suggestions()
 
     async with async_session() as session:
         # Получаем данные с приоритетом: meal_records > manual insulin > auto insulin
-        day1_total = await get_insulin_for_fci(user.id, day1, session)
-        day2_total = await get_insulin_for_fci(user.id, day2, session)
-        day3_total = await get_insulin_for_fci(user.id, day3, session)
+        totals = await get_insulin_for_fci_days(user.id, [day1, day2, day3], session, get_user_zone(user.timezone))
+        day1_total, day2_total, day3_total = totals[day1], totals[day2], totals[day3]
 
         # Если есть данные за все три дня, сразу переходим к расчёту
         if day1_total > 0 and day2_total > 0 and day3_total > 0:
             fci_value = calculate_fci(day1_total, day2_total, day3_total)
 
-            fci_repo = FCIRepository(session)
-            await fci_repo.update_or_create(user_id=user.id, date=day1, value=fci_value)
+            await save_fci(user.id, day1, fci_value, session)
 
             result_text = f"""
 🎉 <b>Расчёт ФЧИ завершён!</b>
@@ -74,7 +78,7 @@ async def start_fci_calculation(message: Message, state: FSMContext, user):
             text = f"""
 📊 <b>Расчёт ФЧИ (формула чувствительности к инсулину)</b>
 
-Мне нужно собрать данные о количестве ультракороткого инсулина на еду и коррекции (сколы) с 8:00 до 24:00 за три дня:
+Мне нужно собрать данные о количестве ультракороткого инсулина на еду и коррекции (сколы) {format_fci_window()} за три дня:
 
 • <b>Вчера</b> ({format_date(day1)})
 • <b>Позавчера</b> ({format_date(day2)})
@@ -197,7 +201,7 @@ async def process_day2_input(message: Message, state: FSMContext, user):
 
         # Проверяем, есть ли данные для day3
         async with async_session() as session:
-            day3_total = await get_insulin_for_fci(user.id, data["day3_date"], session)
+            day3_total = await get_insulin_for_fci(user.id, data["day3_date"], session, get_user_zone(user.timezone))
 
         if day3_total > 0:
             # Есть данные за day3, можно сразу рассчитать ФЧИ
@@ -205,8 +209,7 @@ async def process_day2_input(message: Message, state: FSMContext, user):
             fci_value = calculate_fci(day1_value, day2_value, day3_total)
 
             async with async_session() as session:
-                fci_repo = FCIRepository(session)
-                await fci_repo.update_or_create(user_id=user.id, date=data["day1_date"], value=fci_value)
+                await save_fci(user.id, data["day1_date"], fci_value, session)
 
             result_text = f"""
 🎉 <b>Расчёт ФЧИ завершён!</b>
@@ -262,7 +265,6 @@ async def process_day3_input(message: Message, state: FSMContext, user):
         # Сохраняем данные третьего дня в БД
         async with async_session() as session:
             insulin_repo = InsulinRecordRepository(session)
-            fci_repo = FCIRepository(session)
 
             # Сохраняем инсулин за третий день как ручной ввод
             await insulin_repo.create(
@@ -275,7 +277,7 @@ async def process_day3_input(message: Message, state: FSMContext, user):
 
             # Рассчитываем и сохраняем ФЧИ
             fci_value = calculate_fci(day1_value, day2_value, day3_value)
-            await fci_repo.update_or_create(user_id=user.id, date=data["day1_date"], value=fci_value)
+            await save_fci(user.id, data["day1_date"], fci_value, session)
 
         result_text = f"""
 🎉 <b>Расчёт ФЧИ завершён!</b>
@@ -466,7 +468,7 @@ async def process_fci_edit_date(message: Message, state: FSMContext, user):
 
         # Получаем текущее значение инсулина за эту дату
         async with async_session() as session:
-            current_insulin = await get_insulin_for_fci(user.id, date_obj, session)
+            current_insulin = await get_insulin_for_fci(user.id, date_obj, session, get_user_zone(user.timezone))
 
         await state.update_data(edit_date=date_obj, current_insulin=current_insulin)
         await state.set_state(FCIStates.waiting_for_edit_value)
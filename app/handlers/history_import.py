@@ -0,0 +1,111 @@
+import html
+import logging
+import os
+import tempfile
+from aiogram import Router, F
+from aiogram.filters import Command
+from aiogram.types import Message
+from aiogram.fsm.context import FSMContext
+from app.importer import import_history, ImportValidationError
+from app.jobs import job_queue, JobContext
+from app.keyboards import get_cancel_keyboard
+from app.scheduler import reminder_scheduler, REMINDER_GLUCOSE_END
+from app.states import ImportStates
+from db.session import async_session
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+# Ограничение Bot API на скачивание файлов
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+# Тип задачи в очереди
+IMPORT_JOB = "import"
+
+IMPORT_HELP_TEXT = """
+📥 <b>Импорт истории из CSV</b>
+
+Пришлите CSV-файл (разделитель «,» или «;»). Обязательные колонки: <code>type</code> и <code>date</code>
+(ГГГГ-ММ-ДД или ДД.ММ.ГГГГ). Тип строки задаёт колонка <code>type</code>:
+
+• <b>meal</b> — приём пищи: <code>meal_type</code> (breakfast/lunch/snack/dinner), <code>glucose_start</code>,
+<code>carbs_main</code>, <code>insulin_food</code>, <code>glucose_end</code>; необязательно: <code>pause_time</code>,
+<code>carbs_additional</code>, <code>proteins</code>, <code>fats</code>, <code>insulin_additional</code>, <code>uk_value</code>
+• <b>insulin</b> — инсулин за день: <code>amount</code>, <code>insulin_type</code> (food/correction)
+• <b>fci</b> — ФЧИ за день: <code>value</code>
+
+Если <code>uk_value</code> не указан, УК считается по ФЧИ на дату приёма пищи.
+Файл загружается целиком или не загружается вовсе: при ошибках я покажу, какие строки исправить.
+"""
+
+
+async def run_import_job(ctx: JobContext):
+    """Импорт истории (задача очереди "import"); файл скачивается по file_id в процессе, забравшем задачу"""
+    fd, path = tempfile.mkstemp(prefix="diabetbot_import_", suffix=".csv")
+    os.close(fd)
+
+    async def report(done: int):
+        await ctx.progress(f"⏳ Импортирую... обработано строк: {done}")
+
+    try:
+        await ctx.bot.download(ctx.payload["file_id"], destination=path)
+        with open(path, encoding="utf-8-sig", newline="") as stream:
+            async with async_session() as session:
+                result = await import_history(session, ctx.job.user_id, stream, progress=report)
+
+        text = f"""
+✅ <b>Импорт завершён</b>
+
+🍽️ Приёмов пищи: {result.meals}
+💉 Дней с инсулином: {result.insulin_days}
+📊 Дней с ФЧИ: {result.fci_days}
+"""
+        if result.duplicates:
+            text += f"\n↩️ Пропущено уже сохранённых приёмов пищи: {result.duplicates}"
+        await ctx.finish(text)
+    except ImportValidationError as e:
+        errors = "\n".join(f"• {html.escape(error)}" for error in e.errors)
+        more = f"\n…и ещё {e.error_count - len(e.errors)}" if e.error_count > len(e.errors) else ""
+        await ctx.finish(f"❌ Файл не загружен, ошибок: {e.error_count}\n\n{errors}{more}")
+    except UnicodeDecodeError:
+        await ctx.finish("❌ Не удалось прочитать файл: сохраните его в кодировке UTF-8")
+    finally:
+        os.remove(path)
+
+
+@router.message(Command("import"))
+async def start_import(message: Message, state: FSMContext, user):
+    """Начало импорта истории"""
+    await reminder_scheduler.cancel(user.id, REMINDER_GLUCOSE_END)
+    await state.set_state(ImportStates.waiting_for_file)
+    await message.answer(IMPORT_HELP_TEXT, parse_mode="HTML", reply_markup=get_cancel_keyboard())
+
+
+@router.message(ImportStates.waiting_for_file, F.document)
+async def process_import_file(message: Message, state: FSMContext, user):
+    """Получение CSV-файла для импорта"""
+    document = message.document
+    if not (document.file_name or "").lower().endswith(".csv"):
+        await message.answer("❌ Нужен файл с расширением .csv", reply_markup=get_cancel_keyboard())
+        return
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await message.answer("❌ Файл больше 20 МБ. Разделите его на части.", reply_markup=get_cancel_keyboard())
+        return
+    if await job_queue.has_active(user.id, IMPORT_JOB):
+        await message.answer("⏳ Предыдущий импорт ещё выполняется")
+        return
+
+    await state.clear()
+    progress_message = await message.answer("⏳ Проверяю и импортирую файл...")
+    job_id = await job_queue.enqueue(
+        IMPORT_JOB, user.id, message.chat.id, file_id=document.file_id, progress_message_id=progress_message.message_id
+    )
+    if job_id is None:
+        # Другой импорт поставлен в очередь между проверкой и этим запросом
+        await progress_message.edit_text("⏳ Предыдущий импорт ещё выполняется")
+
+
+@router.message(ImportStates.waiting_for_file)
+async def process_import_not_file(message: Message):
+    """Вместо файла пришло что-то другое"""
+    await message.answer("📎 Пришлите CSV-файл документом", reply_markup=get_cancel_keyboard())
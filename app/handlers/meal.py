@@ -1,7 +1,10 @@
-from aiogram import Router, F
+import json
+from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery
+from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
-from datetime import date
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from datetime import date, datetime, timedelta, timezone
 from app.states import MealStates
 from app.keyboards import (
     get_meal_type_keyboard,
@@ -12,6 +15,9 @@ from app.keyboards import (
     get_cancel_keyboard,
     get_skip_proteins_keyboard,
     get_fci_confirmation_keyboard,
+    get_food_matches_keyboard,
+    get_meal_templates_keyboard,
+    get_cgm_glucose_end_keyboard,
 )
 from app.utils import (
     parse_glucose_input,
@@ -22,13 +28,40 @@ from app.utils import (
     get_date_suggestions,
     format_date,
     get_insulin_for_fci,
+    get_insulin_for_fci_days,
+    calculate_z_score,
+    OUTLIER_Z_THRESHOLD,
+    get_user_zone,
+    save_fci,
+)
+from db.repository import (
+    MealRecordRepository,
+    AdditionalInjectionRepository,
+    FCIRepository,
+    MealTemplateRepository,
+    UserMealStatsRepository,
+    CGMRepository,
+    InsulinDoseRepository,
 )
-from db.repository import MealRecordRepository, AdditionalInjectionRepository, FCIRepository
 from db.session import async_session
-from db.models import MealType
+from db.models import MealType, InsulinType
+from app.food_index import food_index
+from app.cgm import find_glucose_end
+from app.quantiles import population_sketches, uk_sketch_key
+from app.handlers.cgm import save_cgm_document
+from app.scheduler import reminder_scheduler, PendingReminder, REMINDER_GLUCOSE_END
+from app.sender import send_message
+from config.base import settings
 
 router = Router()
 
+# Шаги, на которых можно найти продукт по названию: состояние -> food_step
+FOOD_SEARCH_STEPS = {
+    MealStates.waiting_for_carbs_main.state: "carbs_main",
+    MealStates.waiting_for_proteins.state: "proteins",
+    MealStates.waiting_for_fats.state: "fats",
+}
+
 
 async def _safe_edit_or_answer(callback: CallbackQuery, text: str, parse_mode: str | None = None, reply_markup=None):
     msg = callback.message
@@ -54,9 +87,48 @@ async def _safe_edit_or_answer(callback: CallbackQuery, text: str, parse_mode: s
     await callback.answer()
 
 
+def _looks_like_food_name(text: str) -> bool:
+    """Вместо числа введено название продукта"""
+    text = text.strip()
+    return bool(text) and text[0].isalpha()
+
+
+async def _offer_food_matches(message: Message, state: FSMContext, user, step: str):
+    """Поиск продукта по названию и выбор из найденных"""
+    matches = food_index.search(message.text or "", user_id=user.id)
+    if not matches:
+        await message.answer(
+            "🔍 Продукт не найден. Введите другое название или количество в граммах:",
+            reply_markup=get_cancel_keyboard(),
+        )
+        return
+
+    await state.update_data(food_step=step)
+    await message.answer(
+        "🔍 <b>Найденные продукты</b> (БЖУ на 100 г):\n\nВыберите подходящий:",
+        reply_markup=get_food_matches_keyboard(matches),
+        parse_mode="HTML",
+    )
+
+
+async def _ask_insulin_food(message: Message, state: FSMContext, summary: str):
+    """Переход к вводу инсулина на еду"""
+    await state.set_state(MealStates.waiting_for_insulin_food)
+
+    text = f"""
+{summary}
+
+💉 <b>Шаг 7:</b> Введите количество инсулина на еду в единицах:
+    """
+
+    await message.answer(text, reply_markup=get_cancel_keyboard(), parse_mode="HTML")
+
+
 @router.message(F.text == "🍽️ Рассчитать УК")
-async def start_uk_calculation(message: Message, state: FSMContext):
+async def start_uk_calculation(message: Message, state: FSMContext, user):
     """Начало расчёта УК"""
+    # Новый расчёт заменяет незавершённый: его напоминание больше не нужно
+    await reminder_scheduler.cancel(user.id, REMINDER_GLUCOSE_END)
     text = """
 🍽️ <b>Расчёт УК (углеводный коэффициент)</b>
 
@@ -68,7 +140,7 @@ async def start_uk_calculation(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("meal_"))
-async def process_meal_type_selection(callback: CallbackQuery, state: FSMContext):
+async def process_meal_type_selection(callback: CallbackQuery, state: FSMContext, user):
     """Обработка выбора типа приёма пищи"""
     if not callback.data:
         await callback.answer()
@@ -79,15 +151,63 @@ async def process_meal_type_selection(callback: CallbackQuery, state: FSMContext
     await state.update_data(meal_type=meal_type)
     await state.set_state(MealStates.waiting_for_glucose_start)
 
+    async with async_session() as session:
+        templates = await MealTemplateRepository(session).get_top(user.id, meal_type)
+
     text = f"""
 ✅ Выбран: {get_meal_type_name(meal_type)}
 
 📊 <b>Шаг 1:</b> Введите уровень сахара (СК_старт) в ммоль/л на момент ввода инсулина:
     """
 
+    if templates:
+        text += "\n⭐ Или выберите привычный приём пищи — БЖУ и инсулин заполнятся автоматически."
+        await _safe_edit_or_answer(
+            callback, text, parse_mode="HTML", reply_markup=get_meal_templates_keyboard(templates)
+        )
+        return
+
     await _safe_edit_or_answer(callback, text, parse_mode="HTML")
 
 
+@router.callback_query(MealStates.waiting_for_glucose_start, F.data.startswith("tpl_"))
+async def apply_meal_template(callback: CallbackQuery, state: FSMContext, user):
+    """Заполнение данных приёма пищи из шаблона"""
+    if not callback.data:
+        await callback.answer()
+        return
+
+    async with async_session() as session:
+        template = await MealTemplateRepository(session).get(user.id, int(callback.data.split("_")[1]))
+
+    if template is None:
+        await callback.answer("❌ Шаблон не найден", show_alert=True)
+        return
+
+    await state.update_data(
+        pause_time=template.pause_time,
+        carbs_main=template.carbs_main,
+        carbs_additional=template.carbs_additional or 0.0,
+        proteins=template.proteins,
+        fats=template.fats,
+        insulin_food=template.insulin_food,
+        template_applied=True,
+    )
+
+    text = f"""
+⭐ <b>Шаблон применён:</b>
+• Пауза: {template.pause_time or 0} мин.
+• Углеводы: {template.carbs_main:g}г + {template.carbs_additional or 0:g}г
+• Белки: {template.proteins or 0:g}г
+• Жиры: {template.fats or 0:g}г
+• Инсулин на еду: {template.insulin_food:g} ед.
+
+📊 <b>Шаг 1:</b> Введите уровень сахара (СК_старт) в ммоль/л на момент ввода инсулина:
+    """
+
+    await _safe_edit_or_answer(callback, text, parse_mode="HTML", reply_markup=get_cancel_keyboard())
+
+
 @router.message(MealStates.waiting_for_glucose_start)
 async def process_glucose_start(message: Message, state: FSMContext, user):
     """Обработка ввода СК_старт"""
@@ -100,7 +220,21 @@ async def process_glucose_start(message: Message, state: FSMContext, user):
             )
             return
 
-        await state.update_data(glucose_start=glucose_start)
+        # Время еды нужно, чтобы взять СК_отработку из CGM (с поясом: часы сервера могут быть в UTC)
+        await state.update_data(glucose_start=glucose_start, meal_started_at=datetime.now(timezone.utc).isoformat())
+
+        data = await state.get_data()
+        if data.get("template_applied"):
+            # Остальные данные до подколок уже заполнены из шаблона
+            await state.set_state(MealStates.waiting_for_additional_injections)
+            text = f"""
+✅ СК_старт: {glucose_start} ммоль/л
+
+💉 <b>Шаг 8:</b> Были ли дополнительные подколки (коррекции) после еды?
+            """
+            await message.answer(text, reply_markup=get_additional_injection_keyboard(), parse_mode="HTML")
+            return
+
         await state.set_state(MealStates.waiting_for_pause_time)
 
         text = f"""
@@ -134,7 +268,7 @@ async def process_pause_time(message: Message, state: FSMContext, user):
         text = f"""
 ✅ Время паузы: {pause_time} мин.
 
-🍞 <b>Шаг 3:</b> Введите количество углеводов в граммах:
+🍞 <b>Шаг 3:</b> Введите количество углеводов в граммах или название продукта:
         """
 
         await message.answer(text, reply_markup=get_cancel_keyboard(), parse_mode="HTML")
@@ -146,6 +280,10 @@ async def process_pause_time(message: Message, state: FSMContext, user):
 @router.message(MealStates.waiting_for_carbs_main)
 async def process_carbs_main(message: Message, state: FSMContext, user):
     """Обработка ввода основных углеводов"""
+    if _looks_like_food_name(message.text or ""):
+        await _offer_food_matches(message, state, user, step="carbs_main")
+        return
+
     try:
         carbs_main = parse_number_input(message.text or "")
         if carbs_main < 0:
@@ -189,6 +327,14 @@ async def add_additional_carbs(callback: CallbackQuery, state: FSMContext):
 async def skip_additional_carbs(callback: CallbackQuery, state: FSMContext):
     """Пропуск дополнительных углеводов"""
     await state.update_data(carbs_additional=0.0)
+
+    data = await state.get_data()
+    if data.get("food_macros") and callback.message is not None:
+        # Белки и жиры уже заполнены из базы продуктов
+        await callback.answer()
+        await _ask_insulin_food(callback.message, state, "✅ Дополнительные углеводы: 0г")
+        return
+
     await state.set_state(MealStates.waiting_for_proteins)
 
     text = """
@@ -213,6 +359,13 @@ async def process_carbs_additional(message: Message, state: FSMContext, user):
             return
 
         await state.update_data(carbs_additional=carbs_additional)
+
+        data = await state.get_data()
+        if data.get("food_macros"):
+            # Белки и жиры уже заполнены из базы продуктов
+            await _ask_insulin_food(message, state, f"✅ Дополнительные углеводы: {carbs_additional}г")
+            return
+
         await state.set_state(MealStates.waiting_for_proteins)
 
         text = f"""
@@ -256,6 +409,10 @@ async def enter_proteins(callback: CallbackQuery, state: FSMContext):
 @router.message(MealStates.waiting_for_proteins)
 async def process_proteins(message: Message, state: FSMContext, user):
     """Обработка ввода белков"""
+    if _looks_like_food_name(message.text or ""):
+        await _offer_food_matches(message, state, user, step="proteins")
+        return
+
     try:
         proteins = parse_number_input(message.text or "")
         if proteins < 0:
@@ -285,6 +442,10 @@ async def process_proteins(message: Message, state: FSMContext, user):
 @router.message(MealStates.waiting_for_fats)
 async def process_fats(message: Message, state: FSMContext, user):
     """Обработка ввода жиров"""
+    if _looks_like_food_name(message.text or ""):
+        await _offer_food_matches(message, state, user, step="fats")
+        return
+
     try:
         fats = parse_number_input(message.text or "")
         if fats < 0:
@@ -295,19 +456,96 @@ async def process_fats(message: Message, state: FSMContext, user):
             return
 
         await state.update_data(fats=fats)
-        await state.set_state(MealStates.waiting_for_insulin_food)
+        await _ask_insulin_food(message, state, f"✅ Жиры: {fats}г")
 
-        text = f"""
-✅ Жиры: {fats}г
+    except ValueError:
+        await message.answer(
+            "❌ Неверный формат числа. Введите количество жиров (например: 10):", reply_markup=get_cancel_keyboard()
+        )
 
-💉 <b>Шаг 7:</b> Введите количество инсулина на еду в единицах:
-        """
 
-        await message.answer(text, reply_markup=get_cancel_keyboard(), parse_mode="HTML")
+@router.callback_query(StateFilter(*FOOD_SEARCH_STEPS), F.data.startswith("food_"))
+async def process_food_choice(callback: CallbackQuery, state: FSMContext, user, raw_state: str):
+    """Выбор продукта из базы"""
+    if not callback.data:
+        await callback.answer()
+        return
+
+    data = await state.get_data()
+    # Список из поиска на другом шаге (пользователь уже ввёл значение вручную) устарел
+    if data.get("food_step") != FOOD_SEARCH_STEPS[raw_state]:
+        await callback.answer("❌ Этот список устарел, найдите продукт ещё раз", show_alert=True)
+        return
+
+    food = food_index.get(int(callback.data.split("_")[1]))
+    if food is None:
+        await callback.answer("❌ Продукт не найден", show_alert=True)
+        return
+
+    food_index.touch(user.id, food.food_id)
+    await state.update_data(food_id=food.food_id)
+    await state.set_state(MealStates.waiting_for_food_weight)
+
+    text = f"""
+✅ Продукт: {food.name}
+На 100 г: углеводы {food.carbs:g}г, белки {food.proteins:g}г, жиры {food.fats:g}г
+
+⚖️ Введите вес порции в граммах:
+    """
+
+    await _safe_edit_or_answer(callback, text, reply_markup=get_cancel_keyboard())
+
+
+@router.callback_query(F.data.startswith("food_"))
+async def process_stale_food_choice(callback: CallbackQuery):
+    """Кнопка продукта нажата вне шага поиска (после отмены или в другом сценарии)"""
+    await callback.answer("❌ Этот список устарел", show_alert=True)
+
+
+@router.message(MealStates.waiting_for_food_weight)
+async def process_food_weight(message: Message, state: FSMContext, user):
+    """Пересчёт БЖУ выбранного продукта на вес порции"""
+    try:
+        weight = parse_number_input(message.text or "")
+        if weight <= 0:
+            await message.answer("❌ Вес должен быть больше 0. Попробуйте ещё раз:", reply_markup=get_cancel_keyboard())
+            return
+
+        data = await state.get_data()
+        food = food_index.get(data["food_id"])
+        carbs = round(food.carbs * weight / 100, 1)
+        proteins = round(food.proteins * weight / 100, 1)
+        fats = round(food.fats * weight / 100, 1)
+        step = data.get("food_step")
+
+        summary = f"✅ {food.name}, {weight:g} г"
+
+        # Заполняем БЖУ начиная с шага, на котором был поиск
+        if step == "carbs_main":
+            await state.update_data(carbs_main=carbs, proteins=proteins, fats=fats, food_macros=True)
+            await state.set_state(MealStates.waiting_for_carbs_additional)
+
+            text = f"""
+{summary}
+• Углеводы: {carbs}г
+• Белки: {proteins}г
+• Жиры: {fats}г
+
+🍭 <b>Шаг 4:</b> Были ли дополнительные углеводы (сладости, соки и т.д.)?
+            """
+
+            await message.answer(text, reply_markup=get_additional_carbs_keyboard(), parse_mode="HTML")
+        elif step == "proteins":
+            await state.update_data(proteins=proteins, fats=fats)
+            await _ask_insulin_food(message, state, f"{summary}\n• Белки: {proteins}г\n• Жиры: {fats}г")
+        else:
+            await state.update_data(fats=fats)
+            await _ask_insulin_food(message, state, f"{summary}\n• Жиры: {fats}г")
 
     except ValueError:
         await message.answer(
-            "❌ Неверный формат числа. Введите количество жиров (например: 10):", reply_markup=get_cancel_keyboard()
+            "❌ Неверный формат числа. Введите вес порции в граммах (например: 150):",
+            reply_markup=get_cancel_keyboard(),
         )
 
 
@@ -418,8 +656,63 @@ async def process_injection_dose(message: Message, state: FSMContext, user):
         )
 
 
+async def _find_cgm_glucose_end(state: FSMContext, user) -> tuple[float | None, bool]:
+    """СК_отработка из CGM (если есть) и признак того, что у пользователя вообще есть данные CGM"""
+    data = await state.get_data()
+    meal_started_at = data.get("meal_started_at")
+    async with async_session() as session:
+        if not await CGMRepository(session).has_data(user.id):
+            return None, False
+        if not meal_started_at:
+            return None, True
+        # Показания CGM хранятся в местном времени датчика, поэтому время еды переводим в пояс пользователя
+        started = datetime.fromisoformat(meal_started_at).astimezone(get_user_zone(user.timezone)).replace(tzinfo=None)
+        reading = await find_glucose_end(session, user.id, started)
+    return (reading[1] if reading else None), True
+
+
+async def _schedule_glucose_end_reminder(state: FSMContext, user):
+    """Напоминание ввести СК_отработку через заданное время после начала еды"""
+    data = await state.get_data()
+    meal_started_at = data.get("meal_started_at")
+    started = datetime.fromisoformat(meal_started_at).astimezone(timezone.utc) if meal_started_at else datetime.now(timezone.utc)
+    due_at = started + timedelta(minutes=settings.glucose_end_reminder_minutes)
+    if due_at > datetime.now(timezone.utc):
+        # Данные приёма пищи сохраняются с напоминанием: после перезапуска бота хранилище FSM пусто
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        await reminder_scheduler.schedule(user.id, user.telegram_id, REMINDER_GLUCOSE_END, due_at, payload)
+
+
+async def send_glucose_end_reminder(bot: Bot, storage: BaseStorage, reminder: PendingReminder):
+    """Отправка напоминания, если пользователь всё ещё на шаге ввода СК_отработки"""
+    key = StorageKey(bot_id=bot.id, chat_id=reminder.chat_id, user_id=reminder.chat_id)
+    current_state = await storage.get_state(key)
+    if current_state is None:
+        if not reminder.restored:
+            return
+        # Напоминание загружено из БД при запуске: состояние потеряно при перезапуске бота,
+        # восстанавливаем его из данных, сохранённых с напоминанием
+        payload = await reminder_scheduler.get_payload(reminder.id)
+        if payload is None:
+            return
+        await storage.set_state(key, MealStates.waiting_for_glucose_end.state)
+        await storage.set_data(key, json.loads(payload))
+    elif current_state != MealStates.waiting_for_glucose_end.state:
+        return
+
+    hours = settings.glucose_end_reminder_minutes / 60
+    await send_message(
+        bot,
+        reminder.chat_id,
+        f"⏰ Прошло {hours:g} ч после еды — пора измерить сахар.\n\n"
+        "📊 <b>Шаг 9:</b> Введите уровень сахара (СК_отработка) в ммоль/л:",
+        parse_mode="HTML",
+        reply_markup=get_cancel_keyboard(),
+    )
+
+
 @router.callback_query(F.data == "finish_injections")
-async def finish_injections(callback: CallbackQuery, state: FSMContext):
+async def finish_injections(callback: CallbackQuery, state: FSMContext, user):
     """Завершение ввода подколок"""
     data = await state.get_data()
     injections = data.get("additional_injections", [])
@@ -427,6 +720,7 @@ async def finish_injections(callback: CallbackQuery, state: FSMContext):
     total_additional_insulin = sum(inj["corrected_dose"] for inj in injections)
     await state.update_data(insulin_additional=total_additional_insulin)
     await state.set_state(MealStates.waiting_for_glucose_end)
+    await _schedule_glucose_end_reminder(state, user)
 
     text = f"""
 ✅ Подколки завершены. Всего дополнительного инсулина: {total_additional_insulin:.2f} ед.
@@ -434,51 +728,104 @@ async def finish_injections(callback: CallbackQuery, state: FSMContext):
 📊 <b>Шаг 9:</b> Введите уровень сахара (СК_отработка) через 4-5 часов после еды в ммоль/л:
     """
 
-    await _safe_edit_or_answer(callback, text, parse_mode="HTML")
+    cgm_value, has_cgm = await _find_cgm_glucose_end(state, user)
+    if cgm_value is None and has_cgm:
+        text += "\n📡 Когда пройдёт 4-5 часов, можно прислать свежую выгрузку CGM файлом — я возьму значение из неё."
+
+    await _safe_edit_or_answer(
+        callback,
+        text,
+        parse_mode="HTML",
+        reply_markup=get_cgm_glucose_end_keyboard(cgm_value) if cgm_value is not None else None,
+    )
+
+
+@router.message(MealStates.waiting_for_glucose_end, F.document)
+async def process_glucose_end_cgm_file(message: Message, state: FSMContext, user):
+    """Выгрузка CGM на шаге 9: загружаем её и предлагаем СК_отработку"""
+    if await save_cgm_document(message, user) is None:
+        return
+
+    cgm_value, _ = await _find_cgm_glucose_end(state, user)
+    if cgm_value is None:
+        await message.answer(
+            "📡 Данные CGM загружены, но показаний через 4-5 часов после еды в них нет.\n"
+            "Введите СК_отработку вручную в ммоль/л:",
+            reply_markup=get_cancel_keyboard(),
+        )
+        return
+
+    await message.answer(
+        "📡 Данные CGM загружены. Подтвердите СК_отработку или введите её вручную:",
+        reply_markup=get_cgm_glucose_end_keyboard(cgm_value),
+    )
+
+
+@router.callback_query(MealStates.waiting_for_glucose_end, F.data == "cgm_glucose_end")
+async def process_glucose_end_from_cgm(callback: CallbackQuery, state: FSMContext, user):
+    """СК_отработка из показаний CGM"""
+    cgm_value, _ = await _find_cgm_glucose_end(state, user)
+    if cgm_value is None:
+        await callback.answer("❌ Нет показаний CGM через 4-5 часов после еды", show_alert=True)
+        return
+
+    await callback.answer()
+    await _accept_glucose_end(callback.message, state, user, round(cgm_value, 1))
 
 
 @router.message(MealStates.waiting_for_glucose_end)
 async def process_glucose_end(message: Message, state: FSMContext, user):
-    """Обработка ввода СК_отработка и показ ФЧИ за 3 дня для подтверждения"""
+    """Обработка ввода СК_отработка"""
     try:
         glucose_end = parse_glucose_input(message.text or "")
-        if glucose_end < 1 or glucose_end > 30:
-            await message.answer(
-                "❌ Уровень глюкозы должен быть от 1 до 30 ммоль/л. Попробуйте ещё раз:",
-                reply_markup=get_cancel_keyboard(),
-            )
-            return
+    except ValueError:
+        await message.answer(
+            "❌ Неверный формат уровня глюкозы. Введите число (например: 6.8):", reply_markup=get_cancel_keyboard()
+        )
+        return
 
-        # Сохраняем glucose_end в state
-        await state.update_data(glucose_end=glucose_end)
+    if glucose_end < 1 or glucose_end > 30:
+        await message.answer(
+            "❌ Уровень глюкозы должен быть от 1 до 30 ммоль/л. Попробуйте ещё раз:",
+            reply_markup=get_cancel_keyboard(),
+        )
+        return
 
-        # Получаем ФЧИ из базы данных
-        async with async_session() as session:
-            fci_repo = FCIRepository(session)
-            latest_fci = await fci_repo.get_latest(user.id)
+    await _accept_glucose_end(message, state, user, glucose_end)
 
-            if not latest_fci:
-                await message.answer(
-                    "❌ Сначала нужно рассчитать ФЧИ! Используйте команду '📊 Рассчитать ФЧИ'",
-                    reply_markup=get_main_menu_keyboard(),
-                )
-                await state.clear()
-                return
 
-            fci_value = float(latest_fci.value)
+async def _accept_glucose_end(message: Message, state: FSMContext, user, glucose_end: float):
+    """Сохранение СК_отработки и показ ФЧИ за 3 дня для подтверждения"""
+    # Сохраняем glucose_end в state
+    await state.update_data(glucose_end=glucose_end)
+    await reminder_scheduler.cancel(user.id, REMINDER_GLUCOSE_END)
 
-            # Получаем данные за последние 3 дня для расчета ФЧИ
-            day1, day2, day3 = get_date_suggestions()
-            day1_total = await get_insulin_for_fci(user.id, day1, session)
-            day2_total = await get_insulin_for_fci(user.id, day2, session)
-            day3_total = await get_insulin_for_fci(user.id, day3, session)
+    # Получаем ФЧИ из базы данных
+    async with async_session() as session:
+        fci_repo = FCIRepository(session)
+        latest_fci = await fci_repo.get_latest(user.id)
 
-        # Сохраняем ФЧИ в state для дальнейшего использования
-        await state.update_data(fci_value=fci_value)
-        await state.set_state(MealStates.waiting_for_fci_confirmation)
+        if not latest_fci:
+            await message.answer(
+                "❌ Сначала нужно рассчитать ФЧИ! Используйте команду '📊 Рассчитать ФЧИ'",
+                reply_markup=get_main_menu_keyboard(),
+            )
+            await state.clear()
+            return
 
-        # Формируем текст с данными ФЧИ за 3 дня
-        fci_review_text = f"""
+        fci_value = float(latest_fci.value)
+
+        # Получаем данные за последние 3 дня для расчета ФЧИ
+        day1, day2, day3 = get_date_suggestions()
+        totals = await get_insulin_for_fci_days(user.id, [day1, day2, day3], session, get_user_zone(user.timezone))
+        day1_total, day2_total, day3_total = totals[day1], totals[day2], totals[day3]
+
+    # Сохраняем ФЧИ в state для дальнейшего использования
+    await state.update_data(fci_value=fci_value)
+    await state.set_state(MealStates.waiting_for_fci_confirmation)
+
+    # Формируем текст с данными ФЧИ за 3 дня
+    fci_review_text = f"""
 ✅ СК_отработка: {glucose_end} ммоль/л
 
 📊 <b>Проверьте данные ФЧИ за последние 3 дня:</b>
@@ -491,14 +838,9 @@ async def process_glucose_end(message: Message, state: FSMContext, user):
 
 ⚠️ Если данные за какой-то день неверны, вы можете их изменить.
 Иначе нажмите "✅ Завершить расчет" для завершения расчета УК.
-        """
-
-        await message.answer(fci_review_text, parse_mode="HTML", reply_markup=get_fci_confirmation_keyboard())
+    """
 
-    except ValueError:
-        await message.answer(
-            "❌ Неверный формат уровня глюкозы. Введите число (например: 6.8):", reply_markup=get_cancel_keyboard()
-        )
+    await message.answer(fci_review_text, parse_mode="HTML", reply_markup=get_fci_confirmation_keyboard())
 
 
 @router.callback_query(F.data == "uk_finish_calculation")
@@ -522,6 +864,14 @@ async def finish_uk_calculation(callback: CallbackQuery, state: FSMContext, user
             fats=data.get("fats"),
         )
 
+        # Сравниваем с обычным УК пользователя для этого приёма пищи (до учёта новой записи)
+        meal_stats = await UserMealStatsRepository(session).get(user.id, MealType(data["meal_type"]).value)
+        uk_z = (
+            calculate_z_score(uk_value, meal_stats.count, meal_stats.mean, meal_stats.m2) if meal_stats else None
+        )
+        # Копируем среднее: при сохранении записи статистика обновляется в том же объекте сессии
+        uk_mean = meal_stats.mean if meal_stats else None
+
         # Сохраняем запись о приёме пищи
         meal_repo = MealRecordRepository(session)
         meal_record = await meal_repo.create(
@@ -538,6 +888,7 @@ async def finish_uk_calculation(callback: CallbackQuery, state: FSMContext, user
             insulin_additional=data.get("insulin_additional", 0),
             uk_value=uk_value,
         )
+        population_sketches.add(uk_sketch_key(MealType(data["meal_type"]).value), uk_value)
 
         # Сохраняем подколки
         if data.get("additional_injections"):
@@ -550,21 +901,31 @@ async def finish_uk_calculation(callback: CallbackQuery, state: FSMContext, user
                     dose_corrected=inj["corrected_dose"],
                 )
 
-        # Создаем запись инсулина ТОЛЬКО для этого приема пищи (не сумму за весь день!)
-        from db.repository import InsulinRecordRepository
-        from db.models import InsulinType
-
-        insulin_repo = InsulinRecordRepository(session)
-
-        # Инсулин только этого приема пищи
-        current_meal_insulin = data["insulin_food"] + data.get("insulin_additional", 0)
+        # Журнал инъекций: инсулин на еду — в момент ввода СК_старт, подколки — через указанное время.
+        # Подколки пишутся с коррекцией, как insulin_additional: ФЧИ не зависит от источника данных
+        zone = get_user_zone(user.timezone)
+        meal_started_at = data.get("meal_started_at")
+        injected_at = datetime.fromisoformat(meal_started_at).astimezone(zone) if meal_started_at else datetime.now(zone)
+        doses = [(injected_at, InsulinType.FOOD, data["insulin_food"])]
+        doses += [
+            (injected_at + timedelta(minutes=inj["time"]), InsulinType.CORRECTION, inj["corrected_dose"])
+            for inj in data.get("additional_injections") or []
+        ]
+        await InsulinDoseRepository(session).create_many(
+            user.id, zone.key, [dose for dose in doses if dose[2] > 0], meal_record_id=meal_record.id
+        )
 
-        await insulin_repo.create(
+        # Запоминаем набор значений как шаблон для быстрого повторного ввода
+        template_repo = MealTemplateRepository(session)
+        await template_repo.record_use(
             user_id=user.id,
-            date=date.today(),
-            insulin_type=InsulinType.FOOD,
-            amount=current_meal_insulin,
-            is_manual=False,  # Автоматическая запись из расчета УК
+            meal_type=data["meal_type"],
+            pause_time=data.get("pause_time"),
+            carbs_main=data["carbs_main"],
+            carbs_additional=data.get("carbs_additional", 0),
+            proteins=data.get("proteins"),
+            fats=data.get("fats"),
+            insulin_food=data["insulin_food"],
         )
 
     # Формируем дополнительные блоки отчёта
@@ -585,6 +946,15 @@ async def finish_uk_calculation(callback: CallbackQuery, state: FSMContext, user
     else:
         injections_block = ""
 
+    if uk_z is not None and abs(uk_z) >= OUTLIER_Z_THRESHOLD:
+        direction = "выше" if uk_z > 0 else "ниже"
+        outlier_block = (
+            f"\n⚠️ <b>УК заметно {direction} обычного</b> для этого приёма пищи "
+            f"(среднее {uk_mean:.3f}, отклонение {uk_z:+.1f}σ). Проверьте введённые данные."
+        )
+    else:
+        outlier_block = ""
+
     # Формируем результат
     result_text = f"""
 🎉 <b>Расчёт УК завершён!</b>
@@ -602,7 +972,7 @@ async def finish_uk_calculation(callback: CallbackQuery, state: FSMContext, user
 {injections_block}
 
 📈 <b>Результат:</b>
-• <b>УК = {uk_value:.3f}</b>
+• <b>УК = {uk_value:.3f}</b>{outlier_block}
 
 Данные сохранены! Теперь вы можете использовать этот УК для планирования следующих приёмов пищи.
     """
@@ -646,7 +1016,7 @@ async def process_fci_edit_date_in_meal(message: Message, state: FSMContext, use
 
         # Получаем текущее значение инсулина за эту дату
         async with async_session() as session:
-            current_insulin = await get_insulin_for_fci(user.id, date_obj, session)
+            current_insulin = await get_insulin_for_fci(user.id, date_obj, session, get_user_zone(user.timezone))
 
         await state.update_data(edit_fci_date=date_obj, current_fci_insulin=current_insulin)
         await state.set_state(MealStates.waiting_for_fci_edit_amount)
@@ -697,15 +1067,13 @@ async def process_fci_edit_amount_in_meal(message: Message, state: FSMContext, u
             from app.utils import calculate_fci
 
             day1, day2, day3 = get_date_suggestions()
-            day1_total = await get_insulin_for_fci(user.id, day1, session)
-            day2_total = await get_insulin_for_fci(user.id, day2, session)
-            day3_total = await get_insulin_for_fci(user.id, day3, session)
+            totals = await get_insulin_for_fci_days(user.id, [day1, day2, day3], session, get_user_zone(user.timezone))
+            day1_total, day2_total, day3_total = totals[day1], totals[day2], totals[day3]
 
             # Если есть данные за все 3 дня, пересчитываем ФЧИ
             if day1_total > 0 and day2_total > 0 and day3_total > 0:
                 fci_value = calculate_fci(day1_total, day2_total, day3_total)
-                fci_repo = FCIRepository(session)
-                await fci_repo.update_or_create(user_id=user.id, date=day1, value=fci_value)
+                await save_fci(user.id, day1, fci_value, session)
 
                 # Обновляем ФЧИ в state
                 await state.update_data(fci_value=fci_value)
@@ -1,7 +1,11 @@
 from aiogram import Router, F
 from aiogram.types import Message
-from aiogram.filters import CommandStart
+from aiogram.filters import CommandStart, Command, CommandObject
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from app.keyboards import get_main_menu_keyboard
+from app.utils import get_user_zone
+from db.repository import UserRepository
+from db.session import async_session
 
 router = Router()
 
@@ -25,3 +29,43 @@ async def start_handler(message: Message):
     """
 
     await message.answer(welcome_text, reply_markup=get_main_menu_keyboard(), parse_mode="HTML")
+
+
+@router.message(Command("timezone"))
+async def timezone_handler(message: Message, command: CommandObject, user):
+    """Просмотр и смена часового пояса: /timezone Europe/Moscow"""
+    if not command.args:
+        zone = get_user_zone(user.timezone)
+        await message.answer(
+            f"🕐 Ваш часовой пояс: <b>{zone.key}</b>\n\n"
+            "Чтобы изменить, отправьте команду с названием пояса, например:\n<code>/timezone Asia/Yekaterinburg</code>",
+            parse_mode="HTML",
+        )
+        return
+
+    tz_name = command.args.strip()
+    try:
+        ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError, OSError):
+        # OSError: имя каталога базы поясов ("Europe") или слишком длинное имя
+        await message.answer("❌ Неизвестный часовой пояс. Пример: <code>Europe/Moscow</code>", parse_mode="HTML")
+        return
+
+    async with async_session() as session:
+        await UserRepository(session).set_timezone(user.id, tz_name)
+    await message.answer(f"✅ Часовой пояс сохранён: <b>{tz_name}</b>", parse_mode="HTML")
+
+
+@router.message(Command("digest"))
+async def digest_handler(message: Message, user):
+    """Включение и отключение итогов недели"""
+    enabled = not user.weekly_digest
+    async with async_session() as session:
+        await UserRepository(session).set_weekly_digest(user.id, enabled)
+
+    if enabled:
+        await message.answer(
+            "📬 Итоги недели включены: раз в неделю я пришлю сводку по ФЧИ и УК.\nОтключить — снова /digest"
+        )
+    else:
+        await message.answer("🔕 Итоги недели отключены")
@@ -3,14 +3,26 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from datetime import date, timedelta
 from app.keyboards import get_statistics_keyboard, get_main_menu_keyboard
-from app.utils import format_date, get_meal_type_name
-from db.repository import FCIRepository, MealRecordRepository, UserRepository
+from app.utils import format_date, format_period_stats, get_meal_type_name, running_std
+from db.repository import FCIRepository, MealRecordRepository, UserRepository, UserMealStatsRepository, FCI_STATS_KIND
 from db.session import async_session
+from app.quantiles import population_sketches, FCI_SKETCH_KEY, uk_sketch_key
+from app.glycemic import get_glycemic_summary, format_glycemic_summary
 from db.models import MealType
 
 router = Router()
 
 
+def _percentile_band(key: str, value: float) -> str:
+    """Место значения среди всех пользователей бота (обезличенно)"""
+    percentile = population_sketches.percentile(key, value)
+    if percentile is None:
+        return ""
+    bands = [(25, "ниже P25"), (50, "P25–P50"), (75, "P50–P75"), (101, "выше P75")]
+    band = next(label for bound, label in bands if percentile < bound)
+    return f"  ↳ среди пользователей: ≈{percentile:.0f}-й перцентиль ({band})\n"
+
+
 @router.message(F.text == "📈 Статистика")
 async def show_statistics_menu(message: Message):
     """Показать меню статистики"""
@@ -53,6 +65,62 @@ async def show_month_stats(callback: CallbackQuery, user):
     await show_stats_for_period(callback, start_date, end_date, user.id)
 
 
+@router.callback_query(F.data == "stats_cgm_90")
+async def show_cgm_quarter_stats(callback: CallbackQuery, user):
+    """Показать показатели CGM за 90 дней"""
+    end_date = date.today()
+    start_date = end_date - timedelta(days=89)
+    async with async_session() as session:
+        summary = await get_glycemic_summary(session, user.id, start_date, end_date)
+
+    text = f"📡 <b>CGM за период {format_date(start_date)} - {format_date(end_date)}</b>\n\n"
+    if summary is None:
+        text += "❌ Нет данных CGM. Загрузите выгрузку сенсора командой /cgm"
+    else:
+        text += format_glycemic_summary(summary)
+
+    await callback.message.edit_text(text, parse_mode="HTML")
+    await callback.answer()
+
+
+@router.callback_query(F.data == "stats_all")
+async def show_all_time_stats(callback: CallbackQuery, user):
+    """Показать статистику за всё время по накопленным агрегатам"""
+    async with async_session() as session:
+        stats = await UserMealStatsRepository(session).get_all(user.id)
+
+    text = "📊 <b>Статистика за всё время</b>\n\n"
+
+    fci_stats = stats.get(FCI_STATS_KIND)
+    if fci_stats and fci_stats.count:
+        text += "📈 <b>ФЧИ:</b>\n"
+        text += f"• Количество записей: {fci_stats.count}\n"
+        text += f"• Среднее значение: {fci_stats.mean:.2f} ± {running_std(fci_stats.count, fci_stats.m2):.2f}\n"
+        text += f"• Минимум: {fci_stats.min_value:.2f}\n"
+        text += f"• Максимум: {fci_stats.max_value:.2f}\n"
+        text += _percentile_band(FCI_SKETCH_KEY, fci_stats.mean) + "\n"
+    else:
+        text += "📈 <b>ФЧИ:</b> Нет данных\n\n"
+
+    text += "🍽️ <b>УК по приёмам пищи:</b>\n"
+
+    for meal_type in [MealType.BREAKFAST, MealType.LUNCH, MealType.SNACK, MealType.DINNER]:
+        meal_name = get_meal_type_name(meal_type)
+        meal_stats = stats.get(meal_type.value)
+        if meal_stats and meal_stats.count:
+            text += (
+                f"• {meal_name}: {meal_stats.count} записей, среднее УК: {meal_stats.mean:.3f} "
+                f"± {running_std(meal_stats.count, meal_stats.m2):.3f} "
+                f"(от {meal_stats.min_value:.3f} до {meal_stats.max_value:.3f})\n"
+            )
+            text += _percentile_band(uk_sketch_key(meal_type.value), meal_stats.mean)
+        else:
+            text += f"• {meal_name}: Нет данных\n"
+
+    await callback.message.edit_text(text, parse_mode="HTML")
+    await callback.answer()
+
+
 async def show_stats_for_date(callback: CallbackQuery, target_date: date, user_id: int):
     """Показать статистику за конкретную дату"""
     async with async_session() as session:
@@ -90,6 +158,10 @@ async def show_stats_for_date(callback: CallbackQuery, target_date: date, user_i
         if not meal_records:
             text += "\n❌ За эту дату нет записей о приёмах пищи"
 
+        glycemic = await get_glycemic_summary(session, user_id, target_date, target_date)
+        if glycemic is not None:
+            text += "\n\n" + format_glycemic_summary(glycemic)
+
         await callback.message.edit_text(text, parse_mode="HTML")
         await callback.answer()
 
@@ -97,46 +169,21 @@ async def show_stats_for_date(callback: CallbackQuery, target_date: date, user_i
 async def show_stats_for_period(callback: CallbackQuery, start_date: date, end_date: date, user_id: int):
     """Показать статистику за период"""
     async with async_session() as session:
-        fci_repo = FCIRepository(session)
-        meal_repo = MealRecordRepository(session)
-
-        # Получаем ФЧИ за период
-        fci_records = await fci_repo.get_by_date_range(user_id, start_date, end_date)
-
-        # Получаем записи о приёмах пищи за период
-        meal_records = await meal_repo.get_by_date_range(user_id, start_date, end_date)
+        # ФЧИ и УК по типам приёмов пищи считаются агрегатами в БД, как и в итогах недели
+        fci_stats = await FCIRepository(session).get_period_stats([user_id], start_date, end_date, start_date)
+        uk_stats = await MealRecordRepository(session).get_uk_stats([user_id], start_date, end_date)
 
         text = f"📊 <b>Статистика за период {format_date(start_date)} - {format_date(end_date)}</b>\n\n"
+        fci = fci_stats.get(user_id)
+        text += format_period_stats(fci[:4] if fci else None, uk_stats.get(user_id, {}))
 
-        # Статистика ФЧИ
-        if fci_records:
-            fci_values = [record.value for record in fci_records]
-            avg_fci = sum(fci_values) / len(fci_values)
-            text += f"📈 <b>ФЧИ:</b>\n"
-            text += f"• Количество записей: {len(fci_records)}\n"
-            text += f"• Среднее значение: {avg_fci:.2f}\n"
-            text += f"• Минимум: {min(fci_values):.2f}\n"
-            text += f"• Максимум: {max(fci_values):.2f}\n\n"
-        else:
-            text += "📈 <b>ФЧИ:</b> Нет данных\n\n"
-
-        # Статистика УК по типам приёмов пищи
-        text += "🍽️ <b>УК по приёмам пищи:</b>\n"
-
-        for meal_type in [MealType.BREAKFAST, MealType.LUNCH, MealType.SNACK, MealType.DINNER]:
-            meal_name = get_meal_type_name(meal_type)
-            type_records = [r for r in meal_records if r.meal_type == meal_type]
-
-            if type_records:
-                uk_values = [record.uk_value for record in type_records]
-                avg_uk = sum(uk_values) / len(uk_values)
-                text += f"• {meal_name}: {len(type_records)} записей, среднее УК: {avg_uk:.3f}\n"
-            else:
-                text += f"• {meal_name}: Нет данных\n"
-
-        if not meal_records:
+        if user_id not in uk_stats:
             text += "\n❌ За этот период нет записей о приёмах пищи"
 
+        glycemic = await get_glycemic_summary(session, user_id, start_date, end_date)
+        if glycemic is not None:
+            text += "\n\n" + format_glycemic_summary(glycemic)
+
         await callback.message.edit_text(text, parse_mode="HTML")
         await callback.answer()
 
@@ -0,0 +1,458 @@
+"""
+Массовый импорт истории (приёмы пищи, инсулин, ФЧИ) из CSV.
+
+Файл проверяется за один потоковый проход; корректные строки порциями загружаются
+во временные таблицы (в PostgreSQL через COPY), а затем одной транзакцией
+переносятся в основные таблицы. Производные данные пересчитываются после переноса.
+"""
+
+import asyncio
+import csv
+import io
+from bisect import bisect_right
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Awaitable, Callable, Iterator, NamedTuple, Optional
+
+from sqlalchemy import (
+    Column,
+    Date,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    and_,
+    cast,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    select,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.quantiles import KLLSketch, population_sketches, FCI_SKETCH_KEY, uk_sketch_key
+from app.utils import calculate_uk
+from db.models import FCI, InsulinRecord, InsulinType, MealRecord, MealType
+from db.repository import UserMealStatsRepository
+
+IMPORT_BATCH_SIZE = 10_000
+# Сколько ошибок показывать пользователю
+MAX_REPORTED_ERRORS = 10
+
+ProgressCallback = Callable[[int], Awaitable[None]]
+
+# Временные таблицы живут до конца транзакции импорта
+_stage_metadata = MetaData()
+
+meal_stage = Table(
+    "import_meal_stage",
+    _stage_metadata,
+    Column("date", Date, nullable=False),
+    Column("meal_type", String, nullable=False),
+    Column("glucose_start", Float, nullable=False),
+    Column("pause_time", Integer),
+    Column("carbs_main", Float, nullable=False),
+    Column("carbs_additional", Float, nullable=False),
+    Column("proteins", Float),
+    Column("fats", Float),
+    Column("insulin_food", Float, nullable=False),
+    Column("glucose_end", Float, nullable=False),
+    Column("insulin_additional", Float, nullable=False),
+    Column("uk_value", Float, nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+insulin_stage = Table(
+    "import_insulin_stage",
+    _stage_metadata,
+    Column("date", Date, nullable=False),
+    Column("insulin_type", String, nullable=False),
+    Column("amount", Float, nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+MEAL_STAGE_COLUMNS = [c.name for c in meal_stage.columns]
+INSULIN_STAGE_COLUMNS = [c.name for c in insulin_stage.columns]
+
+MEAL_TYPE_ALIASES = {
+    "breakfast": MealType.BREAKFAST,
+    "завтрак": MealType.BREAKFAST,
+    "lunch": MealType.LUNCH,
+    "обед": MealType.LUNCH,
+    "snack": MealType.SNACK,
+    "полдник": MealType.SNACK,
+    "dinner": MealType.DINNER,
+    "ужин": MealType.DINNER,
+}
+
+INSULIN_TYPE_ALIASES = {
+    "": InsulinType.FOOD,
+    "food": InsulinType.FOOD,
+    "на еду": InsulinType.FOOD,
+    "correction": InsulinType.CORRECTION,
+    "коррекция": InsulinType.CORRECTION,
+}
+
+RECORD_TYPES = {"meal": "meal", "еда": "meal", "insulin": "insulin", "инсулин": "insulin", "fci": "fci", "фчи": "fci"}
+
+REQUIRED_COLUMNS = {"type", "date"}
+
+
+class ImportValidationError(Exception):
+    """Файл не прошёл проверку; errors — сообщения об ошибках по строкам"""
+
+    def __init__(self, errors: list[str], error_count: int):
+        super().__init__(f"Ошибок в файле: {error_count}")
+        self.errors = errors
+        self.error_count = error_count
+
+
+class ImportResult(NamedTuple):
+    meals: int
+    insulin_days: int
+    fci_days: int
+    duplicates: int
+
+
+class _ParsedBatch(NamedTuple):
+    meals: list[tuple]
+    # Приёмы пищи без УК: считаются после прохода по файлу, когда известны все ФЧИ
+    meals_without_uk: list[tuple]
+    insulin: list[tuple]
+    rows: int
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(value: str) -> date:
+    value = value.strip()
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date()
+    except ValueError:
+        raise ValueError("неверная дата, ожидается ГГГГ-ММ-ДД или ДД.ММ.ГГГГ")
+
+
+def _parse_float(value: str, minimum: float, maximum: float, name: str) -> float:
+    try:
+        number = float(value.replace(",", "."))
+    except ValueError:
+        raise ValueError(f"{name}: неверный формат числа")
+    if not minimum <= number <= maximum:
+        raise ValueError(f"{name} вне диапазона {minimum:g}–{maximum:g}")
+    return number
+
+
+def _optional_float(value: str, minimum: float, maximum: float, name: str) -> Optional[float]:
+    if not value or value.isspace():
+        return None
+    return _parse_float(value, minimum, maximum, name)
+
+
+class _CsvParser:
+    """Потоковый разбор и проверка строк файла импорта"""
+
+    def __init__(self, stream: io.TextIOBase):
+        sample = stream.read(4096)
+        stream.seek(0)
+        delimiter = ";" if sample.count(";") > sample.count(",") else ","
+        self._reader = csv.reader(stream, delimiter=delimiter)
+        header = next(self._reader, None)
+        if header is None:
+            raise ImportValidationError(["Файл пуст"], 1)
+
+        self._columns = {name.strip().lower().lstrip("﻿"): i for i, name in enumerate(header)}
+        # К каждой строке дописывается пустое поле, на него указывают отсутствующие колонки
+        self._width = len(header)
+        missing = REQUIRED_COLUMNS - self._columns.keys()
+        if missing:
+            raise ImportValidationError([f"Нет обязательных колонок: {', '.join(sorted(missing))}"], 1)
+
+        self.errors: list[str] = []
+        self.error_count = 0
+        self.fci_by_date: dict[date, float] = {}
+
+    def _field(self, row: list[str], name: str) -> str:
+        return row[self._columns.get(name, self._width)]
+
+    def _required(self, row: list[str], name: str) -> str:
+        value = row[self._columns.get(name, self._width)]
+        if not value or value.isspace():
+            raise ValueError(f"не заполнено поле {name}")
+        return value
+
+    def _parse_meal(self, row: list[str], day: date) -> tuple:
+        meal_type = MEAL_TYPE_ALIASES.get(self._required(row, "meal_type").strip().lower())
+        if meal_type is None:
+            raise ValueError("неизвестный meal_type")
+
+        pause = self._field(row, "pause_time").strip()
+        carbs_additional = _optional_float(self._field(row, "carbs_additional"), 0, 1000, "carbs_additional")
+        insulin_additional = _optional_float(self._field(row, "insulin_additional"), 0, 100, "insulin_additional")
+        return (
+            day,
+            meal_type.name,
+            _parse_float(self._required(row, "glucose_start"), 1, 35, "glucose_start"),
+            int(_parse_float(pause, 0, 1440, "pause_time")) if pause else None,
+            _parse_float(self._required(row, "carbs_main"), 0, 1000, "carbs_main"),
+            carbs_additional or 0.0,
+            _optional_float(self._field(row, "proteins"), 0, 1000, "proteins"),
+            _optional_float(self._field(row, "fats"), 0, 1000, "fats"),
+            _parse_float(self._required(row, "insulin_food"), 0, 100, "insulin_food"),
+            _parse_float(self._required(row, "glucose_end"), 1, 35, "glucose_end"),
+            insulin_additional or 0.0,
+            _optional_float(self._field(row, "uk_value"), -100, 100, "uk_value"),
+        )
+
+    def _parse_insulin(self, row: list[str], day: date) -> tuple:
+        insulin_type = INSULIN_TYPE_ALIASES.get(self._field(row, "insulin_type").strip().lower())
+        if insulin_type is None:
+            raise ValueError("неизвестный insulin_type")
+        return day, insulin_type.name, _parse_float(self._required(row, "amount"), 0, 500, "amount")
+
+    def batches(self, batch_size: int = IMPORT_BATCH_SIZE) -> Iterator[_ParsedBatch]:
+        meals: list[tuple] = []
+        meals_without_uk: list[tuple] = []
+        insulin: list[tuple] = []
+        rows = 0
+        width = self._width
+
+        for row in self._reader:
+            if not any(row):
+                continue
+            if len(row) != width:
+                row = (row + [""] * width)[:width]
+            row.append("")
+            rows += 1
+            try:
+                kind = RECORD_TYPES.get(self._required(row, "type").strip().lower())
+                day = _parse_date(self._required(row, "date"))
+                if kind == "meal":
+                    meal = self._parse_meal(row, day)
+                    (meals if meal[-1] is not None else meals_without_uk).append(meal)
+                elif kind == "insulin":
+                    insulin.append(self._parse_insulin(row, day))
+                elif kind == "fci":
+                    # Последнее значение за день заменяет предыдущие, как при ручном вводе
+                    self.fci_by_date[day] = _parse_float(self._required(row, "value"), 0.1, 30, "value")
+                else:
+                    raise ValueError("type должен быть meal, insulin или fci")
+            except ValueError as e:
+                self.error_count += 1
+                if len(self.errors) < MAX_REPORTED_ERRORS:
+                    self.errors.append(f"Строка {self._reader.line_num}: {e}")
+
+            if rows >= batch_size:
+                yield _ParsedBatch(meals, meals_without_uk, insulin, rows)
+                meals, meals_without_uk, insulin, rows = [], [], [], 0
+
+        if rows:
+            yield _ParsedBatch(meals, meals_without_uk, insulin, rows)
+
+
+def _fill_uk(meals: list[tuple], fci_dates: list[date], fci_values: list[float], fallback: Optional[float]) -> list[tuple]:
+    """Считает УК по последнему ФЧИ на дату приёма пищи"""
+    filled = []
+    for meal in meals:
+        pos = bisect_right(fci_dates, meal[0])
+        fci = fci_values[pos - 1] if pos else fallback
+        if fci is None:
+            raise ImportValidationError(["Нет ни одного ФЧИ: добавьте строки fci или уточните uk_value"], 1)
+        uk = calculate_uk(
+            glucose_start=meal[2],
+            glucose_end=meal[9],
+            fci=fci,
+            insulin_food=meal[8],
+            insulin_additional=meal[10],
+            carbs_main=meal[4],
+            carbs_additional=meal[5],
+            proteins=meal[6],
+            fats=meal[7],
+        )
+        filled.append(meal[:-1] + (uk,))
+    return filled
+
+
+async def _copy_rows(session: AsyncSession, table: Table, columns: list[str], records: list[tuple]) -> None:
+    """Загрузка порции во временную таблицу: COPY в PostgreSQL, executemany в остальных СУБД"""
+    if not records:
+        return
+
+    connection = await session.connection()
+    if connection.dialect.name == "postgresql":
+        raw = await connection.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(table.name, records=records, columns=columns)
+    else:
+        await connection.execute(insert(table), [dict(zip(columns, record)) for record in records])
+
+
+async def _merge_meals(session: AsyncSession, user_id: int) -> list[tuple]:
+    """Переносит приёмы пищи, пропуская уже существующие; возвращает (тип, УК) добавленных"""
+    s = meal_stage.c
+    meal_type = cast(s.meal_type, MealRecord.__table__.c.meal_type.type)
+    duplicate = exists().where(
+        and_(
+            MealRecord.user_id == user_id,
+            MealRecord.date == s.date,
+            MealRecord.meal_type == meal_type,
+            MealRecord.glucose_start == s.glucose_start,
+            MealRecord.carbs_main == s.carbs_main,
+            MealRecord.insulin_food == s.insulin_food,
+        )
+    )
+    # Жиры нужны только для расчёта УК и в истории не хранятся
+    columns = [c for c in MEAL_STAGE_COLUMNS if c != "meal_type" and c in MealRecord.__table__.c]
+    source = select(
+        literal(user_id, Integer),
+        meal_type,
+        *[s[c] for c in columns],
+        func.now(),
+    ).where(~duplicate)
+    result = await session.execute(
+        insert(MealRecord)
+        .from_select(["user_id", "meal_type", *columns, "created_at"], source)
+        .returning(MealRecord.meal_type, MealRecord.uk_value)
+    )
+    return list(result.all())
+
+
+async def _merge_insulin(session: AsyncSession, user_id: int) -> int:
+    """Импортированные суммы за день заменяют ручные записи за эти дни"""
+    s = insulin_stage.c
+    await session.execute(
+        delete(InsulinRecord).where(
+            and_(
+                InsulinRecord.user_id == user_id,
+                InsulinRecord.is_manual == 1,
+                InsulinRecord.date.in_(select(s.date).distinct()),
+            )
+        )
+    )
+    source = (
+        select(
+            literal(user_id, Integer),
+            s.date,
+            cast(s.insulin_type, InsulinRecord.__table__.c.insulin_type.type),
+            func.sum(s.amount),
+            literal(1, Integer),
+            func.now(),
+        )
+        .group_by(s.date, s.insulin_type)
+    )
+    await session.execute(
+        insert(InsulinRecord).from_select(
+            ["user_id", "date", "insulin_type", "amount", "is_manual", "created_at"], source
+        )
+    )
+    result = await session.execute(select(func.count(s.date.distinct())))
+    return result.scalar_one()
+
+
+async def _merge_fci(session: AsyncSession, user_id: int, fci_by_date: dict[date, float]) -> list[date]:
+    """Записывает ФЧИ из файла поверх сохранённых; возвращает дни, за которые ФЧИ раньше не было"""
+    if not fci_by_date:
+        return []
+    replaced = await session.execute(
+        delete(FCI).where(and_(FCI.user_id == user_id, FCI.date.in_(list(fci_by_date)))).returning(FCI.date)
+    )
+    replaced_dates = set(replaced.scalars().all())
+    await session.execute(
+        insert(FCI),
+        [{"user_id": user_id, "date": day, "value": value} for day, value in fci_by_date.items()],
+    )
+    return [day for day in fci_by_date if day not in replaced_dates]
+
+
+async def import_history(
+    session: AsyncSession,
+    user_id: int,
+    stream: io.TextIOBase,
+    progress: Optional[ProgressCallback] = None,
+) -> ImportResult:
+    """
+    Импортирует CSV-файл в историю пользователя одной транзакцией.
+    При ошибках в файле ничего не сохраняется и выбрасывается ImportValidationError.
+    """
+    parser = _CsvParser(stream)
+    batches = parser.batches()
+    connection = await session.connection()
+    for table in (meal_stage, insulin_stage):
+        await connection.run_sync(lambda sync_conn, t=table: t.drop(sync_conn, checkfirst=True))
+        await connection.run_sync(table.create)
+
+    meals_without_uk: list[tuple] = []
+    done = 0
+    try:
+        while True:
+            # Разбор строк занимает процессор, поэтому выполняется в отдельном потоке
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            done += batch.rows
+            if parser.error_count == 0:
+                await _copy_rows(session, meal_stage, MEAL_STAGE_COLUMNS, batch.meals)
+                await _copy_rows(session, insulin_stage, INSULIN_STAGE_COLUMNS, batch.insulin)
+                meals_without_uk.extend(batch.meals_without_uk)
+            if progress is not None:
+                await progress(done)
+
+        if parser.error_count:
+            raise ImportValidationError(parser.errors, parser.error_count)
+
+        if meals_without_uk:
+            result = await session.execute(
+                select(FCI.date, FCI.value).where(FCI.user_id == user_id).order_by(FCI.date, FCI.created_at)
+            )
+            # ФЧИ из файла заменяют сохранённые за те же дни
+            fci_by_date = {day: value for day, value in result.all()}
+            fci_by_date.update(parser.fci_by_date)
+            fci_dates = sorted(fci_by_date)
+            fci_values = [fci_by_date[d] for d in fci_dates]
+            # Приёмы пищи раньше первого ФЧИ считаются по самому раннему ФЧИ
+            fallback = fci_values[0] if fci_values else None
+            await _copy_rows(
+                session,
+                meal_stage,
+                MEAL_STAGE_COLUMNS,
+                _fill_uk(meals_without_uk, fci_dates, fci_values, fallback),
+            )
+
+        staged_meals = (await session.execute(select(func.count()).select_from(meal_stage))).scalar_one()
+        inserted_meals = await _merge_meals(session, user_id)
+        insulin_days = await _merge_insulin(session, user_id)
+        new_fci_dates = await _merge_fci(session, user_id, parser.fci_by_date)
+
+        await UserMealStatsRepository(session).rebuild(user_id)
+        for table in (meal_stage, insulin_stage):
+            await connection.run_sync(table.drop)
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        raise
+
+    # Скетчи обновляются только после успешного коммита
+    new_sketches: dict[str, KLLSketch] = {}
+    for meal_type, uk_value in inserted_meals:
+        key = uk_sketch_key(MealType(meal_type).value)
+        new_sketches.setdefault(key, KLLSketch(population_sketches.k)).update(uk_value)
+    # Как и save_fci, в скетч попадают только новые дни: перезаписанное значение уже учтено
+    if new_fci_dates:
+        sketch = new_sketches.setdefault(FCI_SKETCH_KEY, KLLSketch(population_sketches.k))
+        for day in new_fci_dates:
+            sketch.update(parser.fci_by_date[day])
+    for key, sketch in new_sketches.items():
+        population_sketches.merge(key, sketch)
+
+    return ImportResult(
+        meals=len(inserted_meals),
+        insulin_days=insulin_days,
+        fci_days=len(parser.fci_by_date),
+        duplicates=staged_meals - len(inserted_meals),
+    )
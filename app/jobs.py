@@ -0,0 +1,193 @@
+"""
+Очередь тяжёлых фоновых задач (выгрузка, импорт истории) в таблице jobs.
+
+Обработчики aiogram только ставят задачу в очередь; выполняет её пул воркеров в процессе
+бота. Задачи забираются по приоритету через SELECT ... FOR UPDATE SKIP LOCKED, с ограничением
+числа одновременных задач одного пользователя. Упавшая задача повторяется с экспоненциальной
+отсрочкой, после последней попытки пользователь получает сообщение об ошибке. Пока задача
+выполняется, воркер периодически обновляет locked_at; задачи упавшего процесса по истечении
+job_lock_timeout возвращаются в очередь.
+
+Задачу может забрать любой процесс бота, поэтому в параметрах нет локальных путей (файлы
+передаются по file_id Telegram). Активная задача каждого типа у пользователя одна — это
+гарантирует уникальный частичный индекс, enqueue в таком случае возвращает None.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from aiogram import Bot
+
+from config.base import settings
+from db.models import Job
+from db.repository import JobRepository, JOB_DONE, JOB_FAILED
+from db.session import async_session
+
+logger = logging.getLogger(__name__)
+
+# Отсрочка повтора: RETRY_BASE_DELAY × 2^(попытка - 1), но не больше RETRY_MAX_DELAY (секунды)
+RETRY_BASE_DELAY = 10
+RETRY_MAX_DELAY = 600
+# Не чаще одного сообщения о прогрессе за столько секунд
+PROGRESS_INTERVAL = 2.0
+# Как часто возвращать брошенные задачи в очередь и сколько хранить выполненные
+MAINTENANCE_INTERVAL = 60
+FINISHED_JOBS_TTL = timedelta(days=7)
+
+
+class JobContext:
+    """То, что получает обработчик задачи: параметры, бот и сообщения о прогрессе в чат"""
+
+    def __init__(self, bot: Bot, job: Job):
+        self.bot = bot
+        self.job = job
+        self.payload = json.loads(job.payload)
+        self.last_attempt = job.attempts >= job.max_attempts
+        self._last_report = 0.0
+
+    async def progress(self, text: str, force: bool = False) -> None:
+        """Обновляет сообщение о прогрессе (не чаще PROGRESS_INTERVAL, если не force)"""
+        message_id = self.payload.get("progress_message_id")
+        if self.job.chat_id is None or message_id is None:
+            return
+        if not force and time.monotonic() - self._last_report < PROGRESS_INTERVAL:
+            return
+        self._last_report = time.monotonic()
+        try:
+            await self.bot.edit_message_text(text, chat_id=self.job.chat_id, message_id=message_id, parse_mode="HTML")
+        except Exception:
+            pass
+
+    async def finish(self, text: str) -> None:
+        await self.progress(text, force=True)
+
+
+JobHandler = Callable[[JobContext], Awaitable[None]]
+
+
+class JobKind(NamedTuple):
+    handler: JobHandler
+    failure_text: str
+    max_attempts: int
+    priority: int
+
+
+class JobQueue:
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self._kinds: dict[str, JobKind] = {}
+        self._wakeup = asyncio.Event()
+
+    def register(self, kind: str, handler: JobHandler, failure_text: str, max_attempts: int = 3, priority: int = 0) -> None:
+        """Регистрирует тип задачи; failure_text показывается пользователю после последней неудачной попытки"""
+        self._kinds[kind] = JobKind(handler, failure_text, max_attempts, priority)
+
+    async def enqueue(self, kind: str, user_id: Optional[int], chat_id: Optional[int], **payload) -> Optional[int]:
+        """Ставит задачу в очередь; None, если у пользователя уже есть такая задача в очереди или в работе"""
+        job_kind = self._kinds[kind]
+        async with self.session_factory() as session:
+            job = await JobRepository(session).create(
+                kind, user_id, chat_id, json.dumps(payload), job_kind.priority, job_kind.max_attempts
+            )
+        if job is None:
+            return None
+        self._wakeup.set()
+        return job.id
+
+    async def has_active(self, user_id: int, kind: str) -> bool:
+        async with self.session_factory() as session:
+            return await JobRepository(session).has_active(user_id, kind)
+
+    async def _heartbeat(self, job_id: int) -> None:
+        while True:
+            await asyncio.sleep(settings.job_lock_timeout / 3)
+            try:
+                async with self.session_factory() as session:
+                    await JobRepository(session).heartbeat(job_id)
+            except Exception:
+                logger.exception(f"Не удалось обновить задачу {job_id}")
+
+    async def _execute(self, bot: Bot, job: Job) -> None:
+        job_kind = self._kinds.get(job.kind)
+        if job_kind is None:
+            logger.error(f"Нет обработчика для задачи {job.id} типа {job.kind}")
+            async with self.session_factory() as session:
+                await JobRepository(session).finish(job.id, JOB_FAILED, "unknown kind")
+            return
+
+        context = JobContext(bot, job)
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        try:
+            await job_kind.handler(context)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            async with self.session_factory() as session:
+                repo = JobRepository(session)
+                if context.last_attempt:
+                    logger.exception(f"Задача {job.id} ({job.kind}) не выполнена после {job.attempts} попыток")
+                    await repo.finish(job.id, JOB_FAILED, error)
+                else:
+                    delay = min(RETRY_BASE_DELAY * 2 ** (job.attempts - 1), RETRY_MAX_DELAY) * random.uniform(0.8, 1.2)
+                    logger.warning(f"Задача {job.id} ({job.kind}) упала, повтор через {delay:.0f} с: {error}")
+                    await repo.retry(job.id, datetime.now(timezone.utc) + timedelta(seconds=delay), error)
+            if context.last_attempt:
+                await context.finish(job_kind.failure_text)
+        else:
+            async with self.session_factory() as session:
+                await JobRepository(session).finish(job.id, JOB_DONE)
+        finally:
+            heartbeat.cancel()
+
+    async def _worker(self, bot: Bot) -> None:
+        while True:
+            try:
+                async with self.session_factory() as session:
+                    job = await JobRepository(session).claim(settings.job_user_concurrency)
+            except Exception:
+                logger.exception("Не удалось получить задачу из очереди")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), settings.job_poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._execute(bot, job)
+            except Exception:
+                logger.exception(f"Ошибка при обработке задачи {job.id}")
+
+    async def _maintenance(self) -> None:
+        while True:
+            try:
+                async with self.session_factory() as session:
+                    repo = JobRepository(session)
+                    now = datetime.now(timezone.utc)
+                    requeued = await repo.requeue_stale(now - timedelta(seconds=settings.job_lock_timeout))
+                    if requeued:
+                        logger.warning(f"Возвращено в очередь брошенных задач: {requeued}")
+                    await repo.delete_finished(now - FINISHED_JOBS_TTL)
+            except Exception:
+                logger.exception("Ошибка обслуживания очереди задач")
+            await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+    async def run(self, bot: Bot, workers: int) -> None:
+        """Пул воркеров; работает до отмены"""
+        tasks = [asyncio.create_task(self._worker(bot)) for _ in range(workers)]
+        tasks.append(asyncio.create_task(self._maintenance()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+job_queue = JobQueue(async_session)
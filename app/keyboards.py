@@ -1,5 +1,6 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from db.models import MealType
+from app.food_index import FoodMatch
 
 
 def get_main_menu_keyboard() -> ReplyKeyboardMarkup:
@@ -87,6 +88,42 @@ def get_skip_proteins_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
+def get_food_matches_keyboard(matches: list[FoodMatch]) -> InlineKeyboardMarkup:
+    """Клавиатура с найденными продуктами"""
+    rows = [
+        [
+            InlineKeyboardButton(
+                text=f"{m.name} (У {m.carbs:g} / Б {m.proteins:g} / Ж {m.fats:g})", callback_data=f"food_{m.food_id}"
+            )
+        ]
+        for m in matches
+    ]
+    rows.append([InlineKeyboardButton(text="❌ Отменить ввод", callback_data="cancel_input")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def get_meal_templates_keyboard(templates: list) -> InlineKeyboardMarkup:
+    """Клавиатура с сохранёнными шаблонами приёма пищи"""
+    rows = []
+    for t in templates:
+        text = f"⭐ У {t.carbs_main:g}"
+        if t.carbs_additional:
+            text += f"+{t.carbs_additional:g}"
+        text += f"г · Б {t.proteins or 0:g} · Ж {t.fats or 0:g} · {t.insulin_food:g} ед."
+        rows.append([InlineKeyboardButton(text=text, callback_data=f"tpl_{t.id}")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def get_cgm_glucose_end_keyboard(value: float) -> InlineKeyboardMarkup:
+    """Клавиатура с СК_отработкой из CGM"""
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text=f"📡 Взять из CGM: {value:.1f} ммоль/л", callback_data="cgm_glucose_end")],
+        ]
+    )
+    return keyboard
+
+
 def get_statistics_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура для статистики"""
     keyboard = InlineKeyboardMarkup(
@@ -95,6 +132,12 @@ def get_statistics_keyboard() -> InlineKeyboardMarkup:
             [InlineKeyboardButton(text="📆 За вчера", callback_data="stats_yesterday")],
             [InlineKeyboardButton(text="📊 За неделю", callback_data="stats_week")],
             [InlineKeyboardButton(text="📈 За месяц", callback_data="stats_month")],
+            [InlineKeyboardButton(text="🗂 За всё время", callback_data="stats_all")],
+            [InlineKeyboardButton(text="📡 CGM за 90 дней", callback_data="stats_cgm_90")],
+            [
+                InlineKeyboardButton(text="📤 Экспорт CSV", callback_data="export_csv"),
+                InlineKeyboardButton(text="📤 Экспорт XLSX", callback_data="export_xlsx"),
+            ],
         ]
     )
     return keyboard
@@ -108,6 +151,17 @@ def get_cancel_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 
+def get_broadcast_confirm_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура подтверждения рассылки"""
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(text="📢 Отправить всем", callback_data="broadcast_confirm")],
+            [InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_input")],
+        ]
+    )
+    return keyboard
+
+
 def get_calories_gender_keyboard() -> InlineKeyboardMarkup:
     """Выбор пола для расчёта калорий"""
     keyboard = InlineKeyboardMarkup(
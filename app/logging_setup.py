@@ -0,0 +1,122 @@
+"""
+Журнал бота: запись в очередь без ожидания вывода.
+
+Обработчики пишут записи в ограниченную очередь (QueueHandler), в поток вывода их переносит
+отдельный поток (QueueListener). Если вывод не успевает и очередь заполнена, новые записи
+отбрасываются, а не блокируют цикл asyncio; число отброшенных попадает в журнал, как только
+в очереди появится место.
+
+Каждая запись получает correlation_id — id апдейта, при обработке которого она сделана
+(задаёт CorrelationMiddleware), вне апдейтов — «-». Отладочные записи и SQL-журнал SQLAlchemy
+(settings.debug) проходят выборочно: сохраняется log_sample_percent процентов.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from config.base import settings
+
+# id апдейта, который сейчас обрабатывается (контекст asyncio наследуется задачами)
+correlation_id: ContextVar[str] = ContextVar("correlation_id", default="-")
+
+# Журналы, которые проходят выборочно при любом уровне записи
+SAMPLED_LOGGERS = ("sqlalchemy.engine",)
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", "-"),
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет correlation_id и отбирает часть массовых записей"""
+
+    def __init__(self, sample_percent: int):
+        super().__init__()
+        self.sample_rate = sample_percent / 100
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.INFO or record.name.startswith(SAMPLED_LOGGERS):
+            if record.levelno < logging.WARNING and random.random() >= self.sample_rate:
+                return False
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при заполненной очереди отбрасывает запись вместо ожидания"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        # Исключения форматируются здесь, пока доступен стек; сам текст записи — в потоке вывода
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            if self.dropped and self.queue.qsize() < self.queue.maxsize // 2:
+                dropped, self.dropped = self.dropped, 0
+                notice = logging.makeLogRecord(
+                    {"name": __name__, "levelno": logging.WARNING, "levelname": "WARNING", "correlation_id": "-",
+                     "msg": f"Журнал не успевает: пропущено записей: {dropped}"}
+                )
+                self.queue.put_nowait(self.prepare(notice))
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Настраивает корневой журнал; поток вывода останавливается (с выводом очереди) при выходе"""
+    if settings.log_format == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(formatter)
+
+    handler = DroppingQueueHandler(queue.Queue(maxsize=settings.log_queue_size))
+    handler.addFilter(ContextFilter(settings.log_sample_percent))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(settings.log_level.upper())
+    # SQL-журнал вместо echo движка: идёт через ту же очередь и выборку
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO if settings.debug else logging.WARNING)
+
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,238 @@
+"""
+Метрики процесса бота в формате Prometheus.
+
+Запись метрики — поиск ключа в словаре и пара сложений (бот однопоточный, блокировки не нужны);
+текст для Prometheus собирается только при запросе /metrics. HTTP-сервер поднимается
+на settings.metrics_port, при metrics_port=0 он не запускается.
+"""
+
+import bisect
+import logging
+import math
+from abc import ABC, abstractmethod
+from typing import Iterable, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин по умолчанию (секунды): от 5 мс до 30 с
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(ABC):
+    """Общая часть метрик: метки, дочерние значения и вывод в текстовом формате Prometheus"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        if not self.labelnames:
+            # Метрика без меток выгружается сразу, даже если ещё не менялась
+            self._children[()] = self._new_child()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self): ...
+
+    @abstractmethod
+    def _samples(self) -> Iterable[str]: ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """Монотонный счётчик"""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, child in self._children.items():
+            yield f"{self.name}_total{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class Gauge(_Metric):
+    """Текущее значение (например, число обрабатываемых апдейтов)"""
+
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def _samples(self):
+        for values, child in self._children.items():
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # Последняя ячейка — значения больше верхней границы (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин; накопленные суммы считаются при выгрузке"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+# Метрики обработки апдейтов (заполняются app.middlewares.metrics_middleware)
+update_duration = Histogram(
+    "bot_update_duration_seconds",
+    "Время обработки апдейта по роутеру, обработчику и состоянию FSM",
+    ("router", "handler", "state"),
+)
+update_errors = Counter(
+    "bot_update_errors",
+    "Исключения при обработке апдейтов",
+    ("router", "handler", "error"),
+)
+update_db_queries = Histogram(
+    "bot_update_db_queries",
+    "Число SQL-запросов за один апдейт",
+    ("router", "handler"),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 20, 50, 100),
+)
+update_db_duration = Histogram(
+    "bot_update_db_duration_seconds",
+    "Время SQL-запросов за один апдейт",
+    ("router", "handler"),
+)
+updates_in_flight = Gauge("bot_updates_in_flight", "Апдейтов в обработке")
+handlers_in_flight = Gauge("bot_handlers_in_flight", "Обработчиков в работе по роутерам", ("router",))
+
+# Отставание цикла asyncio (заполняет app.watchdog)
+loop_lag = Histogram(
+    "bot_event_loop_lag_seconds",
+    "Отставание цикла asyncio от расписания",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+loop_lag_quantiles = Gauge(
+    "bot_event_loop_lag_quantile_seconds",
+    "Перцентили отставания цикла asyncio за последнюю минуту (quantile=1 — максимум)",
+    ("quantile",),
+)
+loop_blocked = Counter("bot_event_loop_blocked", "Блокировки цикла asyncio дольше порога")
+
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Запускает HTTP-сервер с /metrics; остановка — await runner.cleanup()"""
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
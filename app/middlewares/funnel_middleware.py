@@ -0,0 +1,35 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.funnel import funnel_tracker
+
+CANCEL_MODULE = "app.handlers.cancel"
+
+
+class FunnelMiddleware(BaseMiddleware):
+    """Внутренний middleware: сообщает воронке об ответах в состояниях FSM и о смене состояния"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        state = data.get("state")
+        if user is None or state is None:
+            return await handler(event, data)
+
+        before = data.get("raw_state")
+        start = time.perf_counter()
+        result = await handler(event, data)
+        server = time.perf_counter() - start
+        after = await state.get_state()
+        if before is not None or after is not None:
+            callback = getattr(data.get("handler"), "callback", None)
+            cancelled = getattr(callback, "__module__", None) == CANCEL_MODULE
+            funnel_tracker.record(user.id, before, after, server, cancelled)
+        return result
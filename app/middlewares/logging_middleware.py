@@ -0,0 +1,22 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.logging_setup import correlation_id
+
+
+class CorrelationMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: помечает записи журнала id обрабатываемого апдейта"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        token = correlation_id.set(str(event.update_id))
+        try:
+            return await handler(event, data)
+        finally:
+            correlation_id.reset(token)
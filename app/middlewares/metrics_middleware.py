@@ -0,0 +1,92 @@
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.metrics import (
+    handlers_in_flight,
+    update_db_duration,
+    update_db_queries,
+    update_duration,
+    update_errors,
+    updates_in_flight,
+)
+from config.base import settings
+from db.instrumentation import fingerprint, track_queries
+
+logger = logging.getLogger(__name__)
+
+# Какой обработчик выбран для текущего апдейта: заполняет HandlerMetricsMiddleware,
+# читает UpdateMetricsMiddleware после обработки
+_current_handler: ContextVar[Optional[list]] = ContextVar("current_handler", default=None)
+
+
+def _handler_labels(data: Dict[str, Any]) -> tuple[str, str]:
+    """Роутер (модуль обработчика без пакета) и имя функции-обработчика"""
+    handler_object = data.get("handler")
+    callback = getattr(handler_object, "callback", None)
+    if callback is None:
+        return "unknown", "unknown"
+    module = getattr(callback, "__module__", "") or ""
+    return module.rsplit(".", 1)[-1], getattr(callback, "__qualname__", type(callback).__name__)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: время обработки, SQL-запросы, ошибки и число апдейтов в работе"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        labels = ["unhandled", event.event_type, "none"]
+        token = _current_handler.set(labels)
+        updates_in_flight.inc()
+        start = time.perf_counter()
+        with track_queries() as queries:
+            try:
+                return await handler(event, data)
+            except Exception as e:
+                update_errors.labels(labels[0], labels[1], type(e).__name__).inc()
+                raise
+            finally:
+                update_duration.labels(*labels).observe(time.perf_counter() - start)
+                update_db_queries.labels(labels[0], labels[1]).observe(queries.count)
+                update_db_duration.labels(labels[0], labels[1]).observe(queries.duration)
+                updates_in_flight.dec()
+                _current_handler.reset(token)
+                _check_query_thresholds(labels, queries)
+
+
+def _check_query_thresholds(labels: list, queries) -> None:
+    if queries.count > settings.update_query_warn_count or queries.duration * 1000 > settings.update_db_warn_ms:
+        distinct = len({fingerprint(statement) for statement in queries.statements})
+        logger.warning(
+            f"{labels[0]}.{labels[1]} (состояние {labels[2]}): {queries.count} запросов "
+            f"({distinct} различных), {queries.duration * 1000:.0f} мс в базе"
+        )
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: сообщает внешнему, какой обработчик и в каком состоянии FSM сработал"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        router, handler_name = _handler_labels(data)
+        labels = _current_handler.get()
+        if labels is not None:
+            labels[0], labels[1], labels[2] = router, handler_name, data.get("raw_state") or "none"
+        in_flight = handlers_in_flight.labels(router)
+        in_flight.inc()
+        try:
+            return await handler(event, data)
+        finally:
+            in_flight.dec()
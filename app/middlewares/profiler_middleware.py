@@ -0,0 +1,30 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.profiler import profiler
+
+
+class ProfilerMiddleware(BaseMiddleware):
+    """Отмечает задачи апдейтов пользователя, выбранного в /profile, чтобы профилировщик учитывал только их"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        if profiler.scope_user_id is None:
+            return await handler(event, data)
+        user = getattr(event.event, "from_user", None)
+        if user is None or user.id != profiler.scope_user_id:
+            return await handler(event, data)
+
+        task = asyncio.current_task()
+        profiler.scoped_tasks.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            profiler.scoped_tasks.discard(task)
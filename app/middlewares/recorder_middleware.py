@@ -0,0 +1,160 @@
+"""
+Запись входящих апдейтов для последующего воспроизведения (scripts/replay.py).
+
+Каждая строка файла — JSON {"ts": время получения, "update": апдейт}; файл — gzip, открытый на
+дозапись (каждый сброс добавляет новый gzip-член, читается обычным gzip.open). Запись идёт
+через BufferedFileWriter раз в RECORD_FLUSH_INTERVAL секунд, обработка апдейта не ждёт диск.
+
+Апдейты обезличиваются до записи:
+- id пользователей и чатов заменяются псевдонимами (HMAC от ключа record_updates_key);
+- имена, username, телефоны, геопозиция и разметка текста удаляются, file_id хешируются;
+- текст и подписи сохраняются, только если это кнопка меню, команда (без аргументов), число
+  (не длиннее KEEP_NUMBER_DIGITS цифр до запятой, чтобы не сохранить телефон) или дата/время;
+  остальной текст заменяется на «x» той же длины, чтобы обработчики шли по тем же веткам.
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.buffered_writer import BufferedFileWriter
+from app.keyboards import get_main_menu_keyboard
+
+logger = logging.getLogger(__name__)
+
+RECORD_FLUSH_INTERVAL = 1.0
+# Число с большим числом цифр похоже на телефон или номер документа и не сохраняется
+KEEP_NUMBER_DIGITS = 6
+# Форматы дат и времени, которые вводят пользователи (ДД.ММ.ГГГГ для ФЧИ и др.)
+KEEP_DATE_FORMATS = ("%d.%m.%Y", "%d.%m", "%H:%M")
+
+_DROP_KEYS = {
+    "username",
+    "last_name",
+    "phone_number",
+    "title",
+    "bio",
+    "description",
+    "entities",
+    "caption_entities",
+    "contact",
+    "location",
+    "venue",
+    "photo",
+    "active_usernames",
+    "invite_link",
+}
+_ID_OWNERS = {"from", "chat", "user", "sender_user", "sender_chat", "forward_from", "forward_from_chat"}
+_NUMBER = re.compile(rf"\d{{1,{KEEP_NUMBER_DIGITS}}}(?:[.,]\d+)?")
+_WORD = re.compile(r"\w")
+
+
+def _is_number_or_date(value: str) -> bool:
+    value = value.strip()
+    if _NUMBER.fullmatch(value):
+        return True
+    for date_format in KEEP_DATE_FORMATS:
+        try:
+            datetime.strptime(value, date_format)
+            return True
+        except ValueError:
+            continue
+    return False
+
+
+def _menu_texts() -> set[str]:
+    return {button.text for row in get_main_menu_keyboard().keyboard for button in row}
+
+
+class UpdateAnonymizer:
+    def __init__(self, key: bytes):
+        self.key = key
+        self.keep_texts = _menu_texts()
+
+    def pseudonym(self, value: int) -> int:
+        digest = hmac.new(self.key, str(abs(value)).encode(), hashlib.sha256).hexdigest()
+        pseudonym = int(digest[:12], 16) + 1
+        return -pseudonym if value < 0 else pseudonym
+
+    def text(self, value: str) -> str:
+        if value in self.keep_texts or _is_number_or_date(value):
+            return value
+        if value.startswith("/"):
+            return value.split(maxsplit=1)[0]
+        return _WORD.sub("x", value)
+
+    def _clean(self, value: Any, key: Optional[str] = None) -> Any:
+        if isinstance(value, list):
+            return [self._clean(item, key) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        cleaned = {}
+        for field, item in value.items():
+            if field in _DROP_KEYS:
+                continue
+            if field in ("text", "caption") and isinstance(item, str):
+                cleaned[field] = self.text(item)
+            elif field in ("file_id", "file_unique_id", "file_name"):
+                cleaned[field] = hashlib.sha256(str(item).encode()).hexdigest()[:16]
+            elif field == "first_name":
+                cleaned[field] = "user"
+            elif field == "id" and key in _ID_OWNERS and isinstance(item, int):
+                cleaned[field] = self.pseudonym(item)
+            else:
+                cleaned[field] = self._clean(item, field)
+        return cleaned
+
+    def anonymize(self, update: Update) -> dict:
+        return self._clean(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+
+class UpdateRecorderMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: пишет обезличенные апдейты в сжатый файл"""
+
+    def __init__(self, path: str, key: str = "", percent: int = 100):
+        self.path = path
+        self.percent = percent
+        if not key:
+            logger.warning("RECORD_UPDATES_KEY не задан: псевдонимы будут разными после перезапуска")
+        self.anonymizer = UpdateAnonymizer(key.encode() if key else os.urandom(16))
+        self.writer = BufferedFileWriter(path, "апдейтов", RECORD_FLUSH_INTERVAL, compress=True)
+
+    def _sampled(self, update: Update) -> bool:
+        """Отбор по пользователю целиком, чтобы записанные диалоги не рвались"""
+        if self.percent >= 100:
+            return True
+        user = getattr(update.event, "from_user", None)
+        return user is not None and self.anonymizer.pseudonym(user.id) % 100 < self.percent
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self._sampled(event):
+            received_at = time.time()
+            self.writer.add(
+                lambda: json.dumps({"ts": received_at, "update": self.anonymizer.anonymize(event)}, ensure_ascii=False)
+            )
+        return await handler(event, data)
+
+    async def flush(self) -> None:
+        await self.writer.flush()
+
+    async def start(self) -> None:
+        await self.writer.start()
+        logger.info(f"Входящие апдейты записываются в {self.path}")
+
+    async def close(self) -> None:
+        await self.writer.close()
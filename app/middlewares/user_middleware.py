@@ -1,6 +1,7 @@
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
 from typing import Callable, Dict, Any, Awaitable
+from app.tracing import span
 from db.repository import UserRepository
 from db.session import async_session
 
@@ -26,14 +27,15 @@ class UserMiddleware(BaseMiddleware):
             return await handler(event, data)
 
         # Создаём или получаем пользователя
-        async with async_session() as session:
-            user_repo = UserRepository(session)
-            db_user = await user_repo.get_or_create(
-                telegram_id=user.id, username=user.username, first_name=user.first_name, last_name=user.last_name
-            )
-
-            # Добавляем пользователя в данные для хендлеров
-            data["user"] = db_user
+        with span("UserMiddleware"):
+            async with async_session() as session:
+                user_repo = UserRepository(session)
+                db_user = await user_repo.get_or_create(
+                    telegram_id=user.id, username=user.username, first_name=user.first_name, last_name=user.last_name
+                )
+
+                # Добавляем пользователя в данные для хендлеров
+                data["user"] = db_user
 
         return await handler(event, data)
 
@@ -0,0 +1,220 @@
+"""
+Профилирование по команде администратора (/profile).
+
+Пока сеанс не запущен, ничего не работает. Во время сеанса:
+- отдельный поток каждые profile_sample_interval_ms снимает стек основного потока (цикла asyncio)
+  и копит свёрнутые стеки (формат flamegraph.pl / speedscope: «кадр;кадр;кадр число»);
+  если задан пользователь, учитываются только отсчёты, когда выполняется задача его апдейта;
+- цикл asyncio переводится в режим отладки, и колбэки дольше profile_slow_callback_ms пишутся в журнал;
+- tracemalloc отслеживает выделения памяти, в конце снимок сохраняется на диск.
+Файлы пишутся в settings.profile_dir, администратор получает сводку.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from aiogram import Bot
+
+from config.base import settings
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRACEMALLOC_FRAMES = 25
+TOP_LIMIT = 10
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_background_tasks: set[asyncio.Task] = set()
+
+
+class ProfileReport(NamedTuple):
+    samples: int
+    seconds: float
+    folded_path: str
+    slow_callbacks_path: str
+    tracemalloc_path: str
+    top_functions: list[tuple[str, int]]
+    slow_callbacks: int
+    top_allocations: list[str]
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    if code.co_filename.startswith(PROJECT_ROOT):
+        path = os.path.relpath(code.co_filename, PROJECT_ROOT)
+    else:
+        path = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def _fold(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """Собирает предупреждения asyncio о медленных колбэках в файл"""
+
+    def __init__(self, path: str):
+        super().__init__(logging.WARNING)
+        self.count = 0
+        self._file = open(path, "w", encoding="utf-8")
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.getMessage().startswith("Executing"):
+            self.count += 1
+            self._file.write(f"{datetime.now().isoformat()} {record.getMessage()}\n")
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self.scope_user_id: Optional[int] = None
+        # Задачи апдейтов выбранного пользователя (заполняет ProfilerMiddleware)
+        self.scoped_tasks: set[asyncio.Task] = set()
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def _sample(self, thread_id: int, loop: asyncio.AbstractEventLoop, stop: threading.Event, counts: Counter) -> None:
+        interval = settings.profile_sample_interval_ms / 1000
+        while not stop.wait(interval):
+            if self.scope_user_id is not None and asyncio.current_task(loop) not in self.scoped_tasks:
+                continue
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                counts[_fold(frame)] += 1
+
+    async def run(self, seconds: float, user_id: Optional[int] = None) -> ProfileReport:
+        """Профилирует seconds секунд (только апдейты user_id, если задан) и сохраняет результаты"""
+        if self._running:
+            raise RuntimeError("Профилирование уже идёт")
+        self._running = True
+        self.scope_user_id = user_id
+        os.makedirs(settings.profile_dir, exist_ok=True)
+        prefix = os.path.join(settings.profile_dir, datetime.now().strftime("%Y%m%d-%H%M%S"))
+        if user_id is not None:
+            prefix += f"-user{user_id}"
+
+        loop = asyncio.get_running_loop()
+        debug, slow_duration = loop.get_debug(), loop.slow_callback_duration
+        slow_handler = _SlowCallbackHandler(f"{prefix}-slow-callbacks.log")
+        asyncio_logger = logging.getLogger("asyncio")
+        started_tracemalloc = not tracemalloc.is_tracing()
+        counts: Counter = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample, args=(threading.get_ident(), loop, stop, counts), name="profiler", daemon=True
+        )
+
+        asyncio_logger.addHandler(slow_handler)
+        loop.slow_callback_duration = settings.profile_slow_callback_ms / 1000
+        loop.set_debug(True)
+        if started_tracemalloc:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        start = time.monotonic()
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.to_thread(sampler.join)
+            elapsed = time.monotonic() - start
+            snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+            if started_tracemalloc:
+                tracemalloc.stop()
+            loop.set_debug(debug)
+            loop.slow_callback_duration = slow_duration
+            asyncio_logger.removeHandler(slow_handler)
+            slow_handler.close()
+            self.scope_user_id = None
+            self.scoped_tasks.clear()
+            self._running = False
+
+        return await asyncio.to_thread(self._save, prefix, counts, snapshot, elapsed, slow_handler.count)
+
+    @staticmethod
+    def _save(prefix: str, counts: Counter, snapshot, elapsed: float, slow_callbacks: int) -> ProfileReport:
+        folded_path = f"{prefix}.folded"
+        with open(folded_path, "w", encoding="utf-8") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+        # Собственное время функции — отсчёты, где она на вершине стека
+        leaves: Counter = Counter()
+        for stack, count in counts.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+
+        tracemalloc_path = f"{prefix}.tracemalloc"
+        top_allocations = []
+        if snapshot is not None:
+            snapshot.dump(tracemalloc_path)
+            for stat in snapshot.statistics("lineno")[:TOP_LIMIT]:
+                frame = stat.traceback[0]
+                top_allocations.append(f"{os.path.basename(frame.filename)}:{frame.lineno} — {stat.size / 1024:.0f} КБ")
+
+        return ProfileReport(
+            samples=sum(counts.values()),
+            seconds=elapsed,
+            folded_path=folded_path,
+            slow_callbacks_path=f"{prefix}-slow-callbacks.log",
+            tracemalloc_path=tracemalloc_path,
+            top_functions=leaves.most_common(TOP_LIMIT),
+            slow_callbacks=slow_callbacks,
+            top_allocations=top_allocations,
+        )
+
+
+profiler = SamplingProfiler()
+
+
+def format_profile_report(report: ProfileReport) -> str:
+    text = f"🔬 <b>Профилирование завершено</b> ({report.seconds:.0f} с, отсчётов: {report.samples})\n\n"
+    if report.top_functions:
+        text += "<b>Собственное время:</b>\n"
+        for name, count in report.top_functions:
+            text += f"• {count / report.samples * 100:.1f}% <code>{name}</code>\n"
+    text += f"\n🐢 Медленных колбэков (> {settings.profile_slow_callback_ms} мс): {report.slow_callbacks}\n"
+    if report.top_allocations:
+        text += "\n<b>Память (tracemalloc):</b>\n"
+        text += "".join(f"• <code>{line}</code>\n" for line in report.top_allocations[:5])
+    text += (
+        f"\n📁 Файлы:\n<code>{report.folded_path}</code>\n"
+        f"<code>{report.slow_callbacks_path}</code>\n<code>{report.tracemalloc_path}</code>"
+    )
+    return text
+
+
+async def _run_with_report(bot: Bot, chat_id: int, seconds: float, user_id: Optional[int]) -> None:
+    try:
+        report = await profiler.run(seconds, user_id)
+        text = format_profile_report(report)
+    except Exception:
+        logger.exception("Ошибка профилирования")
+        text = "❌ Профилирование прервано из-за ошибки"
+    try:
+        await bot.send_message(chat_id, text, parse_mode="HTML")
+    except Exception:
+        logger.exception("Не удалось отправить отчёт профилирования")
+
+
+def start_profiling_task(bot: Bot, chat_id: int, seconds: float, user_id: Optional[int]) -> None:
+    task = asyncio.create_task(_run_with_report(bot, chat_id, seconds, user_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
@@ -0,0 +1,216 @@
+"""
+Квантильные скетчи KLL для обезличенного сравнения с другими пользователями.
+
+Скетч хранит O(k·log n) значений вместо всей выборки, объединяется с другими скетчами
+без потери гарантий точности и позволяет оценить ранг значения среди всех пользователей.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import zlib
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Ключ скетча ФЧИ; для УК используется "uk:<тип приёма пищи>"
+FCI_SKETCH_KEY = "fci"
+# Сколько значений должно быть в скетче, чтобы показывать сравнение
+MIN_POPULATION_SIZE = 50
+
+
+def uk_sketch_key(meal_type_value: str) -> str:
+    return f"uk:{meal_type_value}"
+
+
+class KLLSketch:
+    """Скетч KLL: уровни-компакторы, на уровне h каждый элемент весит 2^h"""
+
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.n = 0
+        self.levels: List[List[float]] = [[]]
+        self._size = 0
+        self._rng = random.Random()
+        self._cdf: Optional[tuple[List[float], List[int]]] = None
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(self.k * (2 / 3) ** depth))
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _compress(self) -> None:
+        while self._size > self._max_size():
+            for h, level in enumerate(self.levels):
+                if len(level) >= self._capacity(h):
+                    if h + 1 == len(self.levels):
+                        self.levels.append([])
+                    level.sort()
+                    # Оставляем каждый второй элемент со случайным сдвигом, вес удваивается
+                    promoted = level[self._rng.randint(0, 1) :: 2]
+                    self.levels[h + 1].extend(promoted)
+                    self._size -= len(level) - len(promoted)
+                    level.clear()
+                    break
+            else:
+                break
+
+    def update(self, value: float) -> None:
+        self.levels[0].append(float(value))
+        self.n += 1
+        self._size += 1
+        self._cdf = None
+        if self._size > self._max_size():
+            self._compress()
+
+    def merge(self, other: "KLLSketch") -> None:
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for h, level in enumerate(other.levels):
+            self.levels[h].extend(level)
+            self._size += len(level)
+        self.n += other.n
+        self._cdf = None
+        self._compress()
+
+    def _build_cdf(self) -> tuple[List[float], List[int]]:
+        if self._cdf is None:
+            weighted = sorted((value, 1 << h) for h, level in enumerate(self.levels) for value in level)
+            self._cdf = ([v for v, _ in weighted], list(accumulate(w for _, w in weighted)))
+        return self._cdf
+
+    def rank(self, value: float) -> float:
+        """Доля значений, не превышающих value (0..1)"""
+        values, cumulative = self._build_cdf()
+        if not values:
+            return 0.0
+        pos = bisect_right(values, value)
+        return cumulative[pos - 1] / cumulative[-1] if pos else 0.0
+
+    def quantile(self, q: float) -> Optional[float]:
+        values, cumulative = self._build_cdf()
+        if not values:
+            return None
+        target = q * cumulative[-1]
+        pos = min(bisect_right(cumulative, target), len(values) - 1)
+        return values[pos]
+
+    def to_bytes(self) -> bytes:
+        payload = {"k": self.k, "n": self.n, "levels": self.levels}
+        return zlib.compress(json.dumps(payload, separators=(",", ":")).encode())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "KLLSketch":
+        payload = json.loads(zlib.decompress(data))
+        sketch = cls(k=payload["k"])
+        sketch.n = payload["n"]
+        sketch.levels = [list(level) for level in payload["levels"]] or [[]]
+        sketch._size = sum(len(level) for level in sketch.levels)
+        return sketch
+
+
+class PopulationSketches:
+    """
+    Скетчи по всем пользователям в памяти процесса.
+
+    Запросы идут к общему скетчу (сохранённое в БД + локальные записи), а локальные
+    записи копятся в отдельном скетче и периодически сливаются со скетчем в БД,
+    поэтому несколько процессов бота не затирают данные друг друга.
+    """
+
+    def __init__(self, k: int = 200):
+        self.k = k
+        self._sketches: Dict[str, KLLSketch] = {}
+        self._pending: Dict[str, KLLSketch] = {}
+
+    def add(self, key: str, value: float) -> None:
+        for store in (self._sketches, self._pending):
+            sketch = store.get(key)
+            if sketch is None:
+                sketch = store[key] = KLLSketch(self.k)
+            sketch.update(value)
+
+    def merge(self, key: str, sketch: KLLSketch) -> None:
+        """Добавить целый скетч (например, после массового импорта)"""
+        for store in (self._sketches, self._pending):
+            target = store.get(key)
+            if target is None:
+                target = store[key] = KLLSketch(self.k)
+            target.merge(sketch)
+
+    def get(self, key: str) -> Optional[KLLSketch]:
+        return self._sketches.get(key)
+
+    def percentile(self, key: str, value: float) -> Optional[float]:
+        """Процент пользовательских значений не выше value; None, если данных мало"""
+        sketch = self._sketches.get(key)
+        if sketch is None or sketch.n < MIN_POPULATION_SIZE:
+            return None
+        return sketch.rank(value) * 100
+
+    async def load(self, session_factory) -> None:
+        """Загрузить сохранённые скетчи из БД"""
+        from db.repository import PopulationSketchRepository
+
+        async with session_factory() as session:
+            stored = await PopulationSketchRepository(session).get_all()
+
+        for key, payload in stored.items():
+            sketch = KLLSketch.from_bytes(payload)
+            local = self._pending.get(key)
+            if local is not None:
+                sketch.merge(local)
+            self._sketches[key] = sketch
+
+    async def flush(self, session_factory) -> None:
+        """Слить накопленные локально значения со скетчами в БД"""
+        from db.repository import PopulationSketchRepository
+
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        merged_by_key: Dict[str, KLLSketch] = {}
+        try:
+            async with session_factory() as session:
+                repo = PopulationSketchRepository(session)
+                for key, delta in pending.items():
+                    payload = await repo.get_for_update(key)
+                    merged = KLLSketch.from_bytes(payload) if payload else KLLSketch(self.k)
+                    merged.merge(delta)
+                    await repo.save(key, merged.to_bytes(), merged.n)
+                    merged_by_key[key] = merged
+                await session.commit()
+        except Exception:
+            # Возвращаем несохранённые значения, чтобы записать их в следующий раз
+            for key, delta in pending.items():
+                local = self._pending.get(key)
+                if local is not None:
+                    delta.merge(local)
+                self._pending[key] = delta
+            raise
+
+        for key, merged in merged_by_key.items():
+            # Значения, пришедшие во время записи, остаются в _pending до следующего сброса
+            local = self._pending.get(key)
+            if local is not None:
+                merged.merge(local)
+            self._sketches[key] = merged
+
+
+population_sketches = PopulationSketches()
+
+
+async def run_sketch_flush_loop(session_factory, interval: float) -> None:
+    """Периодически сохраняет скетчи в БД"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await population_sketches.flush(session_factory)
+        except Exception:
+            logger.exception("Не удалось сохранить квантильные скетчи")
@@ -0,0 +1,237 @@
+"""
+Отложенные напоминания.
+
+Ожидающие напоминания лежат в памяти в иерархическом колесе таймеров: 4 уровня по 64 слота
+с шагом в 1 секунду покрывают ~194 дня. Добавление и отмена — O(1), за тик обрабатывается
+один слот (и изредка переносится слот верхнего уровня). Каждое напоминание хранится и
+в таблице reminders: при запуске колесо заполняется из неё, после отправки строка удаляется.
+Хранилище FSM живёт в памяти и после перезапуска пусто, поэтому вместе с напоминанием можно
+сохранить данные сценария (payload), по которым обработчик восстановит состояние пользователя.
+Отправка идёт пулом воркеров через ограничитель частоты из app.sender.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.fsm.storage.base import BaseStorage
+
+from db.repository import ReminderRepository
+from db.session import async_session
+
+logger = logging.getLogger(__name__)
+
+WHEEL_BITS = 6
+WHEEL_SIZE = 1 << WHEEL_BITS
+WHEEL_MASK = WHEEL_SIZE - 1
+WHEEL_LEVELS = 4
+
+# Размер порции при загрузке напоминаний из БД
+LOAD_BATCH_SIZE = 10_000
+
+# Типы напоминаний
+REMINDER_GLUCOSE_END = "glucose_end"
+
+
+class PendingReminder(NamedTuple):
+    id: int
+    user_id: int
+    chat_id: int
+    kind: str
+    due_at: datetime
+    # Загружено из БД при запуске (состояние FSM пользователя могло потеряться при перезапуске)
+    restored: bool = False
+
+
+ReminderHandler = Callable[[Bot, BaseStorage, PendingReminder], Awaitable[None]]
+
+
+class TimingWheel:
+    """Иерархическое колесо таймеров с шагом в один тик"""
+
+    def __init__(self, tick: int):
+        self._tick = tick
+        self._levels: list[list[dict[Any, tuple[int, Any]]]] = [
+            [{} for _ in range(WHEEL_SIZE)] for _ in range(WHEEL_LEVELS)
+        ]
+        self._slot_of: dict[Any, dict[Any, tuple[int, Any]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def _slot_for(self, due_tick: int) -> dict:
+        delta = due_tick - self._tick
+        if delta <= 0:
+            # Уже просрочено — сработает на следующем тике
+            return self._levels[0][(self._tick + 1) & WHEEL_MASK]
+        for level in range(WHEEL_LEVELS):
+            if delta < 1 << (WHEEL_BITS * (level + 1)):
+                return self._levels[level][(due_tick >> (WHEEL_BITS * level)) & WHEEL_MASK]
+        # Дальше горизонта колеса: слот верхнего уровня, который перенесётся последним
+        shift = WHEEL_BITS * (WHEEL_LEVELS - 1)
+        return self._levels[-1][((self._tick >> shift) - 1) & WHEEL_MASK]
+
+    def _insert(self, key, due_tick: int, item) -> None:
+        slot = self._slot_for(due_tick)
+        slot[key] = (due_tick, item)
+        self._slot_of[key] = slot
+
+    def add(self, key, due_tick: int, item) -> None:
+        self.cancel(key)
+        self._insert(key, due_tick, item)
+
+    def cancel(self, key) -> bool:
+        slot = self._slot_of.pop(key, None)
+        if slot is None:
+            return False
+        del slot[key]
+        return True
+
+    def advance(self, tick: int) -> list:
+        """Сдвигает колесо до тика tick и возвращает сработавшие элементы"""
+        expired = []
+        while self._tick < tick:
+            self._tick += 1
+            # На границе уровня раскладываем его очередной слот по нижним уровням
+            for level in range(1, WHEEL_LEVELS):
+                shift = WHEEL_BITS * level
+                if self._tick & ((1 << shift) - 1):
+                    break
+                slot = self._levels[level][(self._tick >> shift) & WHEEL_MASK]
+                entries = list(slot.items())
+                slot.clear()
+                for key, (due_tick, item) in entries:
+                    if due_tick <= self._tick:
+                        del self._slot_of[key]
+                        expired.append(item)
+                    else:
+                        self._insert(key, due_tick, item)
+
+            slot = self._levels[0][self._tick & WHEEL_MASK]
+            for key, (_, item) in slot.items():
+                del self._slot_of[key]
+                expired.append(item)
+            slot.clear()
+        return expired
+
+
+def _to_tick(moment: datetime) -> int:
+    if moment.tzinfo is None:
+        # SQLite не хранит часовой пояс; время напоминаний записывается в UTC
+        moment = moment.replace(tzinfo=timezone.utc)
+    return math.ceil(moment.timestamp())
+
+
+class ReminderScheduler:
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self._wheel = TimingWheel(int(time.time()))
+        # (пользователь, тип) -> id ожидающего напоминания: отмена без запроса к БД, если напоминания нет
+        self._ids: dict[tuple[int, str], int] = {}
+        self._handlers: dict[str, ReminderHandler] = {}
+        self._queue: asyncio.Queue[PendingReminder] = asyncio.Queue()
+        # Обработанные напоминания, которые удаляются из БД пачкой раз в тик
+        self._done: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self._wheel)
+
+    def register(self, kind: str, handler: ReminderHandler) -> None:
+        self._handlers[kind] = handler
+
+    def _add(self, reminder: PendingReminder) -> None:
+        self._wheel.add(reminder.id, _to_tick(reminder.due_at), reminder)
+        self._ids[(reminder.user_id, reminder.kind)] = reminder.id
+
+    async def load(self) -> None:
+        """Заполняет колесо напоминаниями из БД"""
+        last_id = 0
+        async with self.session_factory() as session:
+            repo = ReminderRepository(session)
+            while batch := await repo.get_batch(last_id, LOAD_BATCH_SIZE):
+                for row in batch:
+                    self._add(PendingReminder(row.id, row.user_id, row.chat_id, row.kind, row.due_at, restored=True))
+                last_id = batch[-1].id
+        logger.info(f"Загружено напоминаний: {len(self._wheel)}")
+
+    async def schedule(
+        self, user_id: int, chat_id: int, kind: str, due_at: datetime, payload: Optional[str] = None
+    ) -> None:
+        """Запланировать напоминание; прежнее напоминание того же типа заменяется"""
+        async with self.session_factory() as session:
+            reminder, replaced_id = await ReminderRepository(session).replace(user_id, chat_id, kind, due_at, payload)
+        if replaced_id is not None:
+            self._wheel.cancel(replaced_id)
+        self._add(PendingReminder(reminder.id, user_id, chat_id, kind, due_at))
+
+    async def get_payload(self, reminder_id: int) -> Optional[str]:
+        """Данные сценария, сохранённые вместе с напоминанием"""
+        async with self.session_factory() as session:
+            return await ReminderRepository(session).get_payload(reminder_id)
+
+    async def cancel(self, user_id: int, kind: str) -> None:
+        """
+        Отменить напоминание (сценарий завершён, отменён или начат другой). Строка удаляется из БД,
+        поэтому отменённое напоминание не восстановится после перезапуска.
+        """
+        pending_id = self._ids.get((user_id, kind))
+        if pending_id is None:
+            return
+        async with self.session_factory() as session:
+            reminder_id = await ReminderRepository(session).delete_by_kind(user_id, kind)
+        if self._ids.get((user_id, kind)) == pending_id:
+            del self._ids[(user_id, kind)]
+        if reminder_id is not None:
+            self._wheel.cancel(reminder_id)
+
+    async def _flush_done(self) -> None:
+        if not self._done:
+            return
+        ids, self._done = self._done, []
+        try:
+            async with self.session_factory() as session:
+                await ReminderRepository(session).delete_many(ids)
+        except Exception:
+            logger.exception("Не удалось удалить отправленные напоминания")
+            self._done.extend(ids)
+
+    async def _worker(self, bot: Bot, storage: BaseStorage) -> None:
+        while True:
+            reminder = await self._queue.get()
+            try:
+                handler = self._handlers.get(reminder.kind)
+                if handler is None:
+                    logger.warning(f"Нет обработчика для напоминания типа {reminder.kind}")
+                else:
+                    await handler(bot, storage, reminder)
+            except TelegramForbiddenError:
+                logger.info(f"Пользователь {reminder.user_id} заблокировал бота, напоминание пропущено")
+            except Exception:
+                logger.exception(f"Не удалось отправить напоминание {reminder.id}")
+            finally:
+                self._done.append(reminder.id)
+                self._queue.task_done()
+
+    async def run(self, bot: Bot, storage: BaseStorage, workers: int) -> None:
+        """Раз в секунду сдвигает колесо и передаёт сработавшие напоминания воркерам"""
+        worker_tasks = [asyncio.create_task(self._worker(bot, storage)) for _ in range(workers)]
+        try:
+            while True:
+                await asyncio.sleep(1 - time.time() % 1)
+                for reminder in self._wheel.advance(int(time.time())):
+                    if self._ids.get((reminder.user_id, reminder.kind)) == reminder.id:
+                        del self._ids[(reminder.user_id, reminder.kind)]
+                    self._queue.put_nowait(reminder)
+                await self._flush_done()
+        finally:
+            for task in worker_tasks:
+                task.cancel()
+            await self._flush_done()
+
+
+reminder_scheduler = ReminderScheduler(async_session)
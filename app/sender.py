@@ -0,0 +1,138 @@
+"""
+Отправка сообщений, инициированных ботом (напоминания, рассылки), с учётом лимитов Telegram.
+
+Используются два маркерных ведра: общее на бота и отдельное на каждый чат. Ожидание
+резервируется заранее, поэтому одновременные отправители встают в очередь без гонок.
+При ответе 429 (retry_after) общее ведро ставится на паузу для всех отправителей.
+"""
+
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import Message
+
+from config.base import settings
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз повторять отправку после 429
+MAX_RETRIES = 3
+# Сколько вёдер по чатам держать в памяти (вытесняются давно не использованные)
+MAX_CHAT_BUCKETS = 10_000
+
+
+class TokenBucket:
+    """Маркерное ведро: rate маркеров в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Забирает маркер и возвращает, сколько секунд подождать до его появления"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Не выдавать маркеры ближайшие seconds секунд"""
+        self.reserve()
+        self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+
+class RateLimiter:
+    def __init__(self, rate: float, chat_rate: float):
+        self.chat_rate = chat_rate
+        self._global = TokenBucket(rate, capacity=rate)
+        self._chats: OrderedDict[int, TokenBucket] = OrderedDict()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate)
+            if len(self._chats) > MAX_CHAT_BUCKETS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id: int) -> None:
+        wait = self._chat_bucket(chat_id).reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        wait = self._global.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        self._global.pause(seconds)
+
+
+rate_limiter = RateLimiter(settings.send_rate_limit, settings.send_chat_rate_limit)
+
+
+async def send_message(bot: Bot, chat_id: int, text: str, **kwargs) -> Message:
+    """Отправляет сообщение с учётом лимитов; TelegramForbiddenError и прочие ошибки пробрасываются"""
+    for attempt in range(MAX_RETRIES + 1):
+        await rate_limiter.acquire(chat_id)
+        try:
+            return await bot.send_message(chat_id, text, **kwargs)
+        except TelegramRetryAfter as e:
+            if attempt == MAX_RETRIES:
+                raise
+            logger.warning(f"Превышен лимит Telegram, пауза {e.retry_after} с")
+            rate_limiter.pause(e.retry_after)
+
+
+async def fan_out(
+    bot: Bot,
+    batches: AsyncIterator[tuple[int, list[tuple[int, str]]]],
+    workers: int,
+    on_batch_sent: Optional[Callable[[int, Counter], Awaitable[None]]] = None,
+    stats: Optional[Counter] = None,
+    **kwargs,
+) -> Counter:
+    """
+    Рассылка порциями: batches выдаёт (курсор, [(chat_id, текст)]). Сообщения идут через
+    ограниченную очередь пулу из workers отправителей; когда порция отправлена целиком,
+    вызывается on_batch_sent(курсор, счётчики) — там сохраняется контрольная точка.
+    Счётчики: delivered, blocked (бот заблокирован), failed.
+    """
+    stats = stats if stats is not None else Counter()
+    queue: asyncio.Queue[tuple[int, str]] = asyncio.Queue(maxsize=workers * 2)
+
+    async def worker():
+        while True:
+            chat_id, text = await queue.get()
+            try:
+                await send_message(bot, chat_id, text, **kwargs)
+                stats["delivered"] += 1
+            except TelegramForbiddenError:
+                stats["blocked"] += 1
+            except Exception as e:
+                logger.warning(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+                stats["failed"] += 1
+            finally:
+                queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        async for cursor, messages in batches:
+            for message in messages:
+                await queue.put(message)
+            await queue.join()
+            if on_batch_sent is not None:
+                await on_batch_sent(cursor, stats)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return stats
@@ -19,6 +19,7 @@ class MealStates(StatesGroup):
     waiting_for_carbs_additional = State()
     waiting_for_proteins = State()
     waiting_for_fats = State()
+    waiting_for_food_weight = State()
     waiting_for_insulin_food = State()
     waiting_for_glucose_end = State()
     waiting_for_additional_injections = State()
@@ -39,3 +40,15 @@ class CaloriesStates(StatesGroup):
     waiting_for_height_cm = State()
     waiting_for_activity = State()
     waiting_for_metabolic_range = State()
+
+
+class ImportStates(StatesGroup):
+    waiting_for_file = State()
+
+
+class CGMStates(StatesGroup):
+    waiting_for_file = State()
+
+
+class BroadcastStates(StatesGroup):
+    waiting_for_confirmation = State()
@@ -0,0 +1,274 @@
+"""
+Трассировка апдейтов: из чего складывается время обработки одного нажатия.
+
+Трасса открывается на каждый апдейт (TracingMiddleware), внутри неё спаны middleware пользователя,
+обработчика, каждого SQL-запроса и каждого вызова Bot API. Текущий спан хранится в contextvars,
+поэтому вложенность сохраняется в корутинах и в потоках-гринлетах SQLAlchemy; вне трассы span()
+ничего не делает.
+
+Решение о сохранении принимается после завершения апдейта (tail sampling): сохраняются все трассы
+с ошибкой, все трассы дольше trace_slow_ms и trace_sample_percent процентов остальных. Сохранённые
+трассы дописываются в trace_path строками JSON в формате OTLP (ExportTraceServiceRequest) —
+файл принимает OpenTelemetry Collector (приёмник otlpjsonfile) и Jaeger.
+"""
+
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.buffered_writer import BufferedFileWriter
+from db.instrumentation import fingerprint
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "diabetbot"
+TRACE_FLUSH_INTERVAL = 5.0
+# Больше спанов в одной трассе не храним (например, цикл из тысяч запросов)
+MAX_SPANS_PER_TRACE = 1000
+
+# Коды вида спана и статуса OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+@dataclass
+class Span:
+    trace: "Trace"
+    span_id: str
+    parent_id: str
+    name: str
+    kind: int = SPAN_KIND_INTERNAL
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: int = 0
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set_error(self, error: BaseException) -> None:
+        self.error = f"{type(error).__name__}: {error}"
+
+
+@dataclass
+class Trace:
+    trace_id: str
+    spans: list[Span] = field(default_factory=list)
+    dropped: int = 0
+    finished: bool = False
+
+    def add(self, span: Span) -> None:
+        if self.finished:
+            return
+        if len(self.spans) < MAX_SPANS_PER_TRACE:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def _start_span(name: str, kind: int, attributes: dict[str, Any], parent: Optional[Span]) -> Span:
+    trace = parent.trace if parent is not None else Trace(_new_id(128))
+    return Span(trace, _new_id(64), parent.span_id if parent is not None else "", name, kind, attributes=attributes)
+
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Вложенный спан текущей трассы; вне трассы отдаёт None и ничего не записывает"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    current = _start_span(name, kind, attributes, parent)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = time.time_ns()
+        current.trace.add(current)
+
+
+def _attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def _otlp_span(span: Span) -> dict:
+    entry = {
+        "traceId": span.trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [_attribute(key, value) for key, value in span.attributes.items()],
+        "status": {"code": STATUS_ERROR, "message": span.error} if span.error else {"code": STATUS_OK},
+    }
+    if span.parent_id:
+        entry["parentSpanId"] = span.parent_id
+    return entry
+
+
+def to_otlp(trace: Trace) -> dict:
+    """Трасса как ExportTraceServiceRequest в JSON-представлении OTLP"""
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": [_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [_otlp_span(span) for span in trace.spans]}],
+            }
+        ]
+    }
+
+
+class TraceFileExporter(BufferedFileWriter):
+    """Копит сохранённые трассы в памяти и дописывает их в файл из фонового потока"""
+
+    def __init__(self, path: str):
+        super().__init__(path, "трасс", TRACE_FLUSH_INTERVAL)
+
+    def export(self, trace: Trace) -> None:
+        self.add(lambda: json.dumps(to_otlp(trace), ensure_ascii=False))
+
+    async def start(self) -> None:
+        await super().start()
+        logger.info(f"Трассы апдейтов записываются в {self.path}")
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: корневой спан апдейта и решение о сохранении трассы"""
+
+    def __init__(self, exporter: TraceFileExporter, slow_ms: int, sample_percent: int):
+        self.exporter = exporter
+        self.slow_ns = slow_ms * 1_000_000
+        self.sample_rate = sample_percent / 100
+
+    def _keep(self, root: Span) -> bool:
+        if root.error or any(span.error for span in root.trace.spans):
+            return True
+        return root.end_ns - root.start_ns >= self.slow_ns or random.random() < self.sample_rate
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        attributes = {"update.id": event.update_id, "update.type": event.event_type}
+        user = getattr(event.event, "from_user", None)
+        if user is not None:
+            attributes["user.id"] = user.id
+        root = _start_span(f"update {event.event_type}", SPAN_KIND_SERVER, attributes, None)
+        token = _current_span.set(root)
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            root.set_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            root.end_ns = time.time_ns()
+            trace = root.trace
+            trace.spans.insert(0, root)
+            trace.finished = True
+            if trace.dropped:
+                root.attributes["spans.dropped"] = trace.dropped
+            if self._keep(root):
+                self.exporter.export(trace)
+
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """Внутренний middleware: спан выбранного обработчика с состоянием FSM"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        callback = getattr(data.get("handler"), "callback", None)
+        name = f"{getattr(callback, '__module__', '')}.{getattr(callback, '__qualname__', 'unknown')}"
+        with span(name, **{"fsm.state": data.get("raw_state") or "none"}):
+            return await handler(event, data)
+
+
+class TracingSessionMiddleware(BaseRequestMiddleware):
+    """Middleware сессии Bot: спан каждого вызова Bot API"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        # Ошибки API приходят исключениями и попадают в статус спана
+        with span(f"telegram {type(method).__name__}", SPAN_KIND_CLIENT):
+            return await make_request(bot, method)
+
+
+# Вне трассы в стек кладётся None, чтобы начало и конец запроса всегда оставались парными
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current_span.get()
+    current = _start_span("sql", SPAN_KIND_CLIENT, {}, parent) if parent is not None else None
+    conn.info.setdefault("trace_spans", []).append(current)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    current = conn.info["trace_spans"].pop()
+    if current is None:
+        return
+    current.end_ns = time.time_ns()
+    normalized = fingerprint(statement)
+    current.name = f"sql {normalized.split(' ', 1)[0]}"
+    current.attributes["db.statement"] = normalized
+    current.trace.add(current)
+
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    spans = connection.info.get("trace_spans") if connection is not None else None
+    current = spans.pop() if spans else None
+    if current is not None:
+        current.end_ns = time.time_ns()
+        current.attributes["db.statement"] = fingerprint(exception_context.statement or "")
+        current.set_error(exception_context.original_exception)
+        current.trace.add(current)
+
+
+def trace_engine(engine: AsyncEngine) -> None:
+    """Подключает спаны SQL-запросов к движку (повторный вызов ничего не меняет)"""
+    if event.contains(engine.sync_engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", _handle_error)
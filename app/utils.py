@@ -1,5 +1,8 @@
-from datetime import date, timedelta
+import math
+from datetime import date, datetime, time, timedelta
 from typing import Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from config.base import settings
 from db.models import MealType
 
 
@@ -17,6 +20,33 @@ def format_date(date_obj: date) -> str:
     return date_obj.strftime("%d.%m.%Y")
 
 
+def get_user_zone(tz_name: str | None) -> ZoneInfo:
+    """Часовой пояс пользователя (или пояс по умолчанию, если не задан или неизвестен)"""
+    try:
+        return ZoneInfo(tz_name or settings.default_timezone)
+    except (ZoneInfoNotFoundError, ValueError, OSError):
+        return ZoneInfo(settings.default_timezone)
+
+
+def get_fci_window(target_date: date, zone: ZoneInfo) -> Tuple[datetime, datetime]:
+    """Границы окна суток для ФЧИ (по умолчанию с 8:00 до 24:00 местного времени)"""
+    midnight = datetime.combine(target_date, time(), tzinfo=zone)
+    return (
+        midnight + timedelta(hours=settings.fci_window_start_hour),
+        midnight + timedelta(hours=settings.fci_window_end_hour),
+    )
+
+
+def get_local_day(target_date: date, zone: ZoneInfo) -> Tuple[datetime, datetime]:
+    """Границы суток [полночь, следующая полночь) по местному времени"""
+    midnight = datetime.combine(target_date, time(), tzinfo=zone)
+    return midnight, datetime.combine(target_date + timedelta(days=1), time(), tzinfo=zone)
+
+
+def format_fci_window() -> str:
+    return f"с {settings.fci_window_start_hour}:00 до {settings.fci_window_end_hour}:00"
+
+
 def calculate_fci(day1: float, day2: float, day3: float) -> float:
     """Рассчитывает ФЧИ по формуле"""
     average = (day1 + day2 + day3) / 3
@@ -73,12 +103,58 @@ def calculate_uk(
     return uk
 
 
+# Минимум записей для оценки отклонения УК от обычного
+OUTLIER_MIN_COUNT = 5
+# Порог |z|, начиная с которого УК считается нетипичным
+OUTLIER_Z_THRESHOLD = 2.5
+
+
+def running_std(count: int, m2: float) -> float:
+    """Выборочное стандартное отклонение по накопленной сумме квадратов отклонений"""
+    if count < 2:
+        return 0.0
+    return math.sqrt(max(m2, 0.0) / (count - 1))
+
+
+def calculate_z_score(value: float, count: int, mean: float, m2: float) -> float | None:
+    """z-оценка значения относительно накопленной статистики (None, если данных мало)"""
+    std = running_std(count, m2)
+    if count < OUTLIER_MIN_COUNT or std == 0:
+        return None
+    return (value - mean) / std
+
+
 def get_meal_type_name(meal_type: MealType) -> str:
     """Возвращает русское название типа приёма пищи"""
     names = {MealType.BREAKFAST: "Завтрак", MealType.LUNCH: "Обед", MealType.SNACK: "Полдник", MealType.DINNER: "Ужин"}
     return names.get(meal_type, meal_type.value)
 
 
+def format_period_stats(
+    fci_stats: tuple[int, float, float, float] | None, uk_stats: dict[MealType, tuple[int, float]]
+) -> str:
+    """Блоки ФЧИ и УК по приёмам пищи для статистики за период и итогов недели"""
+    if fci_stats and fci_stats[0]:
+        count, avg_fci, min_fci, max_fci = fci_stats
+        text = "📈 <b>ФЧИ:</b>\n"
+        text += f"• Количество записей: {count}\n"
+        text += f"• Среднее значение: {avg_fci:.2f}\n"
+        text += f"• Минимум: {min_fci:.2f}\n"
+        text += f"• Максимум: {max_fci:.2f}\n\n"
+    else:
+        text = "📈 <b>ФЧИ:</b> Нет данных\n\n"
+
+    text += "🍽️ <b>УК по приёмам пищи:</b>\n"
+    for meal_type in [MealType.BREAKFAST, MealType.LUNCH, MealType.SNACK, MealType.DINNER]:
+        meal_name = get_meal_type_name(meal_type)
+        if meal_type in uk_stats:
+            count, avg_uk = uk_stats[meal_type]
+            text += f"• {meal_name}: {count} записей, среднее УК: {avg_uk:.3f}\n"
+        else:
+            text += f"• {meal_name}: Нет данных\n"
+    return text
+
+
 def parse_glucose_input(text: str) -> float:
     """Парсит ввод уровня глюкозы"""
     try:
@@ -103,42 +179,74 @@ def parse_number_input(text: str) -> float:
 
 async def calculate_daily_insulin_from_meals(user_id: int, target_date: date, session) -> float:
     """Рассчитывает общий инсулин за день из записей о приёмах пищи"""
-    from db.repository import MealRecordRepository
+    from db.repository import InsulinRecordRepository
 
-    meal_repo = MealRecordRepository(session)
-    meals = await meal_repo.get_by_date(user_id, target_date)
+    # Инсулин на еду + дополнительный инсулин (подколки) суммируется представлением meal_insulin_daily
+    return await InsulinRecordRepository(session).get_auto_total_by_date(user_id, target_date)
 
-    total_insulin = 0.0
-    for meal in meals:
-        # Инсулин на еду + дополнительный инсулин (подколки)
-        total_insulin += float(meal.insulin_food) + float(meal.insulin_additional)
 
-    return total_insulin
+async def save_fci(user_id: int, target_date: date, value: float, session):
+    """
+    Сохраняет ФЧИ за день и добавляет значение в квантильный скетч.
+
+    В скетч попадают только новые записи: старое значение из скетча не удалить, поэтому
+    перезапись не добавляет ещё одно (расхождение исправляет scripts/rebuild_sketches.py).
+    """
+    from app.quantiles import population_sketches, FCI_SKETCH_KEY
+    from db.repository import FCIRepository
 
+    fci, created = await FCIRepository(session).update_or_create(user_id=user_id, date=target_date, value=value)
+    if created:
+        population_sketches.add(FCI_SKETCH_KEY, value)
+    return fci
 
-async def get_insulin_for_fci(user_id: int, target_date: date, session) -> float:
+
+async def get_insulin_for_fci_days(user_id: int, dates: list[date], session, zone: ZoneInfo) -> dict[date, float]:
     """
-    Получает ВЕСЬ инсулин за день для расчета ФЧИ.
+    Получает ВЕСЬ инсулин по каждому дню для расчета ФЧИ (не больше трёх запросов на все дни).
 
-    Приоритет:
+    Приоритет для каждого дня:
     1. Ручной ввод (is_manual=1) - если пользователь вручную ввел инсулин для этого дня, берем ТОЛЬКО его
-    2. Автоматические записи (is_manual=0) - суммирование всех записей из приемов пищи
-    3. Если нет ни того, ни того - возвращаем 0 (система запросит ручной ввод у пользователя)
+    2. Журнал инъекций - сумма доз в окне суток для ФЧИ (zone - часовой пояс пользователя);
+       если инъекции за сутки записаны, но все вне окна, за день берётся 0
+    3. Приёмы пищи - инсулин из meal_records (для дней до появления журнала инъекций)
+
+    Оба источника считают подколки с коррекцией (как meal_records.insulin_additional).
+    4. Если нет ничего - 0 (система запросит ручной ввод у пользователя)
     """
-    from db.repository import InsulinRecordRepository
+    from db.repository import InsulinRecordRepository, InsulinDoseRepository
 
     insulin_repo = InsulinRecordRepository(session)
+    totals = {day: 0.0 for day in dates}
 
     # Приоритет 1: Ручной ввод (пользователь вручную ввел данные для ФЧИ)
-    # Если есть ручная запись, берем ее и ВСЁ - не ищем больше ничего
-    manual_total = await insulin_repo.get_manual_total_by_date(user_id, target_date)
-    if manual_total > 0:
-        return manual_total
-
-    # Приоритет 2: Автоматические записи (суммируются все записи из приемов пищи)
-    auto_total = await insulin_repo.get_auto_total_by_date(user_id, target_date)
-    if auto_total > 0:
-        return auto_total
-
-    # Приоритет 3: Нет данных - возвращаем 0, система запросит ручной ввод
-    return 0.0
+    for day, total in (await insulin_repo.get_manual_totals_by_dates(user_id, dates)).items():
+        if total > 0:
+            totals[day] = total
+    missing = [day for day in dates if totals[day] <= 0]
+
+    # Приоритет 2: Инъекции с точным временем, суммируются только внутри окна. День с журналом
+    # инъекций не берётся из приёмов пищи, иначе туда вернулись бы дозы, исключённые окном
+    if missing:
+        window_totals = await InsulinDoseRepository(session).get_window_totals(
+            user_id,
+            {day: get_fci_window(day, zone) for day in missing},
+            {day: get_local_day(day, zone) for day in missing},
+        )
+        for day, total in window_totals.items():
+            totals[day] = total or 0.0
+        missing = [day for day in missing if day not in window_totals]
+
+    # Приоритет 3: Инсулин из приёмов пищи (представление meal_insulin_daily)
+    if missing:
+        for day, total in (await insulin_repo.get_auto_totals_by_dates(user_id, missing)).items():
+            if total and total > 0:
+                totals[day] = total
+
+    # Приоритет 4: Нет данных - остаётся 0, система запросит ручной ввод
+    return totals
+
+
+async def get_insulin_for_fci(user_id: int, target_date: date, session, zone: ZoneInfo) -> float:
+    """ВЕСЬ инсулин за один день для расчета ФЧИ (см. get_insulin_for_fci_days)"""
+    return (await get_insulin_for_fci_days(user_id, [target_date], session, zone))[target_date]
@@ -0,0 +1,90 @@
+"""
+Сторож цикла asyncio: все пользователи обслуживаются одним циклом, и синхронный код
+(расчёты, pandas/matplotlib, запись журнала) задерживает всех сразу.
+
+Задача цикла каждые loop_watchdog_interval_ms засыпает на интервал и измеряет, насколько позже
+она проснулась (отставание цикла). Отдельный поток следит за отметками задачи: если цикл
+не отвечает дольше loop_lag_threshold_ms, поток снимает стек основного потока — это и есть
+блокирующий код — и пишет его в журнал. Отставание выгружается гистограммой и перцентилями
+за последнюю минуту.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+from app.metrics import loop_blocked, loop_lag, loop_lag_quantiles
+from config.base import settings
+
+logger = logging.getLogger(__name__)
+
+# Окно для перцентилей отставания и как часто они пересчитываются
+LAG_WINDOW_SECONDS = 60
+QUANTILES_UPDATE_SECONDS = 5
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self._window: deque[float] = deque(maxlen=max(1, int(LAG_WINDOW_SECONDS / interval)))
+        # Время последнего пробуждения задачи; читается потоком-сторожем
+        self._heartbeat = time.monotonic()
+
+    def _update_quantiles(self) -> None:
+        values = sorted(self._window)
+        for q in QUANTILES:
+            loop_lag_quantiles.labels(str(q)).set(values[min(len(values) - 1, int(q * len(values)))])
+        loop_lag_quantiles.labels("1").set(values[-1])
+
+    def _watch(self, thread_id: int, stop: threading.Event) -> None:
+        """Поток-сторож: снимает стек цикла один раз за каждую блокировку"""
+        reported: Optional[float] = None
+        while not stop.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.threshold or heartbeat == reported:
+                continue
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            reported = heartbeat
+            loop_blocked.inc()
+            stack = "".join(traceback.format_stack(frame))
+            logger.warning(f"Цикл asyncio заблокирован уже {stalled * 1000:.0f} мс, стек:\n{stack}")
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stop = threading.Event()
+        watcher = threading.Thread(target=self._watch, args=(threading.get_ident(), stop), name="loop-watchdog", daemon=True)
+        watcher.start()
+        last_quantiles = loop.time()
+        try:
+            while True:
+                self._heartbeat = time.monotonic()
+                start = loop.time()
+                await asyncio.sleep(self.interval)
+                now = loop.time()
+                lag = max(0.0, now - start - self.interval)
+                loop_lag.observe(lag)
+                self._window.append(lag)
+                if lag >= self.threshold:
+                    logger.warning(f"Цикл asyncio был заблокирован {lag * 1000:.0f} мс")
+                if now - last_quantiles >= QUANTILES_UPDATE_SECONDS:
+                    self._update_quantiles()
+                    last_quantiles = now
+        finally:
+            stop.set()
+
+
+def create_loop_watchdog() -> Optional[LoopWatchdog]:
+    """Сторож по настройкам; None, если loop_watchdog_interval_ms = 0"""
+    if not settings.loop_watchdog_interval_ms:
+        return None
+    return LoopWatchdog(settings.loop_watchdog_interval_ms / 1000, settings.loop_lag_threshold_ms / 1000)
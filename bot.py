@@ -2,15 +2,37 @@ from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from config.base import settings
 from app.handlers import start, fci, meal, statistics, cancel
-from app.handlers import calories
+from app.handlers import calories, export, history_import, cgm, admin
+from app.logging_setup import setup_logging
+from app.middlewares.logging_middleware import CorrelationMiddleware
 from app.middlewares.user_middleware import UserMiddleware
+from app.middlewares.metrics_middleware import HandlerMetricsMiddleware, UpdateMetricsMiddleware
+from app.middlewares.recorder_middleware import UpdateRecorderMiddleware
+from app.middlewares.profiler_middleware import ProfilerMiddleware
+from app.middlewares.funnel_middleware import FunnelMiddleware
+from app.metrics import start_metrics_server
+from app.watchdog import create_loop_watchdog
+from app.tracing import (
+    HandlerTracingMiddleware,
+    TraceFileExporter,
+    TracingMiddleware,
+    TracingSessionMiddleware,
+    trace_engine,
+)
+from app.food_index import load_food_index
+from app.quantiles import population_sketches, run_sketch_flush_loop
+from app.funnel import funnel_tracker, run_funnel_flush_loop
+from app.scheduler import reminder_scheduler, REMINDER_GLUCOSE_END
+from app.digest import run_weekly_digest_loop
+from app.broadcast import resume_broadcasts
+from app.jobs import job_queue
 from db.models import Base
-from db.session import engine
+from db.session import engine, async_session
 import asyncio
 import logging
 
 # Настройка логирования
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -21,18 +43,47 @@ async def create_tables():
     logger.info("Таблицы базы данных созданы")
 
 
-async def main():
-    """Основная функция запуска бота"""
-    # Создаём бота и диспетчер
-    bot = Bot(token=settings.bot_token)
+def create_dispatcher() -> Dispatcher:
+    """Диспетчер со всеми middleware и роутерами (без фоновых задач и подключения к Telegram)"""
     dp = Dispatcher(storage=MemoryStorage())
 
-    # Добавляем middleware
+    # Добавляем middleware (id апдейта в журнале — первым, чтобы его видели все остальные)
+    dp.update.outer_middleware(CorrelationMiddleware())
     dp.message.middleware(UserMiddleware())
     dp.callback_query.middleware(UserMiddleware())
 
-    # Создаём таблицы
-    await create_tables()
+    # Метрики: время обработки по роутерам, обработчикам и состояниям FSM
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    for event_name, observer in dp.observers.items():
+        if event_name not in ("update", "error"):
+            observer.middleware(HandlerMetricsMiddleware())
+
+    # Воронка сценариев FSM: время в состояниях и брошенные шаги
+    dp.message.middleware(FunnelMiddleware())
+    dp.callback_query.middleware(FunnelMiddleware())
+
+    # Трассы апдейтов: спаны обработчиков и SQL (спаны вызовов Bot API добавляет сессия бота)
+    if settings.trace_path:
+        exporter = TraceFileExporter(settings.trace_path)
+        dp.update.outer_middleware(TracingMiddleware(exporter, settings.trace_slow_ms, settings.trace_sample_percent))
+        for event_name, observer in dp.observers.items():
+            if event_name not in ("update", "error"):
+                observer.middleware(HandlerTracingMiddleware())
+        trace_engine(engine)
+        dp.startup.register(exporter.start)
+        dp.shutdown.register(exporter.close)
+
+    # Профилирование по команде /profile (пока сеанс не запущен, middleware ничего не делает)
+    dp.update.outer_middleware(ProfilerMiddleware())
+
+    # Запись входящих апдейтов для воспроизведения нагрузки
+    if settings.record_updates_path:
+        recorder = UpdateRecorderMiddleware(
+            settings.record_updates_path, settings.record_updates_key, settings.record_updates_percent
+        )
+        dp.update.outer_middleware(recorder)
+        dp.startup.register(recorder.start)
+        dp.shutdown.register(recorder.close)
 
     # Регистрируем роутеры
     dp.include_router(cancel.router)  # Общий обработчик отмены должен быть первым
@@ -41,6 +92,69 @@ async def main():
     dp.include_router(meal.router)
     dp.include_router(statistics.router)
     dp.include_router(calories.router)
+    dp.include_router(export.router)
+    dp.include_router(history_import.router)
+    dp.include_router(cgm.router)
+    dp.include_router(admin.router)
+    return dp
+
+
+async def main():
+    """Основная функция запуска бота"""
+    # Создаём бота и диспетчер
+    bot = Bot(token=settings.bot_token)
+    if settings.trace_path:
+        bot.session.middleware(TracingSessionMiddleware())
+    dp = create_dispatcher()
+
+    metrics_runner = None
+    if settings.metrics_port:
+        metrics_runner = await start_metrics_server(settings.metrics_host, settings.metrics_port)
+
+    # Создаём таблицы
+    await create_tables()
+
+    # Загружаем базу продуктов для поиска
+    load_food_index(settings.food_index_path, settings.food_data_path)
+
+    # Загружаем квантильные скетчи и запускаем их периодическое сохранение
+    await population_sketches.load(async_session)
+    sketch_flush_task = asyncio.create_task(run_sketch_flush_loop(async_session, settings.sketch_flush_interval))
+
+    # Загружаем отложенные напоминания и запускаем их отправку
+    reminder_scheduler.register(REMINDER_GLUCOSE_END, meal.send_glucose_end_reminder)
+    await reminder_scheduler.load()
+    reminder_task = asyncio.create_task(reminder_scheduler.run(bot, dp.storage, settings.reminder_workers))
+
+    # Итоги недели (если они не отправляются отдельным процессом)
+    background_tasks = [sketch_flush_task, reminder_task]
+    if settings.weekly_digest_in_bot:
+        background_tasks.append(asyncio.create_task(run_weekly_digest_loop(bot, async_session)))
+
+    # Итоги воронки сценариев FSM
+    background_tasks.append(asyncio.create_task(run_funnel_flush_loop(async_session, settings.funnel_flush_interval)))
+
+    # Тяжёлые задачи (выгрузка, импорт) выполняются воркерами очереди, а не в обработчиках
+    job_queue.register(
+        export.EXPORT_JOB,
+        export.run_export_job,
+        failure_text="❌ Не удалось подготовить выгрузку. Попробуйте позже.",
+        priority=10,
+    )
+    job_queue.register(
+        history_import.IMPORT_JOB,
+        history_import.run_import_job,
+        failure_text="❌ Не удалось импортировать файл. Попробуйте позже.",
+    )
+    background_tasks.append(asyncio.create_task(job_queue.run(bot, settings.job_workers)))
+
+    # Замер отставания цикла asyncio и поиск блокирующего кода
+    loop_watchdog = create_loop_watchdog()
+    if loop_watchdog is not None:
+        background_tasks.append(asyncio.create_task(loop_watchdog.run()))
+
+    # Продолжаем рассылки, прерванные перезапуском
+    await resume_broadcasts(bot, async_session)
 
     logger.info("Бот запущен")
 
@@ -48,6 +162,19 @@ async def main():
         # Запускаем бота
         await dp.start_polling(bot)
     finally:
+        for task in background_tasks:
+            task.cancel()
+        # Ошибка сохранения одних итогов не должна мешать сохранить другие и закрыть сессию
+        try:
+            await population_sketches.flush(async_session)
+        except Exception:
+            logger.exception("Не удалось сохранить квантильные скетчи")
+        try:
+            await funnel_tracker.flush(async_session)
+        except Exception:
+            logger.exception("Не удалось сохранить итоги воронки")
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         await bot.session.close()
 
 
@@ -0,0 +1,117 @@
+"""
+Учёт SQL-запросов: сколько запросов и времени в базе ушло на один апдейт, журнал медленных запросов.
+
+Обработчики событий движка SQLAlchemy прибавляют каждый запрос к QueryStats текущего контекста
+(его открывает track_queries — middleware метрик на каждый апдейт). Запросы дольше
+settings.slow_query_ms пишутся в журнал db.slow_query с отпечатком: текст запроса без литералов
+и параметров, поэтому одинаковые запросы с разными значениями легко сгруппировать.
+"""
+
+import hashlib
+import logging
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from config.base import settings
+
+slow_query_logger = logging.getLogger("db.slow_query")
+
+_current_stats: ContextVar[Optional["QueryStats"]] = ContextVar("query_stats", default=None)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.$])-?\d+(?:\.\d+)?\b")
+_PARAMETER = re.compile(r"\$\d+|%\(\w+\)s|:\w+|\?")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)", re.IGNORECASE)
+_VALUES_LIST = re.compile(r"(VALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    duration: float = 0.0
+    # Отпечатки выполненных запросов по порядку (для отладки бюджета)
+    statements: list[str] = field(default_factory=list)
+
+
+def fingerprint(statement: str) -> str:
+    """Нормализованный текст запроса: литералы и параметры заменены на ?, списки IN и VALUES свёрнуты"""
+    text = _STRING_LITERAL.sub("?", statement)
+    text = _PARAMETER.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _WHITESPACE.sub(" ", text).strip()
+    text = _IN_LIST.sub("IN (...)", text)
+    return _VALUES_LIST.sub(r"\1, ...", text)
+
+
+def fingerprint_id(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.duration += duration
+        stats.statements.append(statement)
+    if duration * 1000 >= settings.slow_query_ms:
+        normalized = fingerprint(statement)
+        slow_query_logger.warning(
+            f"Медленный запрос {duration * 1000:.0f} мс [{fingerprint_id(normalized)}]: {normalized}"
+        )
+
+
+def _handle_error(exception_context):
+    # Для упавшего запроса after_cursor_execute не вызывается — снимаем его начало со стека
+    connection = exception_context.connection
+    starts = connection.info.get("query_start") if connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Подключает учёт запросов к движку (один раз при создании)"""
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", _handle_error)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Считает запросы, выполненные внутри блока (в том числе во вложенных корутинах)"""
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+@contextmanager
+def query_budget(max_queries: int, max_seconds: Optional[float] = None) -> Iterator[QueryStats]:
+    """
+    Проверка для тестов и бенчмарков: падает с AssertionError, если блок выполнил больше
+    max_queries запросов (или провёл в базе больше max_seconds).
+
+        with query_budget(3):
+            await start_fci_calculation(message, state)
+    """
+    with track_queries() as stats:
+        yield stats
+    if stats.count > max_queries:
+        listing = "\n".join(f"  {i}. {fingerprint(s)}" for i, s in enumerate(stats.statements, 1))
+        raise AssertionError(f"Выполнено {stats.count} запросов при бюджете {max_queries}:\n{listing}")
+    if max_seconds is not None and stats.duration > max_seconds:
+        raise AssertionError(f"Запросы заняли {stats.duration:.3f} с при бюджете {max_seconds} с")
@@ -0,0 +1,54 @@
+"""add_meal_templates
+
+Revision ID: 3c1f7a92d4e5
+Revises: 09855a79f87a
+Create Date: 2026-10-19 10:12:31.418205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1f7a92d4e5'
+down_revision: Union[str, None] = '09855a79f87a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'meal_templates',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column(
+            'meal_type',
+            postgresql.ENUM('BREAKFAST', 'LUNCH', 'SNACK', 'DINNER', name='mealtype', create_type=False),
+            nullable=False,
+        ),
+        sa.Column('signature', sa.String(), nullable=False),
+        sa.Column('pause_time', sa.Integer(), nullable=True),
+        sa.Column('carbs_main', sa.Float(), nullable=False),
+        sa.Column('carbs_additional', sa.Float(), nullable=True),
+        sa.Column('proteins', sa.Float(), nullable=True),
+        sa.Column('fats', sa.Float(), nullable=True),
+        sa.Column('insulin_food', sa.Float(), nullable=False),
+        sa.Column('use_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('rank', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('last_used_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'meal_type', 'signature', name='uq_meal_templates_signature'),
+    )
+    op.create_index('ix_meal_templates_id', 'meal_templates', ['id'])
+    op.create_index('ix_meal_templates_rank', 'meal_templates', ['user_id', 'meal_type', 'rank'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_meal_templates_rank', table_name='meal_templates')
+    op.drop_index('ix_meal_templates_id', table_name='meal_templates')
+    op.drop_table('meal_templates')
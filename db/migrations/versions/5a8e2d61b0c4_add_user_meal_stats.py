@@ -0,0 +1,54 @@
+"""add_user_meal_stats
+
+Revision ID: 5a8e2d61b0c4
+Revises: 3c1f7a92d4e5
+Create Date: 2026-10-19 11:03:54.730112
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a8e2d61b0c4'
+down_revision: Union[str, None] = '3c1f7a92d4e5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'user_meal_stats',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('mean', sa.Float(), nullable=False),
+        sa.Column('m2', sa.Float(), nullable=False),
+        sa.Column('min_value', sa.Float(), nullable=True),
+        sa.Column('max_value', sa.Float(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id', 'kind'),
+    )
+
+    # Заполняем статистику по уже накопленным данным
+    op.execute("""
+        INSERT INTO user_meal_stats (user_id, kind, count, mean, m2, min_value, max_value, updated_at)
+        SELECT user_id, lower(meal_type::text), count(*), avg(uk_value),
+               coalesce(var_pop(uk_value) * count(*), 0), min(uk_value), max(uk_value), now()
+        FROM meal_records
+        GROUP BY user_id, meal_type
+    """)
+    op.execute("""
+        INSERT INTO user_meal_stats (user_id, kind, count, mean, m2, min_value, max_value, updated_at)
+        SELECT user_id, 'fci', count(*), avg(value),
+               coalesce(var_pop(value) * count(*), 0), min(value), max(value), now()
+        FROM fci
+        GROUP BY user_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('user_meal_stats')
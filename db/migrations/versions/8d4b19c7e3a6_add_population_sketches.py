@@ -0,0 +1,34 @@
+"""add_population_sketches
+
+Revision ID: 8d4b19c7e3a6
+Revises: 5a8e2d61b0c4
+Create Date: 2026-10-19 11:48:07.215936
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d4b19c7e3a6'
+down_revision: Union[str, None] = '5a8e2d61b0c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Скетчи заполняются скриптом scripts/rebuild_sketches.py
+    op.create_table(
+        'population_sketches',
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('payload', sa.LargeBinary(), nullable=False),
+        sa.Column('count', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('key'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('population_sketches')
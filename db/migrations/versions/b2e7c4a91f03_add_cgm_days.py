@@ -0,0 +1,36 @@
+"""add_cgm_days
+
+Revision ID: b2e7c4a91f03
+Revises: 8d4b19c7e3a6
+Create Date: 2026-10-19 16:02:41.518304
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2e7c4a91f03'
+down_revision: Union[str, None] = '8d4b19c7e3a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Одна строка на пользователя и сутки; первичный ключ (user_id, day) обслуживает запросы по диапазону дат
+    op.create_table(
+        'cgm_days',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('readings', sa.LargeBinary(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id', 'day'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('cgm_days')
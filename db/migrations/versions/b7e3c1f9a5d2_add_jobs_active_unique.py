@@ -0,0 +1,41 @@
+"""add_jobs_active_unique
+
+Revision ID: b7e3c1f9a5d2
+Revises: d2f6b8a4c0e7
+Create Date: 2026-10-19 23:18:44.602315
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3c1f9a5d2'
+down_revision: Union[str, None] = 'd2f6b8a4c0e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ACTIVE = "status IN ('queued', 'running')"
+
+
+def upgrade() -> None:
+    # Повторные активные задачи одного типа у пользователя (если успели появиться) закрываем
+    op.execute(
+        f"UPDATE jobs SET status = 'failed', error = 'duplicate' "
+        f"WHERE {ACTIVE} AND user_id IS NOT NULL AND id NOT IN "
+        f"(SELECT MIN(id) FROM jobs WHERE {ACTIVE} AND user_id IS NOT NULL GROUP BY user_id, kind)"
+    )
+    op.create_index(
+        'uq_jobs_user_kind_active',
+        'jobs',
+        ['user_id', 'kind'],
+        unique=True,
+        postgresql_where=sa.text(ACTIVE),
+        sqlite_where=sa.text(ACTIVE),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_jobs_user_kind_active', table_name='jobs')
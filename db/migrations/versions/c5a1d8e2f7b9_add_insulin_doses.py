@@ -0,0 +1,46 @@
+"""add_insulin_doses
+
+Revision ID: c5a1d8e2f7b9
+Revises: b2e7c4a91f03
+Create Date: 2026-10-19 16:31:12.804117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a1d8e2f7b9'
+down_revision: Union[str, None] = 'b2e7c4a91f03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('timezone', sa.String(), nullable=True))
+    op.create_table(
+        'insulin_doses',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('ts', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('tz', sa.String(), nullable=False),
+        sa.Column('insulin_type', postgresql.ENUM('FOOD', 'CORRECTION', name='insulintype', create_type=False), nullable=False),
+        sa.Column('amount', sa.Float(), nullable=False),
+        sa.Column('meal_record_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.ForeignKeyConstraint(['meal_record_id'], ['meal_records.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_insulin_doses_id'), 'insulin_doses', ['id'], unique=False)
+    op.create_index('ix_insulin_doses_user_ts', 'insulin_doses', ['user_id', 'ts'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_insulin_doses_user_ts', table_name='insulin_doses')
+    op.drop_index(op.f('ix_insulin_doses_id'), table_name='insulin_doses')
+    op.drop_table('insulin_doses')
+    op.drop_column('users', 'timezone')
@@ -0,0 +1,36 @@
+"""add_funnel_rollups
+
+Revision ID: c9e4a7f2b1d6
+Revises: a3d6f9b2c4e8
+Create Date: 2026-10-19 21:05:12.418530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9e4a7f2b1d6'
+down_revision: Union[str, None] = 'a3d6f9b2c4e8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'funnel_rollups',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('state', sa.String(), nullable=False),
+        sa.Column('next_state', sa.String(), nullable=False),
+        sa.Column('transitions', sa.BigInteger(), nullable=False),
+        sa.Column('dwell_seconds', sa.Float(), nullable=False),
+        sa.Column('dwell_count', sa.BigInteger(), nullable=False),
+        sa.Column('server_seconds', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'state', 'next_state'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('funnel_rollups')
@@ -0,0 +1,26 @@
+"""add_reminder_payload
+
+Revision ID: d2f6b8a4c0e7
+Revises: c9e4a7f2b1d6
+Create Date: 2026-10-19 22:40:27.153902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2f6b8a4c0e7'
+down_revision: Union[str, None] = 'c9e4a7f2b1d6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('reminders', sa.Column('payload', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('reminders', 'payload')
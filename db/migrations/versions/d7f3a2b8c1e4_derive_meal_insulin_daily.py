@@ -0,0 +1,44 @@
+"""derive_meal_insulin_daily
+
+Revision ID: d7f3a2b8c1e4
+Revises: c5a1d8e2f7b9
+Create Date: 2026-10-19 17:05:41.220931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7f3a2b8c1e4'
+down_revision: Union[str, None] = 'c5a1d8e2f7b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+MEAL_INSULIN_DAILY_SQL = """
+    SELECT user_id, date, SUM(insulin_food + COALESCE(insulin_additional, 0)) AS amount, COUNT(*) AS meals
+    FROM meal_records
+    GROUP BY user_id, date
+"""
+
+
+def upgrade() -> None:
+    op.create_index('ix_meal_records_user_date', 'meal_records', ['user_id', 'date'], unique=False)
+    op.execute(f"CREATE OR REPLACE VIEW meal_insulin_daily AS {MEAL_INSULIN_DAILY_SQL}")
+    # Автоматические записи дублировали meal_records и теперь считаются представлением
+    op.execute("DELETE FROM insulin_records WHERE is_manual = 0")
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        INSERT INTO insulin_records (user_id, date, insulin_type, amount, is_manual, created_at)
+        SELECT user_id, date, 'FOOD', amount, 0, now()
+        FROM meal_insulin_daily
+        """
+    )
+    op.execute("DROP VIEW IF EXISTS meal_insulin_daily")
+    op.drop_index('ix_meal_records_user_date', table_name='meal_records')
@@ -0,0 +1,59 @@
+"""insulin_doses_corrected_amount
+
+Revision ID: e5c9a1d7f3b4
+Revises: b7e3c1f9a5d2
+Create Date: 2026-10-19 23:52:10.284617
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5c9a1d7f3b4'
+down_revision: Union[str, None] = 'b7e3c1f9a5d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _set_amounts(column: str) -> None:
+    """
+    Подколки в журнале инъекций сопоставляются с additional_injections того же приёма пищи
+    по порядку времени (журнал пишется из них же, нулевые дозы пропускаются)
+    """
+    bind = op.get_bind()
+    doses: dict[int, list[int]] = {}
+    for dose_id, meal_record_id in bind.execute(
+        sa.text(
+            "SELECT id, meal_record_id FROM insulin_doses "
+            "WHERE insulin_type = 'CORRECTION' AND meal_record_id IS NOT NULL ORDER BY meal_record_id, ts, id"
+        )
+    ):
+        doses.setdefault(meal_record_id, []).append(dose_id)
+
+    injections: dict[int, list[tuple[float, float]]] = {}
+    for meal_record_id, dose, dose_corrected in bind.execute(
+        sa.text(
+            "SELECT meal_record_id, dose, dose_corrected FROM additional_injections "
+            "WHERE dose > 0 ORDER BY meal_record_id, time_from_meal, id"
+        )
+    ):
+        injections.setdefault(meal_record_id, []).append((dose, dose_corrected))
+
+    update = sa.text("UPDATE insulin_doses SET amount = :amount WHERE id = :id")
+    for meal_record_id, dose_ids in doses.items():
+        rows = injections.get(meal_record_id, [])
+        if len(rows) != len(dose_ids):
+            continue
+        for dose_id, (dose, dose_corrected) in zip(dose_ids, rows):
+            bind.execute(update, {"id": dose_id, "amount": dose_corrected if column == "dose_corrected" else dose})
+
+
+def upgrade() -> None:
+    _set_amounts("dose_corrected")
+
+
+def downgrade() -> None:
+    _set_amounts("dose")
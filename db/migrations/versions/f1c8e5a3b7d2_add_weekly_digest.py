@@ -0,0 +1,40 @@
+"""add_weekly_digest
+
+Revision ID: f1c8e5a3b7d2
+Revises: e4b9c2d6a8f1
+Create Date: 2026-10-19 19:02:47.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1c8e5a3b7d2'
+down_revision: Union[str, None] = 'e4b9c2d6a8f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('weekly_digest', sa.Boolean(), nullable=False, server_default=sa.false()))
+    op.create_table(
+        'job_checkpoints',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('cursor', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=True),
+        sa.Column('delivered', sa.Integer(), nullable=False),
+        sa.Column('blocked', sa.Integer(), nullable=False),
+        sa.Column('failed', sa.Integer(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('job_checkpoints')
+    op.drop_column('users', 'weekly_digest')
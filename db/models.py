@@ -1,4 +1,24 @@
-from sqlalchemy import Column, Integer, Float, String, DateTime, Date, Enum, BigInteger, ForeignKey
+from sqlalchemy import (
+    Column,
+    Integer,
+    Float,
+    String,
+    DateTime,
+    Date,
+    Enum,
+    BigInteger,
+    Boolean,
+    Text,
+    ForeignKey,
+    Index,
+    UniqueConstraint,
+    LargeBinary,
+    DDL,
+    event,
+    table,
+    column,
+    text,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -16,6 +36,8 @@ class User(Base):
     username = Column(String, nullable=True)
     first_name = Column(String, nullable=True)
     last_name = Column(String, nullable=True)
+    timezone = Column(String, nullable=True)  # Часовой пояс IANA; если не задан — settings.default_timezone
+    weekly_digest = Column(Boolean, nullable=False, default=False)  # Присылать итоги недели
     created_at = Column(DateTime, default=func.now())
 
     # Связи
@@ -77,6 +99,7 @@ class InsulinRecord(Base):
 
 class MealRecord(Base):
     __tablename__ = "meal_records"
+    __table_args__ = (Index("ix_meal_records_user_date", "user_id", "date"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
@@ -110,6 +133,35 @@ class MealRecord(Base):
         return f"<MealRecord(user_id={self.user_id}, date={self.date}, meal={self.meal_type}, uk={self.uk_value})>"
 
 
+# Инсулин из приёмов пищи по дням выводится из meal_records, а не дублируется в insulin_records.
+# Представление не входит в metadata как таблица; создаётся вместе с таблицами и миграцией.
+MEAL_INSULIN_DAILY_SQL = """
+    SELECT user_id, date, SUM(insulin_food + COALESCE(insulin_additional, 0)) AS amount, COUNT(*) AS meals
+    FROM meal_records
+    GROUP BY user_id, date
+"""
+
+meal_insulin_daily = table(
+    "meal_insulin_daily",
+    column("user_id", Integer),
+    column("date", Date),
+    column("amount", Float),
+    column("meals", Integer),
+)
+
+event.listen(
+    Base.metadata,
+    "after_create",
+    DDL(f"CREATE OR REPLACE VIEW meal_insulin_daily AS {MEAL_INSULIN_DAILY_SQL}").execute_if(dialect="postgresql"),
+)
+event.listen(
+    Base.metadata,
+    "after_create",
+    DDL(f"CREATE VIEW IF NOT EXISTS meal_insulin_daily AS {MEAL_INSULIN_DAILY_SQL}").execute_if(dialect="sqlite"),
+)
+event.listen(Base.metadata, "before_drop", DDL("DROP VIEW IF EXISTS meal_insulin_daily"))
+
+
 class AdditionalInjection(Base):
     __tablename__ = "additional_injections"
 
@@ -126,3 +178,190 @@ class AdditionalInjection(Base):
 
     def __repr__(self):
         return f"<AdditionalInjection(meal_id={self.meal_record_id}, time={self.time_from_meal}, dose={self.dose_corrected})>"
+
+
+class InsulinDose(Base):
+    """Отдельная инъекция ультракороткого инсулина с точным временем"""
+
+    __tablename__ = "insulin_doses"
+    __table_args__ = (Index("ix_insulin_doses_user_ts", "user_id", "ts"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    ts = Column(DateTime(timezone=True), nullable=False)  # Момент инъекции
+    tz = Column(String, nullable=False)  # Часовой пояс пользователя на момент инъекции
+    insulin_type = Column(Enum(InsulinType), nullable=False)
+    amount = Column(Float, nullable=False)  # Доза в единицах; подколки — с коррекцией, как в meal_records (исходная — в additional_injections)
+    meal_record_id = Column(Integer, ForeignKey("meal_records.id"), nullable=True)
+    created_at = Column(DateTime, default=func.now())
+
+    def __repr__(self):
+        return f"<InsulinDose(user_id={self.user_id}, ts={self.ts}, amount={self.amount})>"
+
+
+class MealTemplate(Base):
+    """Шаблон приёма пищи, собирается автоматически из расчётов УК"""
+
+    __tablename__ = "meal_templates"
+    __table_args__ = (
+        UniqueConstraint("user_id", "meal_type", "signature", name="uq_meal_templates_signature"),
+        Index("ix_meal_templates_rank", "user_id", "meal_type", "rank"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    meal_type = Column(Enum(MealType), nullable=False)
+    signature = Column(String, nullable=False)  # Ключ набора значений для поиска дубликатов
+
+    pause_time = Column(Integer, nullable=True)
+    carbs_main = Column(Float, nullable=False)
+    carbs_additional = Column(Float, default=0.0)
+    proteins = Column(Float, nullable=True)
+    fats = Column(Float, nullable=True)
+    insulin_food = Column(Float, nullable=False)
+
+    use_count = Column(Integer, nullable=False, default=0)
+    rank = Column(Float, nullable=False, default=0.0)  # log(Σ exp(λ·t)) по всем использованиям
+    last_used_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, default=func.now())
+
+    def __repr__(self):
+        return f"<MealTemplate(user_id={self.user_id}, meal={self.meal_type}, uses={self.use_count})>"
+
+
+class UserMealStats(Base):
+    """Накопительная статистика пользователя (алгоритм Уэлфорда): УК по типу приёма пищи и ФЧИ"""
+
+    __tablename__ = "user_meal_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    kind = Column(String, primary_key=True)  # Значение MealType или "fci"
+    count = Column(Integer, nullable=False, default=0)
+    mean = Column(Float, nullable=False, default=0.0)
+    m2 = Column(Float, nullable=False, default=0.0)  # Сумма квадратов отклонений от среднего
+    min_value = Column(Float, nullable=True)
+    max_value = Column(Float, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<UserMealStats(user_id={self.user_id}, kind={self.kind}, count={self.count}, mean={self.mean})>"
+
+
+class PopulationSketch(Base):
+    """Квантильный скетч KLL по всем пользователям (без привязки к конкретному пользователю)"""
+
+    __tablename__ = "population_sketches"
+
+    key = Column(String, primary_key=True)  # "fci" или "uk:<тип приёма пищи>"
+    payload = Column(LargeBinary, nullable=False)
+    count = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<PopulationSketch(key={self.key}, count={self.count})>"
+
+
+class CGMDay(Base):
+    """Показания CGM за сутки: 288 пятиминутных слотов, упакованных в int16 (ммоль/л × 100, 0 — нет данных)"""
+
+    __tablename__ = "cgm_days"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    readings = Column(LargeBinary, nullable=False)
+    count = Column(Integer, nullable=False, default=0)  # Сколько слотов заполнено
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<CGMDay(user_id={self.user_id}, day={self.day}, count={self.count})>"
+
+
+class Reminder(Base):
+    """Отложенное напоминание; хранится до отправки, чтобы пережить перезапуск бота"""
+
+    __tablename__ = "reminders"
+    __table_args__ = (UniqueConstraint("user_id", "kind", name="uq_reminders_user_kind"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    kind = Column(String, nullable=False)  # Тип напоминания, например "glucose_end"
+    due_at = Column(DateTime(timezone=True), nullable=False)
+    payload = Column(Text, nullable=True)  # Данные FSM сценария (JSON), чтобы восстановить его после перезапуска
+    created_at = Column(DateTime, default=func.now())
+
+    def __repr__(self):
+        return f"<Reminder(user_id={self.user_id}, kind={self.kind}, due_at={self.due_at})>"
+
+
+class JobCheckpoint(Base):
+    """Прогресс задачи, обходящей всех пользователей (дайджест, рассылка), для продолжения после сбоя"""
+
+    __tablename__ = "job_checkpoints"
+
+    name = Column(String, primary_key=True)  # Например "weekly_digest:2026-10-12" или "broadcast:<id>"
+    cursor = Column(Integer, nullable=False, default=0)  # id последнего обработанного пользователя
+    payload = Column(Text, nullable=True)  # Данные задачи, например текст рассылки
+    delivered = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    finished_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<JobCheckpoint(name={self.name}, cursor={self.cursor}, finished_at={self.finished_at})>"
+
+
+class Job(Base):
+    """Фоновая задача (выгрузка, импорт); воркеры забирают задачи через SELECT ... FOR UPDATE SKIP LOCKED"""
+
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_queue", "status", "priority", "run_after"),
+        Index("ix_jobs_user_status", "user_id", "status"),
+        # Не больше одной задачи каждого типа в очереди или в работе у пользователя
+        Index(
+            "uq_jobs_user_kind_active",
+            "user_id",
+            "kind",
+            unique=True,
+            postgresql_where=text("status IN ('queued', 'running')"),
+            sqlite_where=text("status IN ('queued', 'running')"),
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # Тип задачи, например "export" или "import"
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    chat_id = Column(BigInteger, nullable=True)  # Куда сообщать о прогрессе
+    payload = Column(Text, nullable=False, default="{}")  # Параметры задачи в JSON
+    priority = Column(Integer, nullable=False, default=0)  # Чем больше, тем раньше
+    status = Column(String, nullable=False, default="queued")  # queued / running / done / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(DateTime(timezone=True), nullable=False)  # Не раньше этого момента (отсрочка повтора)
+    locked_at = Column(DateTime(timezone=True), nullable=True)  # Когда воркер последний раз подтвердил работу
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<Job(id={self.id}, kind={self.kind}, status={self.status}, attempts={self.attempts})>"
+
+
+class FunnelRollup(Base):
+    """Переходы между состояниями FSM за день: сколько раз, сколько времени пользователи провели в состоянии и сколько ушло на обработку"""
+
+    __tablename__ = "funnel_rollups"
+
+    day = Column(Date, primary_key=True)
+    state = Column(String, primary_key=True)  # Например "MealStates:waiting_for_proteins"; "none" — вне сценария
+    next_state = Column(String, primary_key=True)  # Новое состояние, "none" (сценарий закончен), "cancelled" или "abandoned"
+    transitions = Column(BigInteger, nullable=False, default=0)
+    dwell_seconds = Column(Float, nullable=False, default=0.0)  # Сумма времени от входа в состояние до ответа
+    dwell_count = Column(BigInteger, nullable=False, default=0)  # Переходы, для которых время входа известно
+    server_seconds = Column(Float, nullable=False, default=0.0)  # Сумма времени обработки ответа ботом
+
+    def __repr__(self):
+        return f"<FunnelRollup(day={self.day}, state={self.state}, next_state={self.next_state}, transitions={self.transitions})>"
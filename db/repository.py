@@ -1,9 +1,35 @@
+import math
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, desc
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, and_, or_, desc, delete, update, func, literal, case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload, aliased
 from typing import List, Optional
-from datetime import date, datetime
-from db.models import User, FCI, MealRecord, AdditionalInjection, MealType, InsulinRecord, InsulinType
+from datetime import date, datetime, timezone
+from db.models import (
+    User,
+    FCI,
+    MealRecord,
+    AdditionalInjection,
+    MealType,
+    InsulinRecord,
+    InsulinType,
+    MealTemplate,
+    UserMealStats,
+    PopulationSketch,
+    CGMDay,
+    InsulinDose,
+    Reminder,
+    JobCheckpoint,
+    Job,
+    FunnelRollup,
+    meal_insulin_daily,
+)
+
+# Период полураспада веса использования шаблона (в днях)
+TEMPLATE_HALF_LIFE_DAYS = 14.0
+
+# Ключ накопительной статистики для ФЧИ (для УК используется значение MealType)
+FCI_STATS_KIND = "fci"
 
 
 class UserRepository:
@@ -34,6 +60,29 @@ class UserRepository:
         result = await self.session.execute(select(User).where(User.telegram_id == telegram_id))
         return result.scalar_one_or_none()
 
+    async def get_timezone(self, user_id: int) -> Optional[str]:
+        result = await self.session.execute(select(User.timezone).where(User.id == user_id))
+        return result.scalar_one_or_none()
+
+    async def set_timezone(self, user_id: int, timezone: str) -> None:
+        """Сохранить часовой пояс пользователя"""
+        user = await self.session.get(User, user_id)
+        user.timezone = timezone
+        await self.session.commit()
+
+    async def set_weekly_digest(self, user_id: int, enabled: bool) -> None:
+        user = await self.session.get(User, user_id)
+        user.weekly_digest = enabled
+        await self.session.commit()
+
+    async def get_chat_batch(self, after_id: int, limit: int, weekly_digest: bool = False) -> List[tuple[int, int]]:
+        """Очередная порция пар (id, telegram_id) по возрастанию id (постраничный обход по ключу)"""
+        query = select(User.id, User.telegram_id).where(User.id > after_id)
+        if weekly_digest:
+            query = query.where(User.weekly_digest.is_(True))
+        result = await self.session.execute(query.order_by(User.id).limit(limit))
+        return [tuple(row) for row in result.all()]
+
 
 class FCIRepository:
     def __init__(self, session: AsyncSession):
@@ -43,24 +92,26 @@ class FCIRepository:
         """Создать запись ФЧИ"""
         fci = FCI(user_id=user_id, date=date, value=value)
         self.session.add(fci)
+        await UserMealStatsRepository(self.session).add_value(user_id, FCI_STATS_KIND, value)
         await self.session.commit()
         await self.session.refresh(fci)
         return fci
 
-    async def update_or_create(self, user_id: int, date: date, value: float) -> FCI:
-        """Обновить существующую запись ФЧИ или создать новую"""
+    async def update_or_create(self, user_id: int, date: date, value: float) -> tuple[FCI, bool]:
+        """Обновить существующую запись ФЧИ или создать новую; второй элемент — создана ли новая запись"""
         # Проверяем, есть ли уже запись за эту дату
         existing = await self.get_by_date(user_id, date)
 
         if existing:
             # Обновляем существующую запись
+            await UserMealStatsRepository(self.session).replace_value(user_id, FCI_STATS_KIND, existing.value, value)
             existing.value = value
             await self.session.commit()
             await self.session.refresh(existing)
-            return existing
+            return existing, False
         else:
             # Создаем новую запись
-            return await self.create(user_id, date, value)
+            return await self.create(user_id, date, value), True
 
     async def get_by_date(self, user_id: int, date: date) -> Optional[FCI]:
         """Получить последнюю запись ФЧИ для конкретной даты"""
@@ -83,6 +134,25 @@ class FCIRepository:
         )
         return list(result.scalars().all())
 
+    async def get_period_stats(
+        self, user_ids: List[int], start_date: date, end_date: date, previous_start: date
+    ) -> dict[int, tuple[int, Optional[float], Optional[float], Optional[float], Optional[float]]]:
+        """(количество, среднее, минимум, максимум, среднее за предыдущий период) по пользователям одним запросом"""
+        current = FCI.date >= start_date
+        result = await self.session.execute(
+            select(
+                FCI.user_id,
+                func.count(case((current, FCI.id))),
+                func.avg(case((current, FCI.value))),
+                func.min(case((current, FCI.value))),
+                func.max(case((current, FCI.value))),
+                func.avg(case((FCI.date < start_date, FCI.value))),
+            )
+            .where(and_(FCI.user_id.in_(user_ids), FCI.date >= previous_start, FCI.date <= end_date))
+            .group_by(FCI.user_id)
+        )
+        return {row[0]: tuple(row[1:]) for row in result.all()}
+
 
 class MealRecordRepository:
     def __init__(self, session: AsyncSession):
@@ -91,6 +161,8 @@ class MealRecordRepository:
     async def create(self, user_id: int, **kwargs) -> MealRecord:
         meal_record = MealRecord(user_id=user_id, **kwargs)
         self.session.add(meal_record)
+        meal_type = MealType(kwargs["meal_type"])
+        await UserMealStatsRepository(self.session).add_value(user_id, meal_type.value, kwargs["uk_value"])
         await self.session.commit()
         await self.session.refresh(meal_record)
         return meal_record
@@ -128,6 +200,24 @@ class MealRecordRepository:
         )
         return list(result.scalars().all())
 
+    async def get_uk_stats(
+        self, user_ids: List[int], start_date: date, end_date: date
+    ) -> dict[int, dict[MealType, tuple[int, float]]]:
+        """Количество записей и среднее УК по типам приёмов пищи для нескольких пользователей одним запросом"""
+        result = await self.session.execute(
+            select(MealRecord.user_id, MealRecord.meal_type, func.count(), func.avg(MealRecord.uk_value))
+            .where(
+                and_(
+                    MealRecord.user_id.in_(user_ids), MealRecord.date >= start_date, MealRecord.date <= end_date
+                )
+            )
+            .group_by(MealRecord.user_id, MealRecord.meal_type)
+        )
+        stats: dict[int, dict[MealType, tuple[int, float]]] = {}
+        for user_id, meal_type, count, avg_uk in result.all():
+            stats.setdefault(user_id, {})[meal_type] = (count, avg_uk)
+        return stats
+
 
 class AdditionalInjectionRepository:
     def __init__(self, session: AsyncSession):
@@ -200,11 +290,7 @@ class InsulinRecordRepository:
 
     async def get_total_by_date(self, user_id: int, date: date) -> float:
         """Получить общее количество ультракороткого инсулина за дату (на еду + коррекции)"""
-        result = await self.session.execute(
-            select(InsulinRecord.amount).where(and_(InsulinRecord.user_id == user_id, InsulinRecord.date == date))
-        )
-        amounts = result.scalars().all()
-        return sum(amounts) if amounts else 0.0
+        return await self.get_manual_total_by_date(user_id, date) + await self.get_auto_total_by_date(user_id, date)
 
     async def get_manual_total_by_date(self, user_id: int, date: date) -> float:
         """Получить общее количество ручного инсулина за дату"""
@@ -219,15 +305,32 @@ class InsulinRecordRepository:
     async def get_auto_total_by_date(self, user_id: int, date: date) -> float:
         """Получить общее количество автоматического инсулина за дату (из расчетов УК)"""
         result = await self.session.execute(
-            select(InsulinRecord.amount).where(
-                and_(InsulinRecord.user_id == user_id, InsulinRecord.date == date, InsulinRecord.is_manual == 0)
+            select(meal_insulin_daily.c.amount).where(
+                and_(meal_insulin_daily.c.user_id == user_id, meal_insulin_daily.c.date == date)
             )
         )
-        amounts = result.scalars().all()
-        return sum(amounts) if amounts else 0.0
+        return result.scalar_one_or_none() or 0.0
+
+    async def get_manual_totals_by_dates(self, user_id: int, dates: List[date]) -> dict[date, float]:
+        """Ручной инсулин по каждой из дат одним запросом (даты без записей отсутствуют)"""
+        result = await self.session.execute(
+            select(InsulinRecord.date, func.sum(InsulinRecord.amount))
+            .where(and_(InsulinRecord.user_id == user_id, InsulinRecord.date.in_(dates), InsulinRecord.is_manual == 1))
+            .group_by(InsulinRecord.date)
+        )
+        return {day: total for day, total in result.all()}
+
+    async def get_auto_totals_by_dates(self, user_id: int, dates: List[date]) -> dict[date, float]:
+        """Инсулин из расчетов УК по каждой из дат одним запросом (даты без приёмов пищи отсутствуют)"""
+        result = await self.session.execute(
+            select(meal_insulin_daily.c.date, meal_insulin_daily.c.amount).where(
+                and_(meal_insulin_daily.c.user_id == user_id, meal_insulin_daily.c.date.in_(dates))
+            )
+        )
+        return {day: amount for day, amount in result.all()}
 
     async def get_by_date_range(self, user_id: int, start_date: date, end_date: date) -> List[InsulinRecord]:
-        """Получить записи инсулина за период"""
+        """Получить ручные записи инсулина за период"""
         result = await self.session.execute(
             select(InsulinRecord)
             .where(
@@ -240,11 +343,589 @@ class InsulinRecordRepository:
         return list(result.scalars().all())
 
     async def get_total_by_date_range(self, user_id: int, start_date: date, end_date: date) -> dict[date, float]:
-        """Получить общее количество инсулина по дням за период"""
+        """Получить общее количество инсулина по дням за период (ручные записи + приёмы пищи)"""
         records = await self.get_by_date_range(user_id, start_date, end_date)
         totals: dict[date, float] = {}
         for record in records:
             if record.date not in totals:
                 totals[record.date] = 0.0
             totals[record.date] += record.amount
+
+        result = await self.session.execute(
+            select(meal_insulin_daily.c.date, meal_insulin_daily.c.amount).where(
+                and_(
+                    meal_insulin_daily.c.user_id == user_id,
+                    meal_insulin_daily.c.date >= start_date,
+                    meal_insulin_daily.c.date <= end_date,
+                )
+            )
+        )
+        for day, amount in result.all():
+            totals[day] = totals.get(day, 0.0) + amount
         return totals
+
+
+class InsulinDoseRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def create_many(
+        self,
+        user_id: int,
+        tz: str,
+        doses: List[tuple[datetime, InsulinType, float]],
+        meal_record_id: Optional[int] = None,
+    ) -> None:
+        """Записать инъекции (момент с часовым поясом, тип, доза)"""
+        for ts, insulin_type, amount in doses:
+            self.session.add(
+                InsulinDose(
+                    user_id=user_id,
+                    ts=ts,
+                    tz=tz,
+                    insulin_type=insulin_type,
+                    amount=amount,
+                    meal_record_id=meal_record_id,
+                )
+            )
+        await self.session.commit()
+
+    async def get_window_totals(
+        self,
+        user_id: int,
+        windows: dict[date, tuple[datetime, datetime]],
+        day_ranges: dict[date, tuple[datetime, datetime]],
+    ) -> dict[date, float]:
+        """
+        Суммы доз по окнам [начало, конец) одним запросом по индексу (user_id, ts).
+        В ответе только дни, за которые (в границах day_ranges) записана хоть одна инъекция;
+        если все инъекции дня вне окна, сумма равна 0.
+        """
+        if not windows:
+            return {}
+
+        days = list(windows)
+        bucket = case(
+            *[(and_(InsulinDose.ts >= day_ranges[day][0], InsulinDose.ts < day_ranges[day][1]), i) for i, day in enumerate(days)],
+            else_=None,
+        ).label("bucket")
+        in_window = case(
+            *[(and_(InsulinDose.ts >= start, InsulinDose.ts < end), InsulinDose.amount) for start, end in windows.values()],
+            else_=0.0,
+        )
+        result = await self.session.execute(
+            select(bucket, func.sum(in_window))
+            .where(
+                and_(
+                    InsulinDose.user_id == user_id,
+                    InsulinDose.ts >= min(min(windows[day][0], day_ranges[day][0]) for day in days),
+                    InsulinDose.ts < max(max(windows[day][1], day_ranges[day][1]) for day in days),
+                )
+            )
+            .group_by(bucket)
+        )
+        return {days[index]: total for index, total in result.all() if index is not None}
+
+    async def get_by_range(self, user_id: int, start: datetime, end: datetime) -> List[InsulinDose]:
+        """Инъекции за период [start, end)"""
+        result = await self.session.execute(
+            select(InsulinDose)
+            .where(and_(InsulinDose.user_id == user_id, InsulinDose.ts >= start, InsulinDose.ts < end))
+            .order_by(InsulinDose.ts)
+        )
+        return list(result.scalars().all())
+
+
+class MealTemplateRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    @staticmethod
+    def make_signature(
+        pause_time: int | None,
+        carbs_main: float,
+        carbs_additional: float,
+        proteins: float | None,
+        fats: float | None,
+        insulin_food: float,
+    ) -> str:
+        """Ключ шаблона: одинаковые наборы значений считаются одним шаблоном"""
+        values = [pause_time or 0, carbs_main, carbs_additional or 0, proteins or 0, fats or 0, insulin_food]
+        return "|".join(f"{round(float(v), 1):g}" for v in values)
+
+    @staticmethod
+    def _usage_weight(moment: datetime) -> float:
+        """Логарифм веса использования: вклад растёт со временем, поэтому старые использования «затухают»"""
+        return math.log(2) / TEMPLATE_HALF_LIFE_DAYS * (moment.timestamp() / 86400)
+
+    async def record_use(
+        self,
+        user_id: int,
+        meal_type: MealType,
+        pause_time: int | None,
+        carbs_main: float,
+        carbs_additional: float,
+        proteins: float | None,
+        fats: float | None,
+        insulin_food: float,
+    ) -> MealTemplate:
+        """Учесть использование набора значений: O(1) обновление частоты и давности"""
+        now = datetime.now()
+        weight = self._usage_weight(now)
+        signature = self.make_signature(pause_time, carbs_main, carbs_additional, proteins, fats, insulin_food)
+
+        result = await self.session.execute(
+            select(MealTemplate).where(
+                and_(
+                    MealTemplate.user_id == user_id,
+                    MealTemplate.meal_type == meal_type,
+                    MealTemplate.signature == signature,
+                )
+            )
+        )
+        template = result.scalar_one_or_none()
+
+        if template:
+            # rank = log(exp(rank) + exp(weight)) без переполнения
+            high, low = max(template.rank, weight), min(template.rank, weight)
+            template.rank = high + math.log1p(math.exp(low - high))
+            template.use_count += 1
+            template.last_used_at = now
+        else:
+            template = MealTemplate(
+                user_id=user_id,
+                meal_type=meal_type,
+                signature=signature,
+                pause_time=pause_time,
+                carbs_main=carbs_main,
+                carbs_additional=carbs_additional or 0.0,
+                proteins=proteins,
+                fats=fats,
+                insulin_food=insulin_food,
+                use_count=1,
+                rank=weight,
+                last_used_at=now,
+            )
+            self.session.add(template)
+
+        await self.session.commit()
+        await self.session.refresh(template)
+        return template
+
+    async def get_top(self, user_id: int, meal_type: MealType, limit: int = 3) -> List[MealTemplate]:
+        """Самые частые и недавние шаблоны для типа приёма пищи"""
+        result = await self.session.execute(
+            select(MealTemplate)
+            .where(and_(MealTemplate.user_id == user_id, MealTemplate.meal_type == meal_type))
+            .order_by(desc(MealTemplate.rank))
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    async def get(self, user_id: int, template_id: int) -> Optional[MealTemplate]:
+        result = await self.session.execute(
+            select(MealTemplate).where(and_(MealTemplate.id == template_id, MealTemplate.user_id == user_id))
+        )
+        return result.scalar_one_or_none()
+
+
+class UserMealStatsRepository:
+    """Статистика обновляется за O(1) на каждую запись; коммит делает вызывающий репозиторий"""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def _get_for_update(self, user_id: int, kind: str) -> Optional[UserMealStats]:
+        result = await self.session.execute(
+            select(UserMealStats)
+            .where(and_(UserMealStats.user_id == user_id, UserMealStats.kind == kind))
+            .with_for_update()
+        )
+        return result.scalar_one_or_none()
+
+    async def add_value(self, user_id: int, kind: str, value: float) -> UserMealStats:
+        """Добавить новое значение в статистику"""
+        value = float(value)
+        stats = await self._get_for_update(user_id, kind)
+        if stats is None:
+            stats = UserMealStats(user_id=user_id, kind=kind, count=0, mean=0.0, m2=0.0)
+            self.session.add(stats)
+
+        stats.count += 1
+        delta = value - stats.mean
+        stats.mean += delta / stats.count
+        stats.m2 += delta * (value - stats.mean)
+        stats.min_value = value if stats.min_value is None else min(stats.min_value, value)
+        stats.max_value = value if stats.max_value is None else max(stats.max_value, value)
+        return stats
+
+    async def replace_value(self, user_id: int, kind: str, old_value: float, new_value: float) -> UserMealStats:
+        """Заменить ранее учтённое значение (при перезаписи ФЧИ за день)"""
+        stats = await self._get_for_update(user_id, kind)
+        if stats is None or stats.count == 0:
+            return await self.add_value(user_id, kind, new_value)
+
+        old_value, new_value = float(old_value), float(new_value)
+        if stats.count == 1:
+            stats.mean, stats.m2 = new_value, 0.0
+            stats.min_value = stats.max_value = new_value
+            return stats
+
+        # Обратный шаг Уэлфорда для старого значения и обычный для нового.
+        # Минимум и максимум при удалении не восстановить, поэтому они лишь расширяются.
+        n = stats.count - 1
+        mean_without = (stats.count * stats.mean - old_value) / n
+        m2_without = max(stats.m2 - (old_value - mean_without) * (old_value - stats.mean), 0.0)
+        delta = new_value - mean_without
+        stats.mean = mean_without + delta / stats.count
+        stats.m2 = m2_without + delta * (new_value - stats.mean)
+        stats.min_value = min(stats.min_value, new_value)
+        stats.max_value = max(stats.max_value, new_value)
+        return stats
+
+    async def rebuild(self, user_id: int) -> None:
+        """Пересчитать статистику пользователя по всем записям (после массового импорта)"""
+        await self.session.execute(delete(UserMealStats).where(UserMealStats.user_id == user_id))
+
+        sources = [
+            (MealRecord, MealRecord.meal_type, MealRecord.uk_value),
+            (FCI, literal(FCI_STATS_KIND), FCI.value),
+        ]
+        for model, kind_column, value_column in sources:
+            aggregates = (
+                select(
+                    kind_column.label("kind"),
+                    func.count().label("count"),
+                    func.avg(value_column).label("mean"),
+                    func.min(value_column).label("min_value"),
+                    func.max(value_column).label("max_value"),
+                )
+                .where(model.user_id == user_id)
+                .group_by(kind_column)
+                .subquery()
+            )
+            # Сумма квадратов отклонений считается вторым проходом: так точнее и работает без var_pop
+            deviation = value_column - aggregates.c.mean
+            result = await self.session.execute(
+                select(aggregates, func.sum(deviation * deviation))
+                .select_from(model)
+                .join(aggregates, kind_column == aggregates.c.kind)
+                .where(model.user_id == user_id)
+                .group_by(*aggregates.c)
+            )
+            for row in result.all():
+                kind = row.kind.value if isinstance(row.kind, MealType) else row.kind
+                self.session.add(
+                    UserMealStats(
+                        user_id=user_id,
+                        kind=kind,
+                        count=row.count,
+                        mean=row.mean,
+                        m2=row[-1] or 0.0,
+                        min_value=row.min_value,
+                        max_value=row.max_value,
+                    )
+                )
+
+    async def get(self, user_id: int, kind: str) -> Optional[UserMealStats]:
+        result = await self.session.execute(
+            select(UserMealStats).where(and_(UserMealStats.user_id == user_id, UserMealStats.kind == kind))
+        )
+        return result.scalar_one_or_none()
+
+    async def get_all(self, user_id: int) -> dict[str, UserMealStats]:
+        result = await self.session.execute(select(UserMealStats).where(UserMealStats.user_id == user_id))
+        return {stats.kind: stats for stats in result.scalars().all()}
+
+
+class PopulationSketchRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get_all(self) -> dict[str, bytes]:
+        result = await self.session.execute(select(PopulationSketch.key, PopulationSketch.payload))
+        return {key: payload for key, payload in result.all()}
+
+    async def get_for_update(self, key: str) -> Optional[bytes]:
+        """Получить скетч с блокировкой строки до конца транзакции"""
+        result = await self.session.execute(
+            select(PopulationSketch.payload).where(PopulationSketch.key == key).with_for_update()
+        )
+        return result.scalar_one_or_none()
+
+    async def save(self, key: str, payload: bytes, count: int) -> None:
+        """Сохранить скетч (коммит делает вызывающий код)"""
+        sketch = await self.session.get(PopulationSketch, key)
+        if sketch is None:
+            self.session.add(PopulationSketch(key=key, payload=payload, count=count))
+        else:
+            sketch.payload = payload
+            sketch.count = count
+
+
+class CGMRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get_days(
+        self, user_id: int, start_day: date, end_day: date, for_update: bool = False
+    ) -> dict[date, CGMDay]:
+        """Получить сохранённые сутки показаний CGM за период"""
+        query = select(CGMDay).where(and_(CGMDay.user_id == user_id, CGMDay.day >= start_day, CGMDay.day <= end_day))
+        if for_update:
+            query = query.with_for_update()
+        result = await self.session.execute(query)
+        return {row.day: row for row in result.scalars().all()}
+
+    async def get_days_in(self, user_id: int, days: List[date]) -> dict[date, CGMDay]:
+        """Получить сохранённые сутки показаний CGM для перечисленных дат"""
+        result = await self.session.execute(
+            select(CGMDay).where(and_(CGMDay.user_id == user_id, CGMDay.day.in_(days)))
+        )
+        return {row.day: row for row in result.scalars().all()}
+
+    def put_day(self, user_id: int, day: date, readings: bytes, count: int, existing: Optional[CGMDay] = None) -> None:
+        """Записать сутки показаний (коммит делает вызывающий код)"""
+        if existing is None:
+            self.session.add(CGMDay(user_id=user_id, day=day, readings=readings, count=count))
+        else:
+            existing.readings = readings
+            existing.count = count
+
+    async def has_data(self, user_id: int) -> bool:
+        result = await self.session.execute(select(CGMDay.day).where(CGMDay.user_id == user_id).limit(1))
+        return result.first() is not None
+
+
+class ReminderRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def replace(
+        self, user_id: int, chat_id: int, kind: str, due_at: datetime, payload: Optional[str] = None
+    ) -> tuple[Reminder, Optional[int]]:
+        """Создать напоминание; прежнее напоминание того же типа удаляется. Возвращает (новое, id прежнего)"""
+        replaced = await self.delete_by_kind(user_id, kind, commit=False)
+        reminder = Reminder(user_id=user_id, chat_id=chat_id, kind=kind, due_at=due_at, payload=payload)
+        self.session.add(reminder)
+        await self.session.commit()
+        await self.session.refresh(reminder)
+        return reminder, replaced
+
+    async def delete_by_kind(self, user_id: int, kind: str, commit: bool = True) -> Optional[int]:
+        """Удалить напоминание пользователя заданного типа; возвращает его id"""
+        result = await self.session.execute(
+            delete(Reminder).where(and_(Reminder.user_id == user_id, Reminder.kind == kind)).returning(Reminder.id)
+        )
+        reminder_id = result.scalar_one_or_none()
+        if commit:
+            await self.session.commit()
+        return reminder_id
+
+    async def get_payload(self, reminder_id: int) -> Optional[str]:
+        result = await self.session.execute(select(Reminder.payload).where(Reminder.id == reminder_id))
+        return result.scalar_one_or_none()
+
+    async def delete_many(self, ids: List[int]) -> None:
+        await self.session.execute(delete(Reminder).where(Reminder.id.in_(ids)))
+        await self.session.commit()
+
+    async def get_batch(self, after_id: int, limit: int) -> List[Reminder]:
+        """Очередная порция напоминаний по возрастанию id (постраничная загрузка по ключу)"""
+        result = await self.session.execute(
+            select(Reminder).where(Reminder.id > after_id).order_by(Reminder.id).limit(limit)
+        )
+        return list(result.scalars().all())
+
+
+class JobCheckpointRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get(self, name: str) -> Optional[JobCheckpoint]:
+        return await self.session.get(JobCheckpoint, name)
+
+    async def create(self, name: str, payload: Optional[str] = None) -> JobCheckpoint:
+        checkpoint = JobCheckpoint(name=name, payload=payload, cursor=0, delivered=0, blocked=0, failed=0)
+        self.session.add(checkpoint)
+        await self.session.commit()
+        return checkpoint
+
+    async def advance(self, name: str, cursor: int, stats: dict[str, int], finished: bool = False) -> None:
+        """Сохранить курсор и счётчики доставки"""
+        checkpoint = await self.session.get(JobCheckpoint, name)
+        checkpoint.cursor = cursor
+        checkpoint.delivered = stats.get("delivered", 0)
+        checkpoint.blocked = stats.get("blocked", 0)
+        checkpoint.failed = stats.get("failed", 0)
+        if finished:
+            checkpoint.finished_at = datetime.now()
+        await self.session.commit()
+
+    async def get_unfinished(self, prefix: str) -> List[JobCheckpoint]:
+        result = await self.session.execute(
+            select(JobCheckpoint)
+            .where(and_(JobCheckpoint.name.startswith(prefix), JobCheckpoint.finished_at.is_(None)))
+            .order_by(JobCheckpoint.created_at)
+        )
+        return list(result.scalars().all())
+
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class JobRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def create(
+        self,
+        kind: str,
+        user_id: Optional[int],
+        chat_id: Optional[int],
+        payload: str,
+        priority: int = 0,
+        max_attempts: int = 3,
+    ) -> Optional[Job]:
+        """Поставить задачу в очередь; None, если у пользователя уже есть активная задача этого типа"""
+        job = Job(
+            kind=kind,
+            user_id=user_id,
+            chat_id=chat_id,
+            payload=payload,
+            priority=priority,
+            max_attempts=max_attempts,
+            status=JOB_QUEUED,
+            attempts=0,
+            run_after=datetime.now(timezone.utc),
+        )
+        self.session.add(job)
+        try:
+            await self.session.commit()
+        except IntegrityError:
+            # Уникальный частичный индекс uq_jobs_user_kind_active
+            await self.session.rollback()
+            return None
+        return job
+
+    async def claim(self, user_limit: int) -> Optional[Job]:
+        """
+        Забрать самую приоритетную готовую задачу. Строка блокируется с SKIP LOCKED, поэтому
+        параллельные воркеры берут разные задачи; задачи пользователя, у которого уже выполняется
+        user_limit задач, пропускаются. На SQLite FOR UPDATE не выводится, запрос остаётся атомарным.
+        """
+        now = datetime.now(timezone.utc)
+        running = aliased(Job)
+        user_running = (
+            select(func.count())
+            .where(and_(running.user_id == Job.user_id, running.status == JOB_RUNNING))
+            .scalar_subquery()
+        )
+        candidate = (
+            select(Job.id)
+            .where(
+                and_(
+                    Job.status == JOB_QUEUED,
+                    Job.run_after <= now,
+                    or_(Job.user_id.is_(None), user_running < user_limit),
+                )
+            )
+            .order_by(desc(Job.priority), Job.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        result = await self.session.execute(
+            update(Job)
+            .where(and_(Job.id == candidate, Job.status == JOB_QUEUED))
+            .values(status=JOB_RUNNING, attempts=Job.attempts + 1, locked_at=now)
+            .returning(Job)
+        )
+        job = result.scalar_one_or_none()
+        await self.session.commit()
+        return job
+
+    async def heartbeat(self, job_id: int) -> None:
+        await self.session.execute(update(Job).where(Job.id == job_id).values(locked_at=datetime.now(timezone.utc)))
+        await self.session.commit()
+
+    async def finish(self, job_id: int, status: str, error: Optional[str] = None) -> None:
+        await self.session.execute(
+            update(Job).where(Job.id == job_id).values(status=status, error=error, finished_at=datetime.now(timezone.utc))
+        )
+        await self.session.commit()
+
+    async def retry(self, job_id: int, run_after: datetime, error: str) -> None:
+        """Вернуть задачу в очередь с отсрочкой"""
+        await self.session.execute(
+            update(Job).where(Job.id == job_id).values(status=JOB_QUEUED, run_after=run_after, error=error, locked_at=None)
+        )
+        await self.session.commit()
+
+    async def requeue_stale(self, locked_before: datetime) -> int:
+        """Вернуть в очередь задачи воркеров, которые перестали подтверждать работу (процесс упал)"""
+        result = await self.session.execute(
+            update(Job)
+            .where(and_(Job.status == JOB_RUNNING, Job.locked_at < locked_before))
+            .values(status=JOB_QUEUED, locked_at=None)
+        )
+        await self.session.commit()
+        return result.rowcount
+
+    async def delete_finished(self, finished_before: datetime) -> None:
+        await self.session.execute(
+            delete(Job).where(and_(Job.status.in_([JOB_DONE, JOB_FAILED]), Job.finished_at < finished_before))
+        )
+        await self.session.commit()
+
+    async def has_active(self, user_id: int, kind: str) -> bool:
+        """Есть ли у пользователя задача этого типа в очереди или в работе"""
+        result = await self.session.execute(
+            select(Job.id)
+            .where(and_(Job.user_id == user_id, Job.kind == kind, Job.status.in_([JOB_QUEUED, JOB_RUNNING])))
+            .limit(1)
+        )
+        return result.first() is not None
+
+
+class FunnelRollupRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def add(
+        self, day: date, state: str, next_state: str, transitions: int, dwell_seconds: float, dwell_count: int, server_seconds: float
+    ) -> None:
+        """Прибавить накопленные переходы к строке за день (коммит делает вызывающий код)"""
+        result = await self.session.execute(
+            select(FunnelRollup)
+            .where(and_(FunnelRollup.day == day, FunnelRollup.state == state, FunnelRollup.next_state == next_state))
+            .with_for_update()
+        )
+        rollup = result.scalar_one_or_none()
+        if rollup is None:
+            self.session.add(
+                FunnelRollup(
+                    day=day,
+                    state=state,
+                    next_state=next_state,
+                    transitions=transitions,
+                    dwell_seconds=dwell_seconds,
+                    dwell_count=dwell_count,
+                    server_seconds=server_seconds,
+                )
+            )
+            # Сразу записываем строку, чтобы следующий add в этой же транзакции её нашёл
+            await self.session.flush()
+        else:
+            rollup.transitions += transitions
+            rollup.dwell_seconds += dwell_seconds
+            rollup.dwell_count += dwell_count
+            rollup.server_seconds += server_seconds
+
+    async def get_since(self, day: date) -> List[FunnelRollup]:
+        """Строки воронки начиная с дня day"""
+        result = await self.session.execute(select(FunnelRollup).where(FunnelRollup.day >= day))
+        return list(result.scalars().all())
@@ -1,9 +1,12 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from config.base import settings
+from db.instrumentation import instrument_engine
 
 # Используем сформированный URL для PostgreSQL
 database_url = settings.get_database_url()
-engine = create_async_engine(database_url, echo=settings.debug)
+# SQL-журнал в режиме отладки включает app.logging_setup (echo писал бы в поток вывода напрямую)
+engine = create_async_engine(database_url)
+instrument_engine(engine)
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
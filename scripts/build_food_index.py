@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Сборка индекса базы продуктов для быстрого поиска
+Запуск: python scripts/build_food_index.py [путь_к_csv] [путь_к_индексу]
+"""
+
+import sys
+import os
+import time
+
+# Добавляем корневую папку проекта в путь
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.food_index import FoodIndex
+
+
+def main():
+    data_path = sys.argv[1] if len(sys.argv) > 1 else "data/foods.csv"
+    index_path = sys.argv[2] if len(sys.argv) > 2 else "data/foods.idx"
+
+    started = time.perf_counter()
+    index = FoodIndex.from_csv(data_path)
+    index.save(index_path)
+    print(f"✅ Индекс собран: {len(index)} продуктов, {len(index.trigram_keys)} триграмм")
+    print(f"⏱️ Время сборки: {time.perf_counter() - started:.3f} с")
+
+    started = time.perf_counter()
+    FoodIndex.load(index_path)
+    print(f"⏱️ Время загрузки: {(time.perf_counter() - started) * 1000:.2f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Пакетный расчёт калорий (ОЭП) для когорты пациентов
+Запуск: python scripts/calories_batch.py patients.csv result.csv [--chunksize 200000]
+
+Входной файл (CSV или Parquet) с колонками:
+gender, age_years, age_months (для детей до года), weight_kg, height_cm,
+activity (sedentary/low/medium/high) или activity_coef
+"""
+
+import argparse
+import sys
+import os
+import time
+
+# Добавляем корневую папку проекта в путь
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.calories_batch import process_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный расчёт ОЭП")
+    parser.add_argument("input", help="CSV или Parquet с данными пациентов")
+    parser.add_argument("output", help="Файл результата (.csv или .parquet)")
+    parser.add_argument("--chunksize", type=int, default=200_000, help="Размер порции строк")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    total, failed = process_file(args.input, args.output, chunksize=args.chunksize)
+    elapsed = time.perf_counter() - started
+
+    print(f"✅ Обработано строк: {total} за {elapsed:.2f} с")
+    if failed:
+        print(f"⚠️ Строк с ошибками: {failed} (см. колонку error)")
+
+
+if __name__ == "__main__":
+    main()
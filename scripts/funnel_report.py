@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Отчёт по воронке сценариев FSM за последние дни (таблица funnel_rollups)
+Запуск: python scripts/funnel_report.py [--days 7] [--group MealStates]
+
+Для каждого состояния: сколько раз пользователи в нём отвечали, сколько из них — повторно в том же
+состоянии (ошибка ввода), сколько бросили или отменили сценарий, среднее время пользователя
+в состоянии и среднее время обработки ответа ботом. Сортировка — по суммарному времени пользователей.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from collections import defaultdict
+from datetime import date, timedelta
+
+# Добавляем корневую папку проекта в путь
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.funnel import ABANDONED, CANCELLED, NO_STATE
+from db.repository import FunnelRollupRepository
+from db.session import async_session, engine
+
+
+async def report(days: int, group: str | None) -> None:
+    async with async_session() as session:
+        rows = await FunnelRollupRepository(session).get_since(date.today() - timedelta(days=days - 1))
+
+    # состояние -> [ответы, повторы, брошено, отменено, время пользователей, ответы со временем, время обработки]
+    states: dict[str, list] = defaultdict(lambda: [0, 0, 0, 0, 0.0, 0, 0.0])
+    started: dict[str, int] = defaultdict(int)
+    for row in rows:
+        if group and not (row.state.startswith(f"{group}:") or row.next_state.startswith(f"{group}:")):
+            continue
+        if row.state == NO_STATE:
+            started[row.next_state] += row.transitions
+            continue
+        totals = states[row.state]
+        if row.next_state == ABANDONED:
+            totals[2] += row.transitions
+            continue
+        totals[0] += row.transitions
+        totals[1] += row.transitions if row.next_state == row.state else 0
+        totals[3] += row.transitions if row.next_state == CANCELLED else 0
+        totals[4] += row.dwell_seconds
+        totals[5] += row.dwell_count
+        totals[6] += row.server_seconds
+
+    if not states:
+        print("Данных воронки за период нет")
+        return
+
+    print(f"Воронка за {days} дн." + (f", сценарий {group}" if group else ""))
+    for state, count in sorted(started.items(), key=lambda item: -item[1]):
+        print(f"  начато в {state}: {count}")
+    print(f"\n{'состояние':<50} {'ответы':>7} {'повторы':>8} {'брошено':>8} {'отмена':>7} {'польз., с':>10} {'бот, мс':>8}")
+    for state, (replies, retries, abandoned, cancelled, dwell, dwell_count, server) in sorted(
+        states.items(), key=lambda item: -item[1][4]
+    ):
+        reached = replies + abandoned
+        abandon_rate = f"{abandoned / reached * 100:.0f}%" if reached else "-"
+        user_time = f"{dwell / dwell_count:.1f}" if dwell_count else "-"
+        server_time = f"{server / replies * 1000:.1f}" if replies else "-"
+        print(f"{state:<50} {replies:>7} {retries:>8} {abandon_rate:>8} {cancelled:>7} {user_time:>10} {server_time:>8}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Отчёт по воронке сценариев FSM")
+    parser.add_argument("--days", type=int, default=7, help="За сколько последних дней")
+    parser.add_argument("--group", help="Только один сценарий, например MealStates")
+    args = parser.parse_args()
+    try:
+        await report(args.days, args.group)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
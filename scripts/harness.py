@@ -0,0 +1,77 @@
+"""
+Общие части нагрузочного теста (loadtest.py) и воспроизведения записи (replay.py):
+сессия Bot без сети и отчёт по времени обработки.
+"""
+
+import itertools
+import statistics
+from collections import Counter
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, Message
+
+from app.metrics import update_db_queries, update_duration
+
+
+class RecordingSession(BaseSession):
+    """Сессия Bot без сети: считает вызовы API и возвращает правдоподобные ответы"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.calls[type(method).__name__] += 1
+        if method.__returning__ is Message:
+            chat_id = getattr(method, "chat_id", 0)
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=Chat(id=chat_id, type="private"),
+                text=getattr(method, "text", None),
+            ).as_(bot)
+        return True
+
+    async def stream_content(
+        self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30, chunk_size: int = 65536, raise_for_status: bool = True
+    ) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+def print_report(latencies: list[float], elapsed: float, errors: Counter, session: RecordingSession) -> None:
+    """Апдейты в секунду, перцентили времени обработки, ошибки, вызовы API и разбивка по обработчикам"""
+    count = len(latencies)
+    if not count:
+        print("\nАпдейтов не было")
+        return
+    cuts = statistics.quantiles(latencies, n=100) if count > 1 else latencies * 99
+    queries = sum(child.sum for child in update_db_queries._children.values())
+
+    print(f"\nАпдейтов: {count} за {elapsed:.2f} с — {count / elapsed:.1f} апдейтов/с")
+    print(f"Время обработки: p50 {cuts[49] * 1000:.1f} мс, p95 {cuts[94] * 1000:.1f} мс, p99 {cuts[98] * 1000:.1f} мс")
+    print(f"SQL-запросов на апдейт: {queries / count:.2f}")
+    if errors:
+        print(f"Ошибки: {dict(errors)}")
+    print("\nВызовы Bot API:")
+    for name, value in session.calls.most_common():
+        print(f"  {name}: {value}")
+
+    print("\nПо обработчикам:")
+    print(f"  {'обработчик':<50} {'апдейтов':>9} {'ср. мс':>8} {'запросов':>9}")
+    per_handler: dict[tuple[str, str], list] = {}
+    for (router, handler, _state), child in update_duration._children.items():
+        entry = per_handler.setdefault((router, handler), [0, 0.0])
+        entry[0] += sum(child.counts)
+        entry[1] += child.sum
+    for (router, handler), (updates, duration) in sorted(per_handler.items(), key=lambda item: -item[1][1]):
+        db = update_db_queries._children.get((router, handler))
+        per_update = db.sum / updates if db else 0
+        print(f"  {router + '.' + handler:<50} {updates:>9} {duration / updates * 1000:>8.1f} {per_update:>9.1f}")
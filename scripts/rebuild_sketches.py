@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Пересборка квантильных скетчей ФЧИ и УК по всем данным в БД
+Запуск: python scripts/rebuild_sketches.py
+
+Нужна один раз после добавления скетчей (или если скетчи повреждены);
+дальше они обновляются при каждой записи.
+"""
+
+import asyncio
+import sys
+import os
+
+# Добавляем корневую папку проекта в путь
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, delete
+from app.quantiles import KLLSketch, FCI_SKETCH_KEY, uk_sketch_key
+from db.models import FCI, MealRecord, PopulationSketch, MealType
+from db.repository import PopulationSketchRepository
+from db.session import async_session, engine
+
+
+async def rebuild():
+    sketches: dict[str, KLLSketch] = {}
+
+    async with async_session() as session:
+        # Читаем потоково, не загружая таблицы в память целиком
+        fci_sketch = sketches.setdefault(FCI_SKETCH_KEY, KLLSketch())
+        result = await session.stream(select(FCI.value).execution_options(yield_per=10_000))
+        async for value in result.scalars():
+            fci_sketch.update(value)
+
+        result = await session.stream(
+            select(MealRecord.meal_type, MealRecord.uk_value).execution_options(yield_per=10_000)
+        )
+        async for meal_type, uk_value in result:
+            key = uk_sketch_key(MealType(meal_type).value)
+            sketches.setdefault(key, KLLSketch()).update(uk_value)
+
+        await session.execute(delete(PopulationSketch))
+        repo = PopulationSketchRepository(session)
+        for key, sketch in sketches.items():
+            await repo.save(key, sketch.to_bytes(), sketch.n)
+            print(f"✅ {key}: {sketch.n} значений")
+        await session.commit()
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(rebuild())
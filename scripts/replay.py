@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Воспроизведение записанных апдейтов (RECORD_UPDATES_PATH) через настоящий диспетчер без Telegram
+Запуск: python scripts/replay.py updates.jsonl.gz [--speed 1 | --speed 10 | --speed 0] [--database-url URL]
+
+--speed 1 — в реальном темпе записи, N — в N раз быстрее, 0 — без пауз (максимальная скорость).
+Апдейты одного пользователя всегда обрабатываются по порядку, разные пользователи — параллельно,
+как при обычном polling. Без --database-url используется временная база SQLite (нужен aiosqlite);
+база начинается пустой, поэтому обработчики, зависящие от истории пользователя, могут идти
+по другим веткам, чем в момент записи.
+
+В конце печатается тот же отчёт, что у scripts/loadtest.py, и отставание от расписания записи.
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter, defaultdict
+
+# Добавляем корневую папку проекта в путь
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов")
+    parser.add_argument("path", help="Файл записи (gzip, JSON построчно)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Множитель скорости; 0 — без пауз")
+    parser.add_argument("--limit", type=int, help="Воспроизвести только первые N апдейтов")
+    parser.add_argument("--database-url", help="URL базы (по умолчанию временная SQLite)")
+    parser.add_argument("--verbose", action="store_true", help="Показывать журнал бота")
+    return parser.parse_args()
+
+
+args = parse_args()
+# База и токен задаются до импорта модулей бота: движок создаётся при импорте db.session
+os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/replay.db"
+os.environ.setdefault("BOT_TOKEN", "123456:replay")
+os.environ["DEBUG"] = "False"
+os.environ["RECORD_UPDATES_PATH"] = ""
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from bot import create_dispatcher, create_tables
+from db.session import engine
+from harness import RecordingSession, print_report
+
+
+def read_recording(path: str, limit: int | None = None) -> list[tuple[float, dict]]:
+    """Строки записи; оборванный последний блок (процесс был убит во время записи) пропускается"""
+    records = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records.append((record["ts"], record["update"]))
+                if limit is not None and len(records) >= limit:
+                    break
+        except (EOFError, zlib.error, gzip.BadGzipFile):
+            print(f"⚠️ Запись обрывается после {len(records)} апдейтов")
+    records.sort(key=lambda record: record[0])
+    return records
+
+
+def _user_key(update: dict) -> int:
+    for field in ("message", "edited_message", "callback_query", "inline_query", "my_chat_member"):
+        event = update.get(field)
+        if event and "from" in event:
+            return event["from"]["id"]
+    return 0
+
+
+class Replayer:
+    def __init__(self, records: list[tuple[float, dict]], speed: float):
+        self.records = records
+        self.speed = speed
+        self.session = RecordingSession()
+        self.bot = Bot(token=os.environ["BOT_TOKEN"], session=self.session)
+        self.dp = create_dispatcher()
+        self.latencies: list[float] = []
+        self.lags: list[float] = []
+        self.errors: Counter = Counter()
+
+    async def _run_user(self, updates: list[tuple[float, dict]], origin: float, started: float) -> None:
+        for ts, data in updates:
+            if self.speed > 0:
+                due = started + (ts - origin) / self.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.lags.append(max(0.0, time.perf_counter() - due))
+            update = Update.model_validate(data, context={"bot": self.bot})
+            start = time.perf_counter()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                self.errors[type(e).__name__] += 1
+            finally:
+                self.latencies.append(time.perf_counter() - start)
+
+    async def run(self) -> float:
+        per_user: dict[int, list[tuple[float, dict]]] = defaultdict(list)
+        for ts, data in self.records:
+            per_user[_user_key(data)].append((ts, data))
+        origin = self.records[0][0]
+        started = time.perf_counter()
+        await asyncio.gather(*(self._run_user(updates, origin, started) for updates in per_user.values()))
+        return time.perf_counter() - started
+
+
+async def main() -> int:
+    logging.getLogger().setLevel(logging.WARNING if args.verbose else logging.ERROR)
+    records = read_recording(args.path, args.limit)
+    if not records:
+        print("❌ В записи нет апдейтов")
+        return 1
+
+    span = records[-1][0] - records[0][0]
+    mode = "без пауз" if args.speed <= 0 else f"×{args.speed:g}"
+    print(f"Апдейтов: {len(records)} за {span:.0f} с записи, воспроизведение {mode}")
+
+    await create_tables()
+    replayer = Replayer(records, args.speed)
+    try:
+        elapsed = await replayer.run()
+        print_report(replayer.latencies, elapsed, replayer.errors, replayer.session)
+        if replayer.lags:
+            cuts = statistics.quantiles(replayer.lags, n=100) if len(replayer.lags) > 1 else replayer.lags * 99
+            print(f"\nОтставание от расписания: p50 {cuts[49] * 1000:.1f} мс, p99 {cuts[98] * 1000:.1f} мс")
+    finally:
+        await replayer.bot.session.close()
+        await engine.dispose()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Отправка итогов недели отдельным процессом, чтобы не нагружать бота
+Запуск: python scripts/send_weekly_digest.py [--week-start 2026-10-12]
+
+Без --week-start отправляются итоги за последнюю завершённую неделю. Прерванная
+отправка продолжается с сохранённого курсора. Чтобы бот не отправлял итоги сам,
+укажите WEEKLY_DIGEST_IN_BOT=False.
+"""
+
+import argparse
+import asyncio
+import sys
+import os
+from datetime import date, datetime
+
+# Добавляем корневую папку проекта в путь
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot
+from app.digest import get_digest_week, send_weekly_digest
+from app.utils import get_user_zone
+from config.base import settings
+from db.session import async_session, engine
+
+
+async def send(week_start: date | None):
+    if week_start is None:
+        week_start, _ = get_digest_week(datetime.now(get_user_zone(None)))
+
+    bot = Bot(token=settings.bot_token)
+    try:
+        stats = await send_weekly_digest(bot, async_session, week_start)
+    finally:
+        await bot.session.close()
+        await engine.dispose()
+
+    print(f"✅ Итоги недели с {week_start}: доставлено {stats['delivered']}, "
+          f"заблокировали бота {stats['blocked']}, ошибок {stats['failed']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отправка итогов недели")
+    parser.add_argument("--week-start", type=date.fromisoformat, help="Первый день недели (ГГГГ-ММ-ДД)")
+    args = parser.parse_args()
+    asyncio.run(send(args.week_start))
+
+
+if __name__ == "__main__":
+    main()